@@ -0,0 +1,48 @@
+"""
+Block-list lookups
+
+A user's own `blockedIds` arrive with the user document that authentication already
+loads. The reverse direction (who has blocked them) needs a query, so it is cached per
+user for BLOCK_CACHE_TTL seconds and dropped in every worker whenever a block changes.
+"""
+
+import os
+from typing import FrozenSet
+
+from bson import ObjectId
+
+from app.cache import TTLCache
+from app.database import get_users_collection
+from app.invalidation import invalidation_bus
+from app.schemas.user import User
+
+blocked_by_cache = TTLCache(float(os.getenv("BLOCK_CACHE_TTL", 60)), max_entries=10000)
+
+async def get_blocked_by(user_id: str) -> FrozenSet[ObjectId]:
+    """IDs of the users who have blocked this user"""
+    blocked_by = blocked_by_cache.get(user_id)
+    if blocked_by is None:
+        users_collection = await get_users_collection()
+        blocked_by = frozenset([
+            user["_id"] async for user in users_collection.find({"blockedIds": ObjectId(user_id)}, {"_id": 1})
+        ])
+        blocked_by_cache.set(user_id, blocked_by)
+    return blocked_by
+
+async def get_block_set(user: User) -> FrozenSet[ObjectId]:
+    """Users hidden from this user in either direction"""
+    blocked = frozenset(ObjectId(blocked_id) for blocked_id in user.blocked_ids)
+    return blocked | await get_blocked_by(user.id)
+
+def _drop_block_sets(user_ids) -> None:
+    # An invalidation without user IDs means the affected users are unknown
+    if not user_ids:
+        blocked_by_cache.invalidate()
+    for user_id in user_ids:
+        blocked_by_cache.invalidate(user_id)
+
+invalidation_bus.subscribe("blocks", _drop_block_sets)
+
+def invalidate_block_cache(*user_ids: str) -> None:
+    """Forget cached block sets after a block or unblock; with no IDs, forget all of them"""
+    invalidation_bus.publish("blocks", *user_ids)
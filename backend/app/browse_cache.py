@@ -0,0 +1,61 @@
+"""
+Browse page cache
+
+Most browse traffic is a handful of hot queries: the default sort, category pages and
+their first few pages. Finished pages of those queries are kept per worker in an LRU,
+keyed by the canonical filter, sort and page together with the catalog version. Every
+write that can change what browse shows (listing writes, purchases, ratings, moderation)
+bumps the version, which makes all cached pages unreachable at once. The bump is
+published on the invalidation bus so the other workers drop their pages too; entries
+also expire after LISTING_PAGE_CACHE_TTL seconds in case a message is lost.
+"""
+
+import os
+from typing import Hashable, List, Optional, Tuple
+
+from app.cache import LRUCache
+from app.invalidation import invalidation_bus
+
+LISTING_PAGE_CACHE_SIZE = int(os.getenv("LISTING_PAGE_CACHE_SIZE", 2000))
+LISTING_PAGE_CACHE_TTL = float(os.getenv("LISTING_PAGE_CACHE_TTL", 30))
+LISTING_PAGE_CACHE_MAX_PAGE = int(os.getenv("LISTING_PAGE_CACHE_MAX_PAGE", 3))
+
+def browse_filter_key(query: dict) -> tuple:
+    """Hashable, order-independent form of a browse query"""
+    def normalize(value):
+        if isinstance(value, dict):
+            return tuple(sorted((key, normalize(item)) for key, item in value.items()))
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return tuple(sorted((normalize(item) for item in value), key=repr))
+        return getattr(value, "value", value)
+    return normalize(query)
+
+class BrowseCache:
+    def __init__(self, max_entries: int, ttl_seconds: float, max_page: int):
+        self.version = 0
+        self.max_page = max_page
+        self.pages = LRUCache(max_entries, ttl_seconds)
+
+    def page_key(self, query: dict, sort: List[Tuple[str, int]], page: int, per_page: int) -> Hashable:
+        return (self.version, browse_filter_key(query), tuple(sort), page, per_page)
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        return self.pages.get(key)
+
+    def set(self, key: Hashable, page: dict) -> None:
+        # A write may have bumped the version while this page was being built
+        if key[0] == self.version:
+            self.pages.set(key, page)
+
+    def bump(self) -> int:
+        """Start a new catalog version; pages cached under older versions are dropped"""
+        self.version += 1
+        self.pages.invalidate()
+        return self.version
+
+browse_cache = BrowseCache(LISTING_PAGE_CACHE_SIZE, LISTING_PAGE_CACHE_TTL, LISTING_PAGE_CACHE_MAX_PAGE)
+invalidation_bus.subscribe("catalog", lambda keys: browse_cache.bump())
+
+def bump_catalog_version() -> None:
+    """Call after any write that changes what listing browse returns, in this and every other worker"""
+    invalidation_bus.publish("catalog")
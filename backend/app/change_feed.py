@@ -0,0 +1,345 @@
+"""
+Derived data maintenance from database changes
+
+The routers keep counters and caches current for the writes they make, but writes from
+scripts, the shell or other services bypass them. The change feed follows `products`,
+`ratings`, `users` and `messages` and turns each change into the same follow-up work:
+cache invalidations at once, and deduplicated rebuild jobs (seller stats, star
+histograms, reputation, profile copies) a few seconds later, so a burst of changes to
+one seller or listing is recomputed once. Rating and listing writes that the API already
+counted into seller stats and star histograms stamp `countedAt` with their `updatedAt`
+and are skipped; anything else the feed triggers is a recomputation from the source
+collections, so a write it sees twice is harmless.
+
+On a replica set each collection is followed with a change stream whose resume token is
+stored in `changeFeeds`, so a restart continues where the last consumer stopped. On a
+standalone server (no change streams) the collections are polled instead, on
+`updatedAt` or, for messages, on their time-ordered `_id`; polling cannot see deletes.
+Only one worker follows a given collection at a time, holding a lease in the same
+document.
+"""
+
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from app.browse_cache import bump_catalog_version
+from app.blocks import invalidate_block_cache
+from app.database import get_database
+from app.jobs import enqueue_job
+from app.message_search import MessageSearch
+from app.models.user import UserModel
+
+CHANGE_FEED_MODE = os.getenv("CHANGE_FEED_MODE", "auto")
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", 5))
+CHANGE_FEED_JOB_DELAY = float(os.getenv("CHANGE_FEED_JOB_DELAY", 5))
+
+# Change stream errors after which the stored resume token can't be used again
+RESUME_TOKEN_LOST_CODES = {260, 280, 286}
+
+# Fields whose changes don't affect anything derived from products
+PRODUCT_COUNTER_FIELDS = {"views"}
+SELLER_STATS_PRODUCT_FIELDS = {"sellerId", "isSold", "isHidden"}
+PROFILE_FIELDS = {"fullName", "email"}
+
+# A change: {"operation": "upsert" | "delete", "id", "document" (None if unknown), "fields" (None if unknown)}
+ChangeHandler = Callable[[Any, Dict[str, Any]], Awaitable[None]]
+CHANGE_HANDLERS: Dict[str, ChangeHandler] = {}
+# Field polled for changes when change streams are unavailable
+POLL_FIELDS: Dict[str, str] = {}
+# Stages applied by the server to a collection's change stream, before events reach us
+STREAM_PIPELINES: Dict[str, List[dict]] = {}
+
+def change_handler(collection_name: str, poll_field: str = "updatedAt", stream_pipeline: Optional[List[dict]] = None):
+    """Register a coroutine as the handler for changes to a collection"""
+    def register(func: ChangeHandler) -> ChangeHandler:
+        CHANGE_HANDLERS[collection_name] = func
+        POLL_FIELDS[collection_name] = poll_field
+        STREAM_PIPELINES[collection_name] = stream_pipeline or []
+        return func
+    return register
+
+def skip_updates_only_to(fields) -> List[dict]:
+    """A change stream stage dropping updates that set nothing but the given top-level fields"""
+    other_updated_fields = {"$filter": {
+        "input": {"$objectToArray": "$updateDescription.updatedFields"},
+        "as": "field",
+        "cond": {"$eq": [{"$in": ["$$field.k", sorted(fields)]}, False]},
+    }}
+    # $or stops at the first true operand, so the update fields are only read for updates
+    return [{"$match": {"$expr": {"$or": [
+        {"$ne": ["$operationType", "update"]},
+        {"$gt": [{"$size": {"$ifNull": ["$updateDescription.removedFields", []]}}, 0]},
+        {"$gt": [{"$size": other_updated_fields}, 0]},
+    ]}}}]
+
+def counted_by_api(change: Dict[str, Any]) -> bool:
+    """Whether the routers already applied this write to the data derived from it
+
+    An update lists countedAt among its changed fields; an inserted or polled document
+    still carries countedAt equal to updatedAt when the API made its latest write.
+    """
+    if change["fields"] is not None:
+        return "countedAt" in change["fields"]
+    document = change["document"] or {}
+    return document.get("countedAt") is not None and document.get("countedAt") == document.get("updatedAt")
+
+def touches(change: Dict[str, Any], fields) -> bool:
+    """Whether a change may have modified any of the fields"""
+    return change["fields"] is None or bool(change["fields"] & set(fields))
+
+async def enqueue_soon(job_type: str, payload: Dict[str, Any], key: str) -> None:
+    """Queue a rebuild shortly, folding it into one already waiting for the same key"""
+    await enqueue_job(
+        job_type,
+        payload,
+        run_at=datetime.utcnow() + timedelta(seconds=CHANGE_FEED_JOB_DELAY),
+        dedupe_key=f"{job_type}:{key}"
+    )
+
+# A view is counted on every listing read; the server drops those events instead of sending them
+@change_handler("products", stream_pipeline=skip_updates_only_to(PRODUCT_COUNTER_FIELDS))
+async def products_changed(database, change: Dict[str, Any]) -> None:
+    if change["fields"] is not None and change["fields"] <= PRODUCT_COUNTER_FIELDS:
+        return
+    # The routers already bumped the catalog and moved the seller's stats for their writes
+    if counted_by_api(change):
+        return
+    # Browse pages, facets, home page and category stats
+    bump_catalog_version()
+    document = change["document"]
+    if document and document.get("sellerId") and touches(change, SELLER_STATS_PRODUCT_FIELDS):
+        seller_id = str(document["sellerId"])
+        await enqueue_soon("rebuild_seller_stats", {"seller_id": seller_id}, seller_id)
+
+@change_handler("ratings")
+async def ratings_changed(database, change: Dict[str, Any]) -> None:
+    document = change["document"]
+    # A deleted rating's listing is unknown here; the API and jobs that delete ratings
+    # update the counters themselves
+    if not document or not touches(change, {"rating", "listingId"}) or counted_by_api(change):
+        return
+    listing_id = str(document["listingId"])
+    await enqueue_soon("rebuild_rating_stars", {"listing_id": listing_id}, listing_id)
+
+    seller_id = document.get("sellerId")
+    if seller_id is None:
+        listing = await database.products.find_one({"_id": document["listingId"]}, {"sellerId": 1})
+        seller_id = listing.get("sellerId") if listing else None
+    if seller_id:
+        # Reputation is derived from the stats and rebuilt with them
+        await enqueue_soon("rebuild_seller_stats", {"seller_id": str(seller_id)}, str(seller_id))
+
+@change_handler("users")
+async def users_changed(database, change: Dict[str, Any]) -> None:
+    if change["operation"] == "delete":
+        return
+    user = change["document"]
+    if user is None:
+        return
+    blocked_ids = [str(blocked_id) for blocked_id in user.get("blockedIds", [])]
+    if blocked_ids and touches(change, {"blockedIds"}):
+        # Users still on the list; someone unblocked outside the API waits out BLOCK_CACHE_TTL
+        invalidate_block_cache(*blocked_ids)
+    # Polling can't tell which fields changed, so compare with the copies instead
+    if touches(change, PROFILE_FIELDS) and (change["fields"] is not None or await UserModel.profile_copies_stale(database, user)):
+        user_id = str(change["id"])
+        await enqueue_soon("propagate_user_profile", {"user_id": user_id}, user_id)
+
+@change_handler("messages", poll_field="_id")
+async def messages_changed(database, change: Dict[str, Any]) -> None:
+    # Deletes are left alone: archiving and bucketing move messages out of `messages` while
+    # they stay searchable, and deleting a chat or an account removes its entries itself
+    if change["operation"] == "delete":
+        return
+    message = change["document"]
+    if not message or change["fields"] is not None:
+        return
+    chat = await database.chats.find_one({"_id": message["chatId"]}, {"participantAId": 1, "participantBId": 1})
+    if chat:
+        await MessageSearch.index_message(message, [chat["participantAId"], chat["participantBId"]])
+
+def stream_change(event: dict) -> Optional[Dict[str, Any]]:
+    """Normalize a change stream event, or None for events that aren't document changes"""
+    operation = event["operationType"]
+    if operation not in ("insert", "update", "replace", "delete"):
+        return None
+    fields = None
+    if operation == "update":
+        description = event.get("updateDescription") or {}
+        fields = {name.split(".")[0] for name in description.get("updatedFields", {})}
+        fields |= {name.split(".")[0] for name in description.get("removedFields", [])}
+    return {
+        "operation": "delete" if operation == "delete" else "upsert",
+        "id": event["documentKey"]["_id"],
+        "document": event.get("fullDocument"),
+        "fields": fields,
+    }
+
+async def supports_change_streams(database) -> bool:
+    """Change streams need a replica set or a sharded cluster"""
+    hello = await database.command("hello")
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+class ChangeFeed:
+    """Follows the watched collections on asyncio tasks inside the API process"""
+
+    def __init__(self, lease_seconds: float = 30.0, poll_interval: float = CHANGE_FEED_POLL_INTERVAL,
+                 poll_lag: float = 2.0, batch_size: int = 500):
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        # Polling stays this far behind the clock so writes stamped just before a poll
+        # but committed just after it are not skipped
+        self.poll_lag = poll_lag
+        self.batch_size = batch_size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.mode: Optional[str] = None
+        self._tasks = []
+
+    async def start(self) -> None:
+        if CHANGE_FEED_MODE == "off":
+            return
+        database = await get_database()
+        self.mode = CHANGE_FEED_MODE
+        if self.mode == "auto":
+            self.mode = "stream" if await supports_change_streams(database) else "poll"
+        if self.mode == "poll":
+            # Only polling reads by timestamp, so only polling deployments pay for these indexes
+            for name, field in POLL_FIELDS.items():
+                if field != "_id":
+                    await database[name].create_index([(field, 1), ("_id", 1)])
+        print(f"Change feed following {', '.join(CHANGE_HANDLERS)} by {self.mode}")
+        self._tasks = [asyncio.create_task(self._run(name)) for name in CHANGE_HANDLERS]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.mode:
+            # Let another worker take over without waiting for the leases to expire
+            database = await get_database()
+            await database.changeFeeds.update_many(
+                {"owner": self.worker_id}, {"$set": {"owner": None, "leaseExpiresAt": datetime.utcnow()}}
+            )
+
+    async def _run(self, name: str) -> None:
+        while True:
+            try:
+                database = await get_database()
+                if await self._acquire(database, name):
+                    if self.mode == "stream":
+                        await self._follow_stream(database, name)
+                    else:
+                        await self._follow_polling(database, name)
+                else:
+                    await asyncio.sleep(self.lease_seconds / 2)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Change feed for {name} failed: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _acquire(self, database, name: str) -> bool:
+        """Take or renew the lease on following a collection"""
+        now = datetime.utcnow()
+        try:
+            await database.changeFeeds.find_one_and_update(
+                {"_id": name, "$or": [{"owner": self.worker_id}, {"owner": None}, {"leaseExpiresAt": {"$lt": now}}]},
+                {"$set": {"owner": self.worker_id, "leaseExpiresAt": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return True
+        except DuplicateKeyError:
+            # Another worker holds it
+            return False
+
+    async def _checkpoint(self, database, name: str, position: Dict[str, Any]) -> bool:
+        """Store how far the collection has been followed and renew the lease; False if it was lost"""
+        now = datetime.utcnow()
+        result = await database.changeFeeds.update_one(
+            {"_id": name, "owner": self.worker_id},
+            {"$set": {**position, "leaseExpiresAt": now + timedelta(seconds=self.lease_seconds)}}
+        )
+        return result.matched_count == 1
+
+    async def _dispatch(self, database, name: str, change: Dict[str, Any]) -> None:
+        try:
+            await CHANGE_HANDLERS[name](database, change)
+        except Exception as e:
+            # Derived data stays repairable with the maintenance rebuild commands
+            print(f"Change feed handler for {name} failed on {change['id']}: {e}")
+
+    async def _follow_stream(self, database, name: str) -> None:
+        state = await database.changeFeeds.find_one({"_id": name}) or {}
+        token = state.get("resumeToken")
+        renew_at = asyncio.get_running_loop().time() + self.lease_seconds / 3
+        try:
+            async with database[name].watch(
+                STREAM_PIPELINES[name], full_document="updateLookup", resume_after=token, max_await_time_ms=1000
+            ) as stream:
+                while True:
+                    event = await stream.try_next()
+                    if event is not None and event["operationType"] == "invalidate":
+                        # The collection was dropped or renamed; start over from now
+                        await self._checkpoint(database, name, {"resumeToken": None})
+                        return
+                    if event is not None:
+                        change = stream_change(event)
+                        if change:
+                            await self._dispatch(database, name, change)
+                    if event is not None or asyncio.get_running_loop().time() >= renew_at:
+                        token = stream.resume_token
+                        if not await self._checkpoint(database, name, {"resumeToken": token}):
+                            return
+                        renew_at = asyncio.get_running_loop().time() + self.lease_seconds / 3
+        except OperationFailure as e:
+            if token is None or e.code not in RESUME_TOKEN_LOST_CODES:
+                raise
+            print(f"Change stream for {name} can't resume ({e}); continuing from now")
+            await self._checkpoint(database, name, {"resumeToken": None})
+
+    async def _follow_polling(self, database, name: str) -> None:
+        field = POLL_FIELDS[name]
+        state = await database.changeFeeds.find_one({"_id": name}) or {}
+        since = state.get("polledUntil")
+        last_id = state.get("polledId")
+        if since is None or last_id is None:
+            # Nothing to catch up on the first time; the rebuild commands cover older data
+            since = datetime.utcnow() - timedelta(seconds=self.poll_lag)
+            last_id = ObjectId.from_datetime(since)
+
+        while True:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.poll_lag)
+            if field == "_id":
+                query = {"_id": {"$gt": last_id, "$lte": ObjectId.from_datetime(cutoff)}}
+                sort = [("_id", 1)]
+            else:
+                query = {
+                    "$or": [{field: {"$gt": since}}, {field: since, "_id": {"$gt": last_id}}],
+                    field: {"$lte": cutoff},
+                }
+                sort = [(field, 1), ("_id", 1)]
+            documents = await database[name].find(query).sort(sort).limit(self.batch_size).to_list(self.batch_size)
+
+            for document in documents:
+                await self._dispatch(database, name, {
+                    "operation": "upsert", "id": document["_id"], "document": document, "fields": None
+                })
+                last_id = document["_id"]
+                if field != "_id":
+                    since = document[field]
+
+            if not await self._checkpoint(database, name, {"polledUntil": since, "polledId": last_id}):
+                return
+            if len(documents) < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+change_feed = ChangeFeed()
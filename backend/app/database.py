@@ -1,5 +1,7 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
+from typing import Set
 import os
 
 # Load environment variables
@@ -46,14 +48,119 @@ async def get_messages_collection():
     database = await get_database()
     return database.messages
 
+async def get_message_buckets_collection():
+    database = await get_database()
+    return database.messageBuckets
+
+async def get_message_archive_collection():
+    database = await get_database()
+    return database.messageArchive
+
+async def get_message_search_collection():
+    database = await get_database()
+    return database.messageSearch
+
 async def get_reports_collection():
     database = await get_database()
     return database.reports
 
+async def get_moderation_queue_collection():
+    database = await get_database()
+    return database.moderationQueue
+
 async def get_featured_products_collection():
     database = await get_database()
     return database.featuredProducts
 
 async def get_ratings_collection():
     database = await get_database()
-    return database.ratings
\ No newline at end of file
+    return database.ratings
+
+async def get_transactions_collection():
+    database = await get_database()
+    return database.transactions
+
+async def get_analytics_collection():
+    database = await get_database()
+    return database.analyticsRollups
+
+async def get_seller_stats_collection():
+    database = await get_database()
+    return database.sellerStats
+
+async def get_jobs_collection():
+    database = await get_database()
+    return database.jobs
+
+# Unique indexes that existing duplicates kept from being built; the writes relying on
+# them look for a duplicate first until the fix command has run and the API restarted
+missing_unique_indexes: Set[str] = set()
+
+def _unique_index_name(collection_name: str, fields) -> str:
+    return f"{collection_name}:{','.join(fields)}"
+
+def unique_index_missing(collection_name: str, *fields: str) -> bool:
+    """Whether the unique index on these fields could not be created at startup"""
+    return _unique_index_name(collection_name, fields) in missing_unique_indexes
+
+async def ensure_unique_index(collection, keys, fix_command: str, **kwargs):
+    """Create a unique index, reporting (not raising) when existing duplicates prevent it"""
+    name = _unique_index_name(collection.name, [field for field, _ in keys])
+    try:
+        await collection.create_index(keys, unique=True, **kwargs)
+        missing_unique_indexes.discard(name)
+    except OperationFailure as e:
+        missing_unique_indexes.add(name)
+        print(f"Could not create unique index on {collection.name} {keys}: {e}")
+        print(f"Run `python maintenance.py {fix_command}` and restart; until then duplicates are checked for before writing")
+
+async def ensure_indexes():
+    """Create the indexes the API relies on (no-op for indexes that already exist)"""
+    database = await get_database()
+    await database.chats.create_index(
+        "pairKey",
+        unique=True,
+        partialFilterExpression={"pairKey": {"$type": "string"}}
+    )
+    await database.chats.create_index([("participantIds", 1), ("lastMessageAt", -1)])
+    await database.messages.create_index([("chatId", 1), ("createdAt", 1)])
+    await database.messageBuckets.create_index([("chatId", 1), ("startAt", 1)])
+    # At most one open bucket per chat and period, so concurrent senders append to the same one
+    await database.messageBuckets.create_index(
+        [("chatId", 1), ("period", 1)],
+        unique=True,
+        partialFilterExpression={"full": False}
+    )
+    await database.messageArchive.create_index([("chatId", 1), ("startAt", 1)])
+    await database.messageSearch.create_index([("userId", 1), ("text", "text")])
+    await database.messageSearch.create_index([("messageId", 1), ("userId", 1)], unique=True)
+    await database.messageSearch.create_index([("chatId", 1)])
+    await database.users.create_index([("blockedIds", 1)])
+    await database.products.create_index([("isHidden", 1), ("sellerReputation", -1), ("createdAt", -1)])
+    # A user's listings and ratings, for profile propagation and its staleness check
+    await database.products.create_index([("sellerId", 1)])
+    await database.ratings.create_index([("userId", 1)])
+    # Case-insensitive uniqueness. Users created before the keys existed get them once the
+    # indexes are in place, so a key clashing with another user's is refused, not indexed
+    for key in ("emailKey", "userNameKey"):
+        await ensure_unique_index(
+            database.users, [(key, 1)], "backfill-user-keys",
+            partialFilterExpression={key: {"$type": "string"}}
+        )
+    from app.models.user import UserModel
+    for user_id, field, value in await UserModel.backfill_keys(database.users):
+        print(f"User {user_id} left without {field}: {value!r} is already taken")
+    await database.moderationQueue.create_index([("status", 1), ("priority", -1), ("_id", 1)])
+    # One report per user and target, one rating per user and listing; inserts rely on these
+    await ensure_unique_index(database.reports, [("reporterId", 1), ("targetId", 1), ("type", 1)], "dedupe-reports-ratings")
+    await ensure_unique_index(database.ratings, [("listingId", 1), ("userId", 1)], "dedupe-reports-ratings")
+    # Seller rating totals are summed per seller from this index; legacy ratings match sellerId null
+    await database.ratings.create_index([("sellerId", 1), ("rating", 1)])
+    await database.analyticsRollups.create_index([("granularity", 1), ("bucketStart", 1)])
+    await database.transactions.create_index([("createdAt", 1)])
+    await database.jobs.create_index([("status", 1), ("runAt", 1)])
+    # At most one pending job per dedupe key; enqueue_job relies on this when workers race
+    await ensure_unique_index(
+        database.jobs, [("dedupeKey", 1)], "dedupe-pending-jobs",
+        partialFilterExpression={"status": "pending", "dedupeKey": {"$type": "string"}}
+    )
@@ -0,0 +1,186 @@
+"""
+Cross-worker cache invalidation
+
+Production runs several gunicorn workers, each with its own in-process caches. A write
+handled by one worker publishes an invalidation (a topic such as "catalog" or "blocks"
+plus the affected keys) on this bus. The publishing worker applies it at once, and the
+transport delivers it to every other worker, whose subscribed caches drop the entries.
+
+Transports (CACHE_INVALIDATION_TRANSPORT):
+- mongo: a small capped collection, `cacheInvalidations`, tailed by every worker in the
+  server's insertion order. Workers generate their own `_id`s, which don't sort in that
+  order, so messages are stamped with the server clock instead; a re-opened cursor
+  re-reads a short window before the last stamp it saw and skips messages already seen.
+- memory: delivery between buses sharing one process, for a single worker or tests.
+"""
+
+import asyncio
+import os
+import socket
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from app.database import get_database
+
+CACHE_INVALIDATION_TRANSPORT = os.getenv("CACHE_INVALIDATION_TRANSPORT", "mongo")
+CACHE_INVALIDATION_COLLECTION_BYTES = int(os.getenv("CACHE_INVALIDATION_COLLECTION_BYTES", 1024 * 1024))
+
+InvalidationHandler = Callable[[List[str]], None]
+Deliver = Callable[[dict], None]
+
+class MemoryTransport:
+    """Delivers messages to every bus attached to this transport object"""
+
+    def __init__(self):
+        self._listeners: List[Deliver] = []
+
+    async def start(self, deliver: Deliver) -> None:
+        self._listeners.append(deliver)
+
+    async def stop(self) -> None:
+        self._listeners = []
+
+    async def send(self, message: dict) -> None:
+        for deliver in list(self._listeners):
+            deliver(message)
+
+class MongoTransport:
+    """Publishes to a capped collection and tails it for messages from other workers"""
+
+    def __init__(self, collection_name: str = "cacheInvalidations", size_bytes: int = CACHE_INVALIDATION_COLLECTION_BYTES,
+                 retry_interval: float = 1.0, overlap: float = 5.0, remembered: int = 10000):
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self.retry_interval = retry_interval
+        # How far before the last seen stamp a re-opened cursor starts; covers messages
+        # stamped earlier but committed later
+        self.overlap = timedelta(seconds=overlap)
+        self._seen_order = deque(maxlen=remembered)
+        self._seen = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _collection(self):
+        database = await get_database()
+        return database[self.collection_name]
+
+    async def start(self, deliver: Deliver) -> None:
+        database = await get_database()
+        try:
+            await database.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # Already created by another worker
+        collection = await self._collection()
+        # Only messages published from now on matter; older ones describe caches we never had
+        latest = await collection.find_one({}, {"createdAt": 1}, sort=[("$natural", -1)])
+        since = None
+        if latest:
+            since = latest["createdAt"]
+            async for message in collection.find({"createdAt": {"$gte": since - self.overlap}}, {"_id": 1}):
+                self._remember(message["_id"])
+        self._task = asyncio.create_task(self._tail(deliver, since))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def send(self, message: dict) -> None:
+        collection = await self._collection()
+        # An upsert with a pipeline lets the server stamp the message with its own clock
+        fields = {name: {"$literal": value} for name, value in message.items() if name not in ("_id", "createdAt")}
+        await collection.update_one({"_id": message["_id"]}, [{"$set": {**fields, "createdAt": "$$NOW"}}], upsert=True)
+
+    def _remember(self, message_id) -> bool:
+        """Record a delivered message; False if it was delivered before"""
+        if message_id in self._seen:
+            return False
+        if len(self._seen_order) == self._seen_order.maxlen:
+            self._seen.discard(self._seen_order[0])
+        self._seen_order.append(message_id)
+        self._seen.add(message_id)
+        return True
+
+    async def _tail(self, deliver: Deliver, since: Optional[datetime]) -> None:
+        """Follow the capped collection, re-opening the cursor after it dies or errors"""
+        collection = await self._collection()
+        while True:
+            try:
+                query = {"createdAt": {"$gte": since - self.overlap}} if since else {}
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for message in cursor:
+                    since = max(since, message["createdAt"]) if since else message["createdAt"]
+                    if self._remember(message["_id"]):
+                        deliver(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Cache invalidation tailer error: {e}")
+            # A tailable cursor on an empty range ends immediately; wait before re-opening
+            await asyncio.sleep(self.retry_interval)
+
+def create_transport(kind: str = CACHE_INVALIDATION_TRANSPORT):
+    """Instantiate the transport named by CACHE_INVALIDATION_TRANSPORT"""
+    if kind == "memory":
+        return MemoryTransport()
+    if kind == "mongo":
+        return MongoTransport()
+    raise ValueError(f"Unknown CACHE_INVALIDATION_TRANSPORT: {kind}")
+
+class InvalidationBus:
+    def __init__(self, transport):
+        self.transport = transport
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._handlers: Dict[str, List[InvalidationHandler]] = {}
+        self._pending_sends = set()
+        self._started = False
+
+    def subscribe(self, topic: str, handler: InvalidationHandler) -> None:
+        """Call handler(keys) whenever an invalidation for the topic is published by any worker"""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, *keys) -> None:
+        """Invalidate locally now and tell the other workers in the background"""
+        keys = [str(key) for key in keys]
+        self._apply(topic, keys)
+        if not self._started:
+            return
+        message = {"_id": ObjectId(), "topic": topic, "keys": keys, "origin": self.origin, "createdAt": datetime.utcnow()}
+        task = asyncio.create_task(self._send(message))
+        self._pending_sends.add(task)
+        task.add_done_callback(self._pending_sends.discard)
+
+    async def start(self) -> None:
+        """Attach to the transport; until then publish() only invalidates this worker"""
+        await self.transport.start(self._receive)
+        self._started = True
+
+    async def stop(self) -> None:
+        self._started = False
+        await asyncio.gather(*self._pending_sends, return_exceptions=True)
+        await self.transport.stop()
+
+    async def _send(self, message: dict) -> None:
+        try:
+            await self.transport.send(message)
+        except Exception as e:
+            # Other workers' caches still expire on their own TTLs
+            print(f"Failed to publish {message['topic']} invalidation: {e}")
+
+    def _receive(self, message: dict) -> None:
+        if message.get("origin") != self.origin:
+            self._apply(message["topic"], message.get("keys", []))
+
+    def _apply(self, topic: str, keys: List[str]) -> None:
+        for handler in self._handlers.get(topic, []):
+            try:
+                handler(keys)
+            except Exception as e:
+                print(f"Cache invalidation handler for {topic} failed: {e}")
+
+invalidation_bus = InvalidationBus(create_transport())
@@ -0,0 +1,435 @@
+"""
+Persistent background job queue
+
+Jobs are documents in the `jobs` collection. Any worker process can claim a due job
+atomically with find_one_and_update, so running several gunicorn workers is safe.
+Failed jobs are retried with exponential backoff; jobs whose worker died are picked up
+again once their lock times out. Handlers must therefore be idempotent, and they do
+their work in bounded batches so a large cascade never holds the event loop for long.
+"""
+
+import asyncio
+import os
+import socket
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.browse_cache import bump_catalog_version
+from app.database import get_database, get_jobs_collection
+from app.models.job import JobModel
+from app.models.user import UserModel
+from app.models.rating import RatingModel
+from app.models.seller_stats import SellerStatsModel
+from app.models.analytics import AnalyticsModel
+from app.message_archive import MessageArchive, MESSAGE_ARCHIVE_AFTER_DAYS
+
+MESSAGE_ARCHIVE_INTERVAL_HOURS = float(os.getenv("MESSAGE_ARCHIVE_INTERVAL_HOURS", 24))
+
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", 500))
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Optional[dict]]]
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+
+def job_handler(job_type: str):
+    """Register a coroutine as the handler for a job type"""
+    def register(func: JobHandler) -> JobHandler:
+        JOB_HANDLERS[job_type] = func
+        return func
+    return register
+
+async def enqueue_job(
+    job_type: str,
+    payload: Optional[Dict[str, Any]] = None,
+    run_at: Optional[datetime] = None,
+    max_attempts: int = 5,
+    dedupe_key: Optional[str] = None
+) -> str:
+    """Persist a job and return its ID
+
+    With a dedupe_key, a job that is still pending under the same key is reused instead
+    of queueing a second copy, so handlers should read current state rather than rely on
+    payload snapshots.
+    """
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+
+    jobs_collection = await get_jobs_collection()
+    job_dict = JobModel.create_job_dict(job_type, payload, run_at, max_attempts, dedupe_key)
+
+    if dedupe_key:
+        job = None
+        while job is None:
+            try:
+                job = await jobs_collection.find_one_and_update(
+                    {"dedupeKey": dedupe_key, "status": JobModel.PENDING},
+                    {"$setOnInsert": job_dict},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # Another worker queued it between our lookup and insert; it may already
+                # have been claimed, in which case the upsert is tried again
+                job = await jobs_collection.find_one({"dedupeKey": dedupe_key, "status": JobModel.PENDING}, {"_id": 1})
+        job_id = job["_id"]
+    else:
+        result = await jobs_collection.insert_one(job_dict)
+        job_id = result.inserted_id
+
+    job_worker.notify()
+    return str(job_id)
+
+async def delete_in_batches(collection, query: dict, batch_size: int = JOB_BATCH_SIZE) -> int:
+    """delete_many in bounded chunks, yielding to the event loop between chunks"""
+    deleted = 0
+    while True:
+        ids = [doc["_id"] async for doc in collection.find(query, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return deleted
+        result = await collection.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+        await asyncio.sleep(0)
+
+async def delete_ratings_in_batches(database, query: dict, batch_size: int = JOB_BATCH_SIZE) -> int:
+    """Delete ratings in chunks and take each chunk back out of its sellers' stats
+
+    Only ratings this call actually removed are subtracted, so a rerun of the job or a
+    concurrent delete of the same rating through the API never decrements twice.
+    """
+    deleted = 0
+    while True:
+        rating_ids = [
+            rating["_id"] async for rating in database.ratings.find(query, {"_id": 1}).limit(batch_size)
+        ]
+        if not rating_ids:
+            return deleted
+        ratings = []
+        for rating_id in rating_ids:
+            rating = await database.ratings.find_one_and_delete(
+                {"_id": rating_id}, projection={"rating": 1, "sellerId": 1, "listingId": 1}
+            )
+            if rating is not None:
+                ratings.append(rating)
+        deleted += len(ratings)
+
+        per_seller: Dict[ObjectId, Dict[str, int]] = {}
+        per_listing: Dict[ObjectId, Dict[str, int]] = {}
+        for rating in ratings:
+            if rating.get("sellerId"):
+                totals = per_seller.setdefault(rating["sellerId"], {"ratingSum": 0, "ratingCount": 0})
+                totals["ratingSum"] -= rating["rating"]
+                totals["ratingCount"] -= 1
+            stars = per_listing.setdefault(rating["listingId"], {})
+            for field, value in RatingModel.stars_increments(rating["rating"], None).items():
+                stars[field] = stars.get(field, 0) + value
+        for seller_id, increments in per_seller.items():
+            await SellerStatsModel.apply(database.sellerStats, seller_id, increments)
+            if await UserModel.refresh_reputation(database, seller_id) is not None:
+                await UserModel.propagate_reputation(database, seller_id)
+        for listing_id, increments in per_listing.items():
+            await RatingModel.apply_stars(database.products, database.ratings, listing_id, increments)
+        await asyncio.sleep(0)
+
+async def delete_listing_dependents(database, listing_ids) -> None:
+    """Remove ratings, featured entries and reports that point at the given listings"""
+    await delete_ratings_in_batches(database, {"listingId": {"$in": listing_ids}})
+    await delete_in_batches(database.featuredProducts, {"productId": {"$in": listing_ids}})
+    await delete_in_batches(database.reports, {"type": "product", "targetId": {"$in": listing_ids}})
+    await database.moderationQueue.delete_many({"type": "product", "targetId": {"$in": listing_ids}})
+
+@job_handler("cascade_delete_listing")
+async def cascade_delete_listing(payload: Dict[str, Any]) -> dict:
+    """Clean up everything that referenced a deleted listing"""
+    database = await get_database()
+    await delete_listing_dependents(database, [ObjectId(payload["listing_id"])])
+    return {"listing_id": payload["listing_id"]}
+
+@job_handler("cascade_delete_user")
+async def cascade_delete_user(payload: Dict[str, Any]) -> dict:
+    """Remove a deleted user's listings, chats, messages, ratings, reports and stats"""
+    database = await get_database()
+    user_id = ObjectId(payload["user_id"])
+
+    # Listings (and whatever references them), one batch at a time
+    listings_deleted = 0
+    while True:
+        listing_ids = [doc["_id"] async for doc in database.products.find({"sellerId": user_id}, {"_id": 1}).limit(JOB_BATCH_SIZE)]
+        if not listing_ids:
+            break
+        await delete_listing_dependents(database, listing_ids)
+        result = await database.products.delete_many({"_id": {"$in": listing_ids}})
+        listings_deleted += result.deleted_count
+
+    # Chats the user took part in, messages first so a retry can still find the chats
+    chats_deleted = 0
+    participant_query = {"$or": [{"participantAId": user_id}, {"participantBId": user_id}]}
+    while True:
+        chats = await database.chats.find(
+            participant_query, {"participantAId": 1, "participantBId": 1, "unreadCount": 1, "blocked": 1}
+        ).limit(JOB_BATCH_SIZE).to_list(JOB_BATCH_SIZE)
+        if not chats:
+            break
+        chat_ids = [chat["_id"] for chat in chats]
+        await delete_in_batches(database.messages, {"chatId": {"$in": chat_ids}})
+        await delete_in_batches(database.messageBuckets, {"chatId": {"$in": chat_ids}})
+        await delete_in_batches(database.messageArchive, {"chatId": {"$in": chat_ids}})
+        await delete_in_batches(database.messageSearch, {"chatId": {"$in": chat_ids}})
+        result = await database.chats.delete_many({"_id": {"$in": chat_ids}})
+        chats_deleted += result.deleted_count
+
+        # The other participants no longer have these chats' unread messages (a blocked
+        # chat's were already taken off)
+        for chat in chats:
+            if chat.get("blocked"):
+                continue
+            other_key = "b" if chat["participantAId"] == user_id else "a"
+            other_id = chat["participantBId"] if other_key == "b" else chat["participantAId"]
+            unread = (chat.get("unreadCount") or {}).get(other_key, 0)
+            await UserModel.add_unread(database.users, other_id, -unread)
+
+    ratings_deleted = await delete_ratings_in_batches(database, {"userId": user_id})
+    reports_deleted = await delete_in_batches(database.reports, {"reporterId": user_id})
+    reports_deleted += await delete_in_batches(database.reports, {"type": "user", "targetId": user_id})
+    await database.moderationQueue.delete_many({"type": "user", "targetId": user_id})
+    await database.sellerStats.delete_one({"_id": user_id})
+    await database.users.update_many({"blockedIds": user_id}, {"$pull": {"blockedIds": user_id}})
+    bump_catalog_version()
+
+    return {
+        "listings": listings_deleted,
+        "chats": chats_deleted,
+        "ratings": ratings_deleted,
+        "reports": reports_deleted,
+    }
+
+@job_handler("propagate_user_profile")
+async def propagate_user_profile(payload: Dict[str, Any]) -> dict:
+    """Copy the user's current name/email onto their listings, ratings and chats"""
+    database = await get_database()
+    user = await database.users.find_one({"_id": ObjectId(payload["user_id"])}, {"fullName": 1, "email": 1})
+    if not user:
+        return {"skipped": "user not found"}
+    modified = await UserModel.propagate_profile(database, user["_id"], user.get("fullName"), user.get("email"))
+    bump_catalog_version()
+    return modified
+
+@job_handler("propagate_seller_reputation")
+async def propagate_seller_reputation(payload: Dict[str, Any]) -> dict:
+    """Re-derive the seller's reputation from their stats and copy it onto their listings"""
+    database = await get_database()
+    # Concurrent rating writes may have stored their scores out of order
+    await UserModel.refresh_reputation(database, payload["user_id"])
+    updated = await UserModel.propagate_reputation(database, payload["user_id"])
+    if updated:
+        bump_catalog_version()
+    return {"listings": updated}
+
+@job_handler("rebuild_seller_stats")
+async def rebuild_seller_stats(payload: Dict[str, Any]) -> dict:
+    """Backfill sellerStats for one seller, or every seller, and the reputation derived from them"""
+    database = await get_database()
+    sellers = await SellerStatsModel.rebuild(database, payload.get("seller_id"))
+    reputation = await UserModel.rebuild_reputation(database, payload.get("seller_id"))
+    if reputation["listings"]:
+        bump_catalog_version()
+    return {"sellers": sellers, **reputation}
+
+@job_handler("rebuild_seller_reputation")
+async def rebuild_seller_reputation(payload: Dict[str, Any]) -> dict:
+    """Recompute the reputation of one seller, or every user, from their stats"""
+    database = await get_database()
+    rebuilt = await UserModel.rebuild_reputation(database, payload.get("seller_id"))
+    if rebuilt["listings"]:
+        bump_catalog_version()
+    return rebuilt
+
+@job_handler("rebuild_rating_stars")
+async def rebuild_rating_stars(payload: Dict[str, Any]) -> dict:
+    """Backfill the star histogram of one listing, or every listing"""
+    database = await get_database()
+    updated = await RatingModel.rebuild_stars(database, payload.get("listing_id"))
+    if updated:
+        bump_catalog_version()
+    return {"listings": updated}
+
+@job_handler("rebuild_analytics")
+async def rebuild_analytics(payload: Dict[str, Any]) -> dict:
+    """Backfill analytics rollups for the last N days"""
+    database = await get_database()
+    end = datetime.utcnow()
+    start = end - timedelta(days=payload.get("days", 30))
+    return {"buckets": await AnalyticsModel.rebuild(database, start, end)}
+
+@job_handler("archive_messages")
+async def archive_messages(payload: Dict[str, Any]) -> dict:
+    """Move old chat messages to the archive; the scheduled run queues its next run"""
+    result = await MessageArchive.archive_older_than(payload.get("older_than_days", MESSAGE_ARCHIVE_AFTER_DAYS))
+    if payload.get("recurring"):
+        await schedule_message_archival(datetime.utcnow() + timedelta(hours=MESSAGE_ARCHIVE_INTERVAL_HOURS))
+    return result
+
+async def schedule_message_archival(run_at: Optional[datetime] = None) -> Optional[str]:
+    """Make sure a recurring archive run is queued (every worker calls this on startup)"""
+    if MESSAGE_ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    return await enqueue_job(
+        "archive_messages",
+        {"older_than_days": MESSAGE_ARCHIVE_AFTER_DAYS, "recurring": True},
+        run_at=run_at,
+        dedupe_key="archive_messages"
+    )
+
+class JobWorker:
+    """Runs queued jobs on a few asyncio tasks inside the API process"""
+
+    def __init__(self, concurrency: int = 2, poll_interval: float = 2.0, lock_timeout: float = 300.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        """Start the worker loops on the running event loop"""
+        if self._tasks or self.concurrency <= 0:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run_loop()) for _ in range(self.concurrency)]
+        print(f"Started {self.concurrency} background job workers ({self.worker_id})")
+
+    async def stop(self) -> None:
+        """Cancel the worker loops; interrupted jobs are retried after their lock times out"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Wake idle loops in this process so a freshly enqueued job starts immediately"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def claim_next(self) -> Optional[dict]:
+        """Atomically take the oldest due job, or one whose previous worker stopped responding"""
+        jobs_collection = await get_jobs_collection()
+        now = datetime.utcnow()
+        return await jobs_collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": JobModel.PENDING, "runAt": {"$lte": now}},
+                    {"status": JobModel.RUNNING, "lockedAt": {"$lt": now - timedelta(seconds=self.lock_timeout)}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": JobModel.RUNNING,
+                    "lockedAt": now,
+                    "lockedBy": self.worker_id,
+                    "updatedAt": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("runAt", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _keep_locked(self, job_id) -> None:
+        """Refresh a running job's lock so a long job isn't taken over as abandoned"""
+        jobs_collection = await get_jobs_collection()
+        while True:
+            await asyncio.sleep(self.lock_timeout / 3)
+            try:
+                await jobs_collection.update_one(
+                    {"_id": job_id, "status": JobModel.RUNNING, "lockedBy": self.worker_id},
+                    {"$set": {"lockedAt": datetime.utcnow()}}
+                )
+            except Exception as e:
+                print(f"Could not refresh the lock on job {job_id}: {e}")
+
+    async def run_job(self, job: dict) -> None:
+        """Execute a claimed job and record the outcome"""
+        jobs_collection = await get_jobs_collection()
+        handler = JOB_HANDLERS.get(job["type"])
+        attempts = job.get("attempts", 1)
+        max_attempts = job.get("maxAttempts", 1)
+
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job type {job['type']}")
+            if attempts > max_attempts:
+                raise RuntimeError("Job exceeded its maximum attempts")
+            heartbeat = asyncio.create_task(self._keep_locked(job["_id"]))
+            try:
+                result = await handler(job.get("payload", {}))
+            finally:
+                heartbeat.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            now = datetime.utcnow()
+            if attempts < max_attempts and handler is not None:
+                update = {
+                    "status": JobModel.PENDING,
+                    "runAt": now + JobModel.retry_delay(attempts),
+                }
+            else:
+                update = {"status": JobModel.FAILED}
+            update.update({"lastError": f"{e}\n{traceback.format_exc(limit=5)}", "lockedAt": None, "lockedBy": None, "updatedAt": now})
+            try:
+                await jobs_collection.update_one({"_id": job["_id"]}, {"$set": update})
+            except DuplicateKeyError:
+                # A copy was queued under the same dedupe key while this one ran; it does the retry
+                await jobs_collection.update_one(
+                    {"_id": job["_id"]}, {"$set": {**update, "status": JobModel.FAILED}}
+                )
+            print(f"Job {job['_id']} ({job['type']}) failed on attempt {attempts}/{max_attempts}: {e}")
+            return
+
+        await jobs_collection.update_one(
+            {"_id": job["_id"]},
+            {
+                "$set": {
+                    "status": JobModel.DONE,
+                    "result": result,
+                    "lockedAt": None,
+                    "lockedBy": None,
+                    "lastError": None,
+                    "updatedAt": datetime.utcnow()
+                }
+            }
+        )
+
+    async def _run_loop(self) -> None:
+        while not self._stopping:
+            try:
+                job = await self.claim_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job worker could not claim a job: {e}")
+                job = None
+
+            if job is not None:
+                await self.run_job(job)
+                continue
+
+            # Nothing due: sleep until the poll interval elapses or a job is enqueued here
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+job_worker = JobWorker(
+    concurrency=int(os.getenv("JOB_WORKER_CONCURRENCY", 2)),
+    poll_interval=float(os.getenv("JOB_POLL_INTERVAL", 2)),
+    lock_timeout=float(os.getenv("JOB_LOCK_TIMEOUT", 300))
+)
@@ -3,7 +3,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 
-from app.database import connect_to_mongo, close_mongo_connection
+from app.change_feed import change_feed
+from app.database import connect_to_mongo, close_mongo_connection, ensure_indexes
+from app.invalidation import invalidation_bus
+from app.jobs import job_worker, schedule_message_archival
 from app.routers import auth, listings, users, chat, reports, home, ratings, admin
 
 # Load environment variables
@@ -28,9 +31,17 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongo()
+    await ensure_indexes()
+    await invalidation_bus.start()
+    job_worker.start()
+    await schedule_message_archival()
+    await change_feed.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await change_feed.stop()
+    await job_worker.stop()
+    await invalidation_bus.stop()
     await close_mongo_connection()
 
 # Health check
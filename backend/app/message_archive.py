@@ -0,0 +1,132 @@
+"""
+Cold storage for old chat messages
+
+Messages older than MESSAGE_ARCHIVE_AFTER_DAYS are moved out of the hot message store
+into `messageArchive` segments: one document per run of up to MESSAGE_ARCHIVE_SEGMENT_SIZE
+consecutive messages of a chat, holding them as zlib-compressed BSON. Archived messages
+are always the oldest ones of their chat and chats count them in `archivedCount`, so a
+history page can be split between the archive and the hot store by position alone.
+"""
+
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import List
+
+import bson
+from bson import Binary, ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.database import get_chats_collection, get_message_archive_collection
+from app.message_store import BucketMessageStore, covering_ranges, message_store
+
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", 180))
+MESSAGE_ARCHIVE_SEGMENT_SIZE = int(os.getenv("MESSAGE_ARCHIVE_SEGMENT_SIZE", 500))
+
+class MessageArchive:
+    @staticmethod
+    def create_segment_dict(chat_id: ObjectId, messages: List[dict]) -> dict:
+        """Create a compressed archive segment for MongoDB insertion
+
+        The segment is keyed by its first message, so re-archiving the same messages after
+        an interrupted run is detected as a duplicate key.
+        """
+        packed = [BucketMessageStore.embedded_message(message) for message in messages]
+        return {
+            "_id": packed[0]["_id"],
+            "chatId": chat_id,
+            "startAt": packed[0]["createdAt"],
+            "endAt": packed[-1]["createdAt"],
+            "count": len(packed),
+            "lastMessageId": packed[-1]["_id"],
+            "data": Binary(zlib.compress(bson.encode({"messages": packed}))),
+            "archivedAt": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def unpack(segment: dict) -> List[dict]:
+        """Decompress a segment into message documents shaped like the document layout"""
+        messages = bson.decode(zlib.decompress(segment["data"]))["messages"]
+        return [{**message, "chatId": segment["chatId"]} for message in messages]
+
+    @staticmethod
+    async def get_page(chat_id: str, skip: int, limit: int) -> List[dict]:
+        """Archived messages of a chat in chronological order"""
+        archive_collection = await get_message_archive_collection()
+        sizes = await archive_collection.find(
+            {"chatId": ObjectId(chat_id)}, {"count": 1}
+        ).sort([("startAt", 1), ("_id", 1)]).to_list(None)
+
+        needed, offset = covering_ranges(sizes, skip, limit)
+        if not needed:
+            return []
+
+        segments = {segment["_id"]: segment async for segment in archive_collection.find({"_id": {"$in": needed}})}
+        messages = []
+        for segment_id in needed:
+            if segment_id in segments:
+                messages.extend(MessageArchive.unpack(segments[segment_id]))
+        return messages[offset:offset + limit]
+
+    @staticmethod
+    async def archive_chat(chat_id: ObjectId, before: datetime, segment_size: int = MESSAGE_ARCHIVE_SEGMENT_SIZE) -> int:
+        """Move the chat's messages sent before a cutoff into the archive, one segment at a time
+
+        Each segment is written, then the chat's archivedCount is recounted from the archive,
+        then the hot copies are removed; a run interrupted anywhere can simply be repeated.
+        """
+        archive_collection = await get_message_archive_collection()
+        chats_collection = await get_chats_collection()
+        archived = 0
+
+        while True:
+            messages = await message_store.oldest_before(str(chat_id), before, segment_size)
+            if not messages:
+                return archived
+
+            pending = messages
+            while pending:
+                try:
+                    await archive_collection.insert_one(MessageArchive.create_segment_dict(chat_id, pending))
+                    archived += len(pending)
+                    break
+                except DuplicateKeyError:
+                    # An earlier run archived a prefix of these messages but never removed them
+                    existing = await archive_collection.find_one({"_id": pending[0]["_id"]}, {"lastMessageId": 1})
+                    stored_ids = [message["_id"] for message in pending]
+                    if existing["lastMessageId"] not in stored_ids:
+                        break
+                    pending = pending[stored_ids.index(existing["lastMessageId"]) + 1:]
+
+            archived_count = sum([
+                segment["count"] async for segment in archive_collection.find({"chatId": chat_id}, {"count": 1})
+            ])
+            await chats_collection.update_one({"_id": chat_id}, {"$set": {"archivedCount": archived_count}})
+            await message_store.remove(str(chat_id), messages)
+
+    @staticmethod
+    async def archive_older_than(days: int, segment_size: int = MESSAGE_ARCHIVE_SEGMENT_SIZE) -> dict:
+        """Archive every chat's messages older than the given number of days"""
+        chats_collection = await get_chats_collection()
+        before = datetime.utcnow() - timedelta(days=days)
+        chats = 0
+        messages = 0
+
+        # A chat created after the cutoff cannot have messages old enough to archive
+        async for chat in chats_collection.find({"createdAt": {"$lt": before}}, {"_id": 1}):
+            moved = await MessageArchive.archive_chat(chat["_id"], before, segment_size)
+            if moved:
+                chats += 1
+                messages += moved
+        return {"chats": chats, "messages": messages}
+
+async def get_chat_messages_page(chat: dict, skip: int, limit: int) -> List[dict]:
+    """A page of a chat's history, reading from the archive for positions it holds"""
+    archived_count = chat.get("archivedCount", 0)
+    messages = []
+    if skip < archived_count:
+        messages = await MessageArchive.get_page(str(chat["_id"]), skip, min(limit, archived_count - skip))
+    remaining = limit - len(messages)
+    if remaining > 0:
+        messages += await message_store.get_page(str(chat["_id"]), max(0, skip - archived_count), remaining)
+    return messages
@@ -0,0 +1,135 @@
+"""
+Full-text search over a user's chat messages
+
+`messageSearch` holds one small entry per message and participant, with a compound text
+index on (userId, text). A search is an equality match on the searching user in front of
+the text lookup, so its cost depends on that user's matching messages only, however many
+chats they have and wherever the messages are stored (documents, buckets or the archive).
+"""
+
+import asyncio
+import re
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.database import get_message_search_collection
+from app.message_archive import get_chat_messages_page
+
+SNIPPET_LENGTH = 120
+
+# Write-behind indexing tasks, kept referenced until they finish
+_pending_index_tasks = set()
+
+class MessageSearch:
+    @staticmethod
+    def create_entry_dicts(message: dict, participant_ids: List[ObjectId]) -> List[dict]:
+        """Create one search entry per participant for MongoDB insertion"""
+        return [
+            {
+                "userId": participant_id,
+                "chatId": message["chatId"],
+                "messageId": message["_id"],
+                "senderId": message["senderId"],
+                "text": message["text"],
+                "createdAt": message["createdAt"],
+            }
+            for participant_id in dict.fromkeys(participant_ids)
+        ]
+
+    @staticmethod
+    def query_terms(query: str) -> List[str]:
+        """Words of a $text search string, without negated terms"""
+        return [term for term in re.findall(r"-?[\w']+", query) if not term.startswith("-")]
+
+    @staticmethod
+    def snippet(text: str, query: str, length: int = SNIPPET_LENGTH) -> str:
+        """The part of a message around its first matching term"""
+        if len(text) <= length:
+            return text
+        lowered = text.lower()
+        positions = [lowered.find(term.lower()) for term in MessageSearch.query_terms(query)]
+        positions = [position for position in positions if position >= 0]
+        start = max(0, min(positions) - length // 3) if positions else 0
+        end = min(len(text), start + length)
+        start = max(0, end - length)
+        return ("..." if start > 0 else "") + text[start:end].strip() + ("..." if end < len(text) else "")
+
+    @staticmethod
+    def search_result_helper(entry: dict, query: str) -> dict:
+        """Transform a search entry to API response format"""
+        return {
+            "message_id": str(entry["messageId"]),
+            "chat_id": str(entry["chatId"]),
+            "sender_id": str(entry["senderId"]),
+            "text": entry["text"],
+            "snippet": MessageSearch.snippet(entry["text"], query),
+            "score": round(entry.get("score", 0.0), 4),
+            "created_at": entry["createdAt"],
+        }
+
+    @staticmethod
+    async def index_message(message: dict, participant_ids: List[ObjectId]) -> None:
+        """Add a message to both participants' search entries"""
+        search_collection = await get_message_search_collection()
+        operations = [
+            UpdateOne({"messageId": entry["messageId"], "userId": entry["userId"]}, {"$setOnInsert": entry}, upsert=True)
+            for entry in MessageSearch.create_entry_dicts(message, participant_ids)
+        ]
+        try:
+            await search_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # The index is derived data; `maintenance.py rebuild-message-search` repairs it
+            print(f"Failed to index message {message['_id']} for search: {e}")
+
+    @staticmethod
+    def index_message_later(message: dict, participant_ids: List[ObjectId]) -> None:
+        """Index a message without holding up the request that sent it"""
+        task = asyncio.create_task(MessageSearch.index_message(message, participant_ids))
+        _pending_index_tasks.add(task)
+        task.add_done_callback(_pending_index_tasks.discard)
+
+    @staticmethod
+    async def remove_message(message_id: ObjectId) -> None:
+        """Drop a message's search entries"""
+        search_collection = await get_message_search_collection()
+        await search_collection.delete_many({"messageId": message_id})
+
+    @staticmethod
+    async def search(user_id: str, query: str, skip: int, limit: int, chat_id: Optional[str] = None) -> Tuple[List[dict], int]:
+        """Rank the user's messages matching a query by text score; returns (page, total)"""
+        search_collection = await get_message_search_collection()
+        text_filter = {"userId": ObjectId(user_id), "$text": {"$search": query}}
+        if chat_id:
+            text_filter["chatId"] = ObjectId(chat_id)
+
+        cursor = search_collection.find(
+            text_filter,
+            {"score": {"$meta": "textScore"}, "chatId": 1, "messageId": 1, "senderId": 1, "text": 1, "createdAt": 1}
+        ).sort([("score", {"$meta": "textScore"}), ("createdAt", -1)]).skip(skip).limit(limit)
+
+        entries, total = await asyncio.gather(cursor.to_list(limit), search_collection.count_documents(text_filter))
+        return [MessageSearch.search_result_helper(entry, query) for entry in entries], total
+
+    @staticmethod
+    async def rebuild(database, chat_id: Optional[str] = None, batch_size: int = 500) -> int:
+        """Re-index every message (hot and archived) of one chat, or of all chats"""
+        query = {"_id": ObjectId(chat_id)} if chat_id else {}
+        indexed = 0
+        async for chat in database.chats.find(query):
+            participant_ids = [chat["participantAId"], chat["participantBId"]]
+            skip = 0
+            while True:
+                messages = await get_chat_messages_page(chat, skip, batch_size)
+                if not messages:
+                    break
+                operations = [
+                    UpdateOne({"messageId": entry["messageId"], "userId": entry["userId"]}, {"$set": entry}, upsert=True)
+                    for message in messages
+                    for entry in MessageSearch.create_entry_dicts(message, participant_ids)
+                ]
+                await database.messageSearch.bulk_write(operations, ordered=False)
+                indexed += len(messages)
+                skip += len(messages)
+        return indexed
@@ -0,0 +1,225 @@
+"""
+Chat message storage
+
+Two layouts are supported, picked with MESSAGE_STORAGE_MODE:
+
+- "document" (default): one document per message in `messages`.
+- "bucket": messages are packed into `messageBuckets` documents, one open bucket per
+  chat that messages are $push-ed onto until it holds MESSAGE_BUCKET_SIZE messages or
+  (with MESSAGE_BUCKET_PER_DAY) the UTC day changes. A page of history is then one or
+  two bucket reads instead of a skip over every earlier message.
+
+Switch layouts with `python maintenance.py migrate-message-storage --to bucket|document`.
+"""
+
+import os
+from datetime import datetime
+from typing import List, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.database import get_messages_collection, get_message_buckets_collection
+
+MESSAGE_STORAGE_MODE = os.getenv("MESSAGE_STORAGE_MODE", "document")
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", 100))
+MESSAGE_BUCKET_PER_DAY = os.getenv("MESSAGE_BUCKET_PER_DAY", "true").lower() == "true"
+
+def covering_ranges(sizes: List[dict], skip: int, limit: int) -> Tuple[List[ObjectId], int]:
+    """Pick the containers (buckets, archive segments) that hold messages [skip, skip + limit)
+
+    `sizes` are {"_id", "count"} documents in chronological order. Returns the IDs to fetch
+    and the offset of the first wanted message within the first of them.
+    """
+    needed = []
+    offset = 0
+    position = 0
+    for container in sizes:
+        container_end = position + container["count"]
+        if position >= skip + limit:
+            break
+        if container_end > skip:
+            if not needed:
+                offset = skip - position
+            needed.append(container["_id"])
+        position = container_end
+    return needed, offset
+
+class DocumentMessageStore:
+    """One document per message"""
+
+    mode = "document"
+
+    async def insert(self, message: dict) -> ObjectId:
+        """Store a message built by MessageModel.create_message_dict and return its ID"""
+        messages_collection = await get_messages_collection()
+        result = await messages_collection.insert_one(message)
+        return result.inserted_id
+
+    async def get_page(self, chat_id: str, skip: int, limit: int) -> List[dict]:
+        """Messages of a chat in chronological order"""
+        messages_collection = await get_messages_collection()
+        cursor = messages_collection.find({"chatId": ObjectId(chat_id)}).sort("createdAt", 1).skip(skip).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def delete(self, chat_id: str, message_id: ObjectId) -> None:
+        """Remove a single message"""
+        messages_collection = await get_messages_collection()
+        await messages_collection.delete_one({"_id": message_id, "chatId": ObjectId(chat_id)})
+
+    async def oldest_before(self, chat_id: str, before: datetime, limit: int) -> List[dict]:
+        """The chat's oldest messages sent before a cutoff, for archival"""
+        messages_collection = await get_messages_collection()
+        cursor = messages_collection.find(
+            {"chatId": ObjectId(chat_id), "createdAt": {"$lt": before}}
+        ).sort("createdAt", 1).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def remove(self, chat_id: str, messages: List[dict]) -> None:
+        """Drop messages returned by oldest_before once they have been archived"""
+        messages_collection = await get_messages_collection()
+        await messages_collection.delete_many({"_id": {"$in": [message["_id"] for message in messages]}})
+
+class BucketMessageStore:
+    """Messages packed into per-chat bucket documents"""
+
+    mode = "bucket"
+
+    def __init__(self, bucket_size: int = 100, per_day: bool = True):
+        self.bucket_size = bucket_size
+        self.per_day = per_day
+
+    def period_for(self, created_at: datetime) -> str:
+        """Buckets never span two periods: a UTC day, or one period for the whole chat"""
+        return created_at.strftime("%Y-%m-%d") if self.per_day else "all"
+
+    @staticmethod
+    def embedded_message(message: dict) -> dict:
+        """The part of a message stored inside a bucket (the chat ID lives on the bucket)"""
+        return {
+            "_id": message.get("_id") or ObjectId(),
+            "senderId": message["senderId"],
+            "text": message["text"],
+            "createdAt": message["createdAt"],
+        }
+
+    @staticmethod
+    def unpack(bucket: dict) -> List[dict]:
+        """Turn a bucket back into message documents shaped like the document layout"""
+        return [{**message, "chatId": bucket["chatId"]} for message in bucket.get("messages", [])]
+
+    def create_bucket_dict(self, chat_id: ObjectId, messages: List[dict], is_full: bool) -> dict:
+        """Create a bucket document for MongoDB insertion (used by migrations)"""
+        return {
+            "chatId": chat_id,
+            "period": self.period_for(messages[0]["createdAt"]),
+            "startAt": messages[0]["createdAt"],
+            "endAt": messages[-1]["createdAt"],
+            "count": len(messages),
+            "full": is_full,
+            "messages": [self.embedded_message(message) for message in messages],
+        }
+
+    async def insert(self, message: dict) -> ObjectId:
+        """$push a message onto the chat's open bucket, opening a new bucket when needed"""
+        buckets_collection = await get_message_buckets_collection()
+        embedded = self.embedded_message(message)
+
+        # The unique partial index on (chatId, period, full=false) guarantees a single open
+        # bucket; when two writers race to open one, the loser retries and appends to it
+        for attempt in range(3):
+            try:
+                bucket = await buckets_collection.find_one_and_update(
+                    {"chatId": message["chatId"], "period": self.period_for(embedded["createdAt"]), "full": False},
+                    {
+                        "$push": {"messages": embedded},
+                        "$inc": {"count": 1},
+                        "$max": {"endAt": embedded["createdAt"]},
+                        "$setOnInsert": {"startAt": embedded["createdAt"]}
+                    },
+                    projection={"count": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                break
+            except DuplicateKeyError:
+                if attempt == 2:
+                    raise
+
+        if bucket["count"] >= self.bucket_size:
+            await buckets_collection.update_one({"_id": bucket["_id"], "full": False}, {"$set": {"full": True}})
+
+        return embedded["_id"]
+
+    async def get_page(self, chat_id: str, skip: int, limit: int) -> List[dict]:
+        """Messages of a chat in chronological order, reading only the buckets the page spans"""
+        buckets_collection = await get_message_buckets_collection()
+        chat_object_id = ObjectId(chat_id)
+
+        # Bucket sizes come from a small index-ordered query that skips the message arrays
+        sizes = await buckets_collection.find(
+            {"chatId": chat_object_id}, {"count": 1}
+        ).sort([("startAt", 1), ("_id", 1)]).to_list(None)
+
+        needed, offset = covering_ranges(sizes, skip, limit)
+        if not needed:
+            return []
+
+        buckets = {
+            bucket["_id"]: bucket
+            async for bucket in buckets_collection.find({"_id": {"$in": needed}})
+        }
+        messages = []
+        for bucket_id in needed:
+            if bucket_id in buckets:
+                messages.extend(self.unpack(buckets[bucket_id]))
+        return messages[offset:offset + limit]
+
+    async def delete(self, chat_id: str, message_id: ObjectId) -> None:
+        """Pull a single message out of its bucket, dropping the bucket if that empties it"""
+        buckets_collection = await get_message_buckets_collection()
+        bucket = await buckets_collection.find_one_and_update(
+            {"chatId": ObjectId(chat_id), "messages._id": message_id},
+            {"$pull": {"messages": {"_id": message_id}}, "$inc": {"count": -1}},
+            projection={"count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket and bucket["count"] <= 0:
+            # Conditional, in case a message was appended in between
+            await buckets_collection.delete_one({"_id": bucket["_id"], "count": {"$lte": 0}})
+
+    async def oldest_before(self, chat_id: str, before: datetime, limit: int) -> List[dict]:
+        """Messages of the chat's oldest whole buckets that ended before a cutoff
+
+        Always returns complete buckets (at least one, even if it holds more than `limit`
+        messages) and never the bucket still being appended to.
+        """
+        buckets_collection = await get_message_buckets_collection()
+        open_period = self.period_for(datetime.utcnow())
+        messages = []
+        async for bucket in buckets_collection.find({"chatId": ObjectId(chat_id)}).sort([("startAt", 1), ("_id", 1)]):
+            if bucket["endAt"] >= before or (not bucket.get("full") and bucket["period"] == open_period):
+                break
+            if messages and len(messages) + bucket["count"] > limit:
+                break
+            messages.extend(self.unpack(bucket))
+        return messages
+
+    async def remove(self, chat_id: str, messages: List[dict]) -> None:
+        """Drop the buckets returned by oldest_before once they have been archived"""
+        buckets_collection = await get_message_buckets_collection()
+        await buckets_collection.delete_many({
+            "chatId": ObjectId(chat_id),
+            "messages._id": {"$in": [message["_id"] for message in messages]}
+        })
+
+def create_message_store(mode: str = MESSAGE_STORAGE_MODE):
+    """Build the store for a storage mode name"""
+    if mode == "document":
+        return DocumentMessageStore()
+    if mode == "bucket":
+        return BucketMessageStore(MESSAGE_BUCKET_SIZE, MESSAGE_BUCKET_PER_DAY)
+    raise ValueError(f"Unknown message storage mode: {mode}")
+
+message_store = create_message_store()
@@ -3,5 +3,10 @@ from .listing import ListingModel
 from .chat import ChatModel, MessageModel
 from .report import ReportModel
 from .featured import FeaturedProductModel
+from .analytics import AnalyticsModel
+from .transaction import TransactionModel
+from .seller_stats import SellerStatsModel
+from .job import JobModel
+from .moderation import ModerationModel
 
-__all__ = ["UserModel", "ListingModel", "ChatModel", "MessageModel", "ReportModel", "FeaturedProductModel"]
\ No newline at end of file
+__all__ = ["UserModel", "ListingModel", "ChatModel", "MessageModel", "ReportModel", "FeaturedProductModel", "AnalyticsModel", "TransactionModel", "SellerStatsModel", "JobModel", "ModerationModel"]
\ No newline at end of file
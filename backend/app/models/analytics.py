@@ -0,0 +1,185 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ReplaceOne, UpdateOne
+from typing import Optional, Dict, Any, List
+
+from app.message_archive import MessageArchive
+
+class AnalyticsModel:
+    # Metric name in the rollup document -> field name in API responses
+    METRICS = {
+        "newListings": "new_listings",
+        "purchases": "purchases",
+        "gmv": "gmv",
+        "newUsers": "new_users",
+        "messagesSent": "messages_sent",
+        "reportsFiled": "reports_filed",
+    }
+
+    GRANULARITIES = {
+        "hour": timedelta(hours=1),
+        "day": timedelta(days=1),
+    }
+
+    # Upper bound on how many buckets a single range query may return
+    MAX_BUCKETS = {
+        "hour": 24 * 31,
+        "day": 366 * 2,
+    }
+
+    @staticmethod
+    def to_naive_utc(value: datetime) -> datetime:
+        """Convert a possibly timezone-aware datetime to the naive UTC values stored in MongoDB"""
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @staticmethod
+    def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+        """Truncate a timestamp to the start of its hour or day bucket"""
+        timestamp = AnalyticsModel.to_naive_utc(timestamp)
+        if granularity == "hour":
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def bucket_id(granularity: str, bucket_start: datetime) -> str:
+        """Deterministic rollup document ID, e.g. day:2024-05-01 or hour:2024-05-01T13"""
+        if granularity == "hour":
+            return f"hour:{bucket_start.strftime('%Y-%m-%dT%H')}"
+        return f"day:{bucket_start.strftime('%Y-%m-%d')}"
+
+    @staticmethod
+    def create_rollup_dict(granularity: str, bucket_start: datetime, metrics: Dict[str, float]) -> dict:
+        """Create a complete rollup document (used when rebuilding)"""
+        return {
+            "_id": AnalyticsModel.bucket_id(granularity, bucket_start),
+            "granularity": granularity,
+            "bucketStart": bucket_start,
+            "metrics": {name: metrics.get(name, 0) for name in AnalyticsModel.METRICS},
+            "updatedAt": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def rollup_helper(bucket_start: datetime, metrics: Optional[Dict[str, float]] = None) -> dict:
+        """Transform a rollup bucket to API response format"""
+        metrics = metrics or {}
+        bucket = {"bucket_start": bucket_start}
+        for name, field in AnalyticsModel.METRICS.items():
+            bucket[field] = metrics.get(name, 0)
+        bucket["gmv"] = round(bucket["gmv"], 2)
+        return bucket
+
+    @staticmethod
+    async def record(rollups_collection, at: Optional[datetime] = None, **increments) -> None:
+        """Increment metrics in the hourly and daily buckets containing `at` (defaults to now)"""
+        at = at or datetime.utcnow()
+        operations = []
+        for granularity in AnalyticsModel.GRANULARITIES:
+            start = AnalyticsModel.bucket_start(at, granularity)
+            operations.append(UpdateOne(
+                {"_id": AnalyticsModel.bucket_id(granularity, start)},
+                {
+                    "$inc": {f"metrics.{name}": value for name, value in increments.items()},
+                    "$set": {"updatedAt": datetime.utcnow()},
+                    "$setOnInsert": {"granularity": granularity, "bucketStart": start}
+                },
+                upsert=True
+            ))
+        try:
+            await rollups_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Analytics must never fail the write that triggered it
+            print(f"Failed to record analytics {increments}: {e}")
+
+    @staticmethod
+    async def get_series(rollups_collection, granularity: str, start: datetime, end: datetime) -> List[dict]:
+        """Return zero-filled buckets in [start, end) read from the rollups only"""
+        step = AnalyticsModel.GRANULARITIES[granularity]
+        first = AnalyticsModel.bucket_start(start, granularity)
+
+        stored = {}
+        cursor = rollups_collection.find({
+            "granularity": granularity,
+            "bucketStart": {"$gte": first, "$lt": AnalyticsModel.to_naive_utc(end)}
+        }).sort("bucketStart", 1)
+        async for rollup in cursor:
+            stored[rollup["bucketStart"]] = rollup.get("metrics", {})
+
+        buckets = []
+        current = first
+        while current < AnalyticsModel.to_naive_utc(end):
+            buckets.append(AnalyticsModel.rollup_helper(current, stored.get(current)))
+            current += step
+        return buckets
+
+    @staticmethod
+    async def rebuild(database, start: datetime, end: datetime) -> int:
+        """Recompute hourly and daily rollups for whole days in [start, end) from the source collections"""
+        # Widen the range to whole days so daily buckets are never half rebuilt
+        start = AnalyticsModel.bucket_start(start, "day")
+        day_end = AnalyticsModel.bucket_start(end, "day")
+        if day_end < AnalyticsModel.to_naive_utc(end):
+            day_end += timedelta(days=1)
+        end = day_end
+
+        # Stages that turn bucketed messages back into one document per message
+        unwind_message_buckets = [
+            {"$match": {"startAt": {"$lt": end}, "endAt": {"$gte": start}}},
+            {"$unwind": "$messages"},
+            {"$replaceRoot": {"newRoot": "$messages"}},
+        ]
+
+        # (collection, {metric: accumulator}, leading stages), each grouped by hour on createdAt
+        sources = [
+            (database.products, {"newListings": {"$sum": 1}}, []),
+            (database.users, {"newUsers": {"$sum": 1}}, []),
+            (database.messages, {"messagesSent": {"$sum": 1}}, []),
+            (database.messageBuckets, {"messagesSent": {"$sum": 1}}, unwind_message_buckets),
+            (database.reports, {"reportsFiled": {"$sum": 1}}, []),
+            (database.transactions, {"purchases": {"$sum": 1}, "gmv": {"$sum": "$totalCost"}}, []),
+        ]
+
+        hourly: Dict[datetime, Dict[str, float]] = {}
+        for collection, accumulators, leading_stages in sources:
+            pipeline = [
+                *leading_stages,
+                {"$match": {"createdAt": {"$gte": start, "$lt": end}}},
+                {
+                    "$group": {
+                        "_id": {"$dateToString": {"format": "%Y-%m-%dT%H", "date": "$createdAt"}},
+                        **accumulators
+                    }
+                }
+            ]
+            async for group in collection.aggregate(pipeline):
+                hour = datetime.strptime(group["_id"], "%Y-%m-%dT%H")
+                metrics = hourly.setdefault(hour, {})
+                for name in accumulators:
+                    metrics[name] = metrics.get(name, 0) + group[name]
+
+        # Archived messages are stored compressed, so they are counted here instead
+        async for segment in database.messageArchive.find({"startAt": {"$lt": end}, "endAt": {"$gte": start}}):
+            for message in MessageArchive.unpack(segment):
+                if start <= message["createdAt"] < end:
+                    metrics = hourly.setdefault(AnalyticsModel.bucket_start(message["createdAt"], "hour"), {})
+                    metrics["messagesSent"] = metrics.get("messagesSent", 0) + 1
+
+        daily: Dict[datetime, Dict[str, float]] = {}
+        for hour, metrics in hourly.items():
+            day_metrics = daily.setdefault(AnalyticsModel.bucket_start(hour, "day"), {})
+            for name, value in metrics.items():
+                day_metrics[name] = day_metrics.get(name, 0) + value
+
+        rollups_collection = database.analyticsRollups
+        await rollups_collection.delete_many({"bucketStart": {"$gte": start, "$lt": end}})
+
+        operations = []
+        for granularity, buckets in (("hour", hourly), ("day", daily)):
+            for bucket_start, metrics in buckets.items():
+                document = AnalyticsModel.create_rollup_dict(granularity, bucket_start, metrics)
+                operations.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+
+        for i in range(0, len(operations), 500):
+            await rollups_collection.bulk_write(operations[i:i + 500], ordered=False)
+
+        return len(operations)
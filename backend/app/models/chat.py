@@ -1,7 +1,10 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from typing import Optional, Dict, Any, List
 
+from app.models.user import UserModel
+
 class ChatModel:
     @staticmethod
     def chat_helper(chat: dict) -> dict:
@@ -13,24 +16,145 @@ class ChatModel:
             "last_message": chat.get("lastMessage"),
             "last_message_at": chat.get("lastMessageAt"),
             "unread_count": chat.get("unreadCount", {"a": 0, "b": 0}),
+            "participant_a_name": chat.get("participantAName"),
+            "participant_b_name": chat.get("participantBName"),
             "created_at": chat.get("createdAt", datetime.utcnow()),
             "updated_at": chat.get("updatedAt", datetime.utcnow()),
         }
     
     @staticmethod
-    def create_chat_dict(participant_a_id: str, participant_b_id: str) -> dict:
+    def create_chat_dict(participant_a_id: str, participant_b_id: str, participant_a_name: str = None, participant_b_name: str = None) -> dict:
         """Create chat document for MongoDB insertion"""
         now = datetime.utcnow()
         return {
+            "pairKey": ChatModel.pair_key(participant_a_id, participant_b_id),
+            "participantIds": [ObjectId(participant_a_id), ObjectId(participant_b_id)],
             "participantAId": ObjectId(participant_a_id),
             "participantBId": ObjectId(participant_b_id),
+            "participantAName": participant_a_name,
+            "participantBName": participant_b_name,
             "lastMessage": None,
             "lastMessageAt": None,
+            "lastMessageId": None,
             "unreadCount": {"a": 0, "b": 0},
+            "archivedCount": 0,
+            # Per-participant read position: {"lastReadAt": datetime, "lastReadMessageId": ObjectId}
+            "readWatermarks": {"a": None, "b": None},
             "createdAt": now,
             "updatedAt": now,
         }
     
+    @staticmethod
+    def pair_key(user_id_1: str, user_id_2: str) -> str:
+        """Canonical key for a pair of users, the same whichever of them starts the chat"""
+        return ":".join(sorted([str(user_id_1), str(user_id_2)]))
+    
+    @staticmethod
+    def participants_query(user_id: str, excluded_ids=None) -> dict:
+        """Query matching the user's chats, leaving out chats with any of excluded_ids"""
+        if excluded_ids:
+            return {"participantIds": {"$eq": ObjectId(user_id), "$nin": list(excluded_ids)}}
+        return {"participantIds": ObjectId(user_id)}
+    
+    @staticmethod
+    def participant_filter(chat_id: str, user_id: str, excluded_ids=None) -> dict:
+        """Query matching the chat only if the user takes part in it (and nobody excluded does)"""
+        return {"_id": ObjectId(chat_id), **ChatModel.participants_query(user_id, excluded_ids)}
+    
+    @staticmethod
+    async def set_blocked(database, user_id_1, user_id_2, blocked: bool) -> None:
+        """Flag the chats between two users as hidden by a block, or visible again
+        
+        A hidden chat's unread messages leave both participants' unreadTotal and come back
+        when it is unblocked. The flag changes with a conditional write, so the counts move
+        once even if two requests race.
+        """
+        user_ids = [ObjectId(user_id_1), ObjectId(user_id_2)]
+        state = {"$ne": True} if blocked else True
+        update = {"$set": {"blocked": True}} if blocked else {"$unset": {"blocked": ""}}
+        async for chat in database.chats.find({"participantIds": {"$all": user_ids}, "blocked": state}, {"_id": 1}):
+            flipped = await database.chats.find_one_and_update(
+                {"_id": chat["_id"], "blocked": state},
+                update,
+                projection={"participantAId": 1, "participantBId": 1, "unreadCount": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if not flipped:
+                continue
+            unread = flipped.get("unreadCount") or {}
+            for key, user_id in (("a", flipped["participantAId"]), ("b", flipped["participantBId"])):
+                count = unread.get(key, 0)
+                await UserModel.add_unread(database.users, user_id, -count if blocked else count)
+    
+    @staticmethod
+    def participant_key(chat: dict, user_id: str) -> str:
+        """Return "a" or "b" for the user's side of the chat"""
+        return "a" if str(chat["participantAId"]) == str(user_id) else "b"
+    
+    @staticmethod
+    def new_message_update(message: dict) -> list:
+        """Update pipeline recording a new message on its chat
+        
+        Works out the recipient's side from the stored participants, so membership can be
+        checked and the unread counter bumped in the same write.
+        """
+        sender_id = message["senderId"]
+        return [
+            {
+                "$set": {
+                    "lastMessage": {"$literal": message["text"]},
+                    "lastMessageAt": message["createdAt"],
+                    "lastMessageId": message["_id"],
+                    "updatedAt": message["createdAt"],
+                    "unreadCount.a": {"$add": [
+                        {"$ifNull": ["$unreadCount.a", 0]},
+                        {"$cond": [{"$eq": ["$participantAId", sender_id]}, 0, 1]}
+                    ]},
+                    "unreadCount.b": {"$add": [
+                        {"$ifNull": ["$unreadCount.b", 0]},
+                        {"$cond": [{"$eq": ["$participantBId", sender_id]}, 0, 1]}
+                    ]},
+                }
+            }
+        ]
+    
+    @staticmethod
+    def retract_message_update(message: dict, previous: dict) -> list:
+        """Update pipeline undoing new_message_update for a message that could not be stored
+        
+        The last-message fields go back to `previous` (the chat as it was before) unless a
+        later message has replaced them since, and the recipient's unread counter drops by one.
+        """
+        sender_id = message["senderId"]
+        is_last = {"$eq": ["$lastMessageId", message["_id"]]}
+        restored = {
+            field: {"$cond": [is_last, {"$literal": previous.get(field)}, f"${field}"]}
+            for field in ("lastMessage", "lastMessageAt", "lastMessageId")
+        }
+        return [
+            {
+                "$set": {
+                    **restored,
+                    "unreadCount.a": {"$max": [0, {"$subtract": [
+                        {"$ifNull": ["$unreadCount.a", 0]},
+                        {"$cond": [{"$eq": ["$participantAId", sender_id]}, 0, 1]}
+                    ]}]},
+                    "unreadCount.b": {"$max": [0, {"$subtract": [
+                        {"$ifNull": ["$unreadCount.b", 0]},
+                        {"$cond": [{"$eq": ["$participantBId", sender_id]}, 0, 1]}
+                    ]}]},
+                }
+            }
+        ]
+    
+    @staticmethod
+    def read_watermark_dict(chat: dict, read_at: datetime) -> dict:
+        """Create the watermark stored when a participant reads the chat"""
+        return {
+            "lastReadAt": read_at,
+            "lastReadMessageId": chat.get("lastMessageId"),
+        }
+    
     @staticmethod
     def validate_object_id(id_string: str) -> bool:
         """Validate if string is a valid ObjectId"""
@@ -42,16 +166,31 @@ class ChatModel:
 
 class MessageModel:
     @staticmethod
-    def message_helper(message: dict) -> dict:
-        """Transform MongoDB document to API response format"""
+    def message_helper(message: dict, chat: Optional[dict] = None) -> dict:
+        """Transform MongoDB document to API response format
+        
+        Read state is derived from the recipient's watermark on the chat; the per-message
+        isRead/readAt fields only exist on messages that predate the watermarks.
+        """
+        is_read = message.get("isRead", False)
+        read_at = message.get("readAt")
+        
+        if chat is not None:
+            reader_key = "b" if message["senderId"] == chat["participantAId"] else "a"
+            watermark = (chat.get("readWatermarks") or {}).get(reader_key)
+            created_at = message.get("createdAt")
+            if watermark and created_at and created_at <= watermark["lastReadAt"]:
+                is_read = True
+                read_at = read_at or watermark["lastReadAt"]
+        
         return {
             "id": str(message["_id"]),
             "chat_id": str(message["chatId"]),
             "sender_id": str(message["senderId"]),
             "text": message["text"],
-            "is_read": message.get("isRead", False),
+            "is_read": is_read,
             "created_at": message.get("createdAt", datetime.utcnow()),
-            "read_at": message.get("readAt"),
+            "read_at": read_at,
         }
     
     @staticmethod
@@ -62,7 +201,5 @@ class MessageModel:
             "chatId": ObjectId(chat_id),
             "senderId": ObjectId(sender_id),
             "text": text,
-            "isRead": False,
             "createdAt": now,
-            "readAt": None,
         }
\ No newline at end of file
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from typing import Optional, Dict, Any
+
+class JobModel:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    @staticmethod
+    def job_helper(job: dict) -> dict:
+        """Transform MongoDB document to API response format"""
+        return {
+            "id": str(job["_id"]),
+            "type": job["type"],
+            "payload": job.get("payload", {}),
+            "status": job.get("status", JobModel.PENDING),
+            "attempts": job.get("attempts", 0),
+            "max_attempts": job.get("maxAttempts", 1),
+            "run_at": job.get("runAt"),
+            "last_error": job.get("lastError"),
+            "created_at": job.get("createdAt"),
+            "updated_at": job.get("updatedAt"),
+        }
+
+    @staticmethod
+    def create_job_dict(
+        job_type: str,
+        payload: Optional[Dict[str, Any]] = None,
+        run_at: Optional[datetime] = None,
+        max_attempts: int = 5,
+        dedupe_key: Optional[str] = None
+    ) -> dict:
+        """Create job document for MongoDB insertion"""
+        now = datetime.utcnow()
+        return {
+            "type": job_type,
+            "payload": payload or {},
+            "status": JobModel.PENDING,
+            "attempts": 0,
+            "maxAttempts": max_attempts,
+            "runAt": run_at or now,
+            "lockedAt": None,
+            "lockedBy": None,
+            "lastError": None,
+            "dedupeKey": dedupe_key,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    @staticmethod
+    def retry_delay(attempts: int) -> timedelta:
+        """Exponential backoff between attempts, capped at 30 minutes"""
+        return timedelta(seconds=min(2 ** attempts * 5, 1800))
+
+    @staticmethod
+    def validate_object_id(id_string: str) -> bool:
+        """Validate if string is a valid ObjectId"""
+        try:
+            ObjectId(id_string)
+            return True
+        except:
+            return False
@@ -2,6 +2,9 @@ from datetime import datetime
 from bson import ObjectId
 from typing import Optional, Dict, Any, List
 
+from app.models.rating import RatingModel
+from app.models.user import UserModel
+
 class ListingModel:
     # Category mapping - now both database and schema use the same capitalized values
     CATEGORY_MAPPING = {
@@ -28,6 +31,9 @@ class ListingModel:
         "textbooks": "Books"
     }
     
+    # Lower bounds of the browse price facet buckets; the last bucket is open-ended
+    PRICE_FACET_BOUNDARIES = [0, 10, 25, 50, 100, 250, 500]
+    
     # Reverse mapping is now 1:1 since database and schema use same format
     REVERSE_CATEGORY_MAPPING = {
         "Books": "Books",
@@ -39,34 +45,94 @@ class ListingModel:
         "Other": "Other"
     }
     
+    @staticmethod
+    def facet_pipeline(query: dict) -> List[dict]:
+        """Count categories, price buckets and conditions for a browse query in one aggregation
+        
+        Each facet leaves out its own filter, so the sidebar keeps offering the alternatives.
+        """
+        facet_fields = ("category", "price", "condition")
+        base_query = {field: value for field, value in query.items() if field not in facet_fields}
+        
+        def match_except(field: str) -> dict:
+            return {"$match": {other: query[other] for other in facet_fields if other != field and other in query}}
+        
+        return [
+            {"$match": base_query},
+            {
+                "$facet": {
+                    "categories": [match_except("category"), {"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+                    "prices": [
+                        match_except("price"),
+                        {
+                            "$bucket": {
+                                "groupBy": "$price",
+                                "boundaries": ListingModel.PRICE_FACET_BOUNDARIES,
+                                "default": "above",
+                                "output": {"count": {"$sum": 1}},
+                            }
+                        },
+                    ],
+                    "conditions": [match_except("condition"), {"$group": {"_id": "$condition", "count": {"$sum": 1}}}],
+                }
+            },
+        ]
+    
+    @staticmethod
+    def facets_helper(result: Optional[dict]) -> dict:
+        """Transform a facet_pipeline result to API response format"""
+        result = result or {}
+        categories: Dict[str, int] = {}
+        for group in result.get("categories", []):
+            category = ListingModel.CATEGORY_MAPPING.get(group["_id"], "Other")
+            categories[category] = categories.get(category, 0) + group["count"]
+        
+        bounds = ListingModel.PRICE_FACET_BOUNDARIES
+        price_counts = {group["_id"]: group["count"] for group in result.get("prices", [])}
+        price_ranges = [
+            {"min": low, "max": high, "count": price_counts.get(low, 0)}
+            for low, high in zip(bounds, bounds[1:])
+        ]
+        price_ranges.append({"min": bounds[-1], "max": None, "count": price_counts.get("above", 0)})
+        
+        return {
+            "categories": [
+                {"value": value, "count": count}
+                for value, count in sorted(categories.items(), key=lambda item: -item[1])
+            ],
+            "price_ranges": price_ranges,
+            "conditions": [
+                {"value": group["_id"], "count": group["count"]}
+                for group in sorted(result.get("conditions", []), key=lambda group: -group["count"])
+                if group["_id"]
+            ],
+        }
+    
     @staticmethod
     def map_category_to_db(schema_category: str) -> str:
         """Map schema category value to database category value"""
         return ListingModel.REVERSE_CATEGORY_MAPPING.get(schema_category, "Other")
 
     @staticmethod
-    async def listing_helper(listing: dict, users_collection=None, ratings_collection=None) -> dict:
+    async def listing_helper(listing: dict, ratings_collection=None) -> dict:
         """Transform MongoDB document to API response format"""
         # Get category (with fallback mapping for any legacy data)
         db_category = listing["category"]
         mapped_category = ListingModel.CATEGORY_MAPPING.get(db_category, "Other")
         
-        # Fetch current seller name from users collection if available
-        seller_name = listing.get("seller_name", "Anonymous User")
-        if users_collection is not None and "sellerId" in listing:
-            try:
-                user = await users_collection.find_one({"_id": listing["sellerId"]})
-                if user:
-                    seller_name = user.get("fullName", user.get("full_name", seller_name))
-            except:
-                pass  # Use the stored seller_name if fetch fails
+        # seller_name/seller_email are denormalized on the listing and kept current by the
+        # profile-update fan-out, so no users lookup is needed here
+        seller_name = listing.get("seller_name") or "Anonymous User"
         
-        # Calculate average rating if ratings collection is provided
+        # Average rating comes from the listing's star histogram; listings that predate it
+        # are counted when a ratings collection is provided
         average_rating = None
         total_ratings = 0
-        if ratings_collection is not None:
+        if "stars" in listing:
+            summary = RatingModel.summary_from_stars(listing["stars"])
+            average_rating, total_ratings = summary["average_rating"], summary["total_ratings"]
+        elif ratings_collection is not None:
             try:
-                from app.models.rating import RatingModel
                 average_rating, total_ratings = await RatingModel.calculate_listing_average_rating(
                     ratings_collection, str(listing["_id"])
                 )
@@ -99,7 +165,7 @@ class ListingModel:
         }
     
     @staticmethod
-    def create_listing_dict(listing_data: dict, user_id: str, user_email: str = None, user_name: str = None) -> dict:
+    def create_listing_dict(listing_data: dict, user_id: str, user_email: str = None, user_name: str = None, seller_reputation: float = None) -> dict:
         """Create listing document for MongoDB insertion"""
         now = datetime.utcnow()
         # Category now matches between schema and database (both capitalized)
@@ -121,10 +187,13 @@ class ListingModel:
             "images": listing_data.get("images", []),
             "tags": listing_data.get("tags", []),
             "views": 0,
+            "stars": RatingModel.empty_stars(),
             "createdAt": now,
             "updatedAt": now,
+            "countedAt": now,
             "seller_email": user_email,
             "seller_name": user_name,
+            "sellerReputation": seller_reputation if seller_reputation is not None else UserModel.reputation(0, 0),
         }
     
     @staticmethod
@@ -158,7 +227,7 @@ class ListingModel:
         if "is_hidden" in listing_data:
             update_data["isHidden"] = listing_data["is_hidden"]
             
-        update_data["updatedAt"] = datetime.utcnow()
+        update_data["updatedAt"] = update_data["countedAt"] = datetime.utcnow()
         return update_data
     
     @staticmethod
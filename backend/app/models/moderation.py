@@ -0,0 +1,139 @@
+from pymongo import ReturnDocument, ReplaceOne
+from typing import Dict, Any, Tuple
+
+class ModerationModel:
+    OPEN = "open"
+    RESOLVED = "resolved"
+    DISMISSED = "dismissed"
+
+    # A second reporter counts for more than a repeat report
+    REPORTER_WEIGHT = 10
+
+    @staticmethod
+    def item_id(target_type: str, target_id) -> str:
+        """Queue documents are keyed by what was reported, e.g. "product:<id>" """
+        return f"{getattr(target_type, 'value', target_type)}:{target_id}"
+
+    @staticmethod
+    def priority(report_count: int, distinct_reporters: int) -> int:
+        """Score used to order the queue"""
+        return distinct_reporters * ModerationModel.REPORTER_WEIGHT + report_count
+
+    @staticmethod
+    def item_helper(item: dict) -> dict:
+        """Transform MongoDB document to API response format"""
+        return {
+            "id": item["_id"],
+            "type": item["type"],
+            "target_id": str(item["targetId"]),
+            "status": item.get("status", ModerationModel.OPEN),
+            "report_count": item.get("reportCount", 0),
+            "distinct_reporters": item.get("distinctReporters", 0),
+            "priority": item.get("priority", 0),
+            "latest_reason": item.get("latestReason"),
+            "first_reported_at": item.get("firstReportedAt"),
+            "latest_reported_at": item.get("latestReportedAt"),
+            "auto_hidden_at": item.get("autoHiddenAt"),
+            "resolution_notes": item.get("resolutionNotes"),
+            "resolved_at": item.get("resolvedAt"),
+        }
+
+    @staticmethod
+    def encode_cursor(item: dict) -> str:
+        """Keyset position after this item in (priority desc, _id asc) order"""
+        return f"{item.get('priority', 0)}|{item['_id']}"
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[int, str]:
+        priority, item_id = cursor.split("|", 1)
+        return int(priority), item_id
+
+    @staticmethod
+    async def record_report(queue_collection, report: dict) -> dict:
+        """Fold a new report into its target's queue document and return the updated document
+
+        One pipeline upsert keeps the count, the distinct reporter set and the priority
+        consistent without reading the reports collection.
+        """
+        reporter_ids = {"$setUnion": [{"$ifNull": ["$reporterIds", []]}, [report["reporterId"]]]}
+        report_count = {"$add": [{"$ifNull": ["$reportCount", 0]}, 1]}
+        return await queue_collection.find_one_and_update(
+            {"_id": ModerationModel.item_id(report["type"], report["targetId"])},
+            [
+                {
+                    "$set": {
+                        "type": report["type"],
+                        "targetId": report["targetId"],
+                        "reporterIds": reporter_ids,
+                        "reportCount": report_count,
+                        "latestReason": {"$literal": report["description"]},
+                        "latestReportedAt": report["createdAt"],
+                        "firstReportedAt": {"$ifNull": ["$firstReportedAt", report["createdAt"]]},
+                        "status": ModerationModel.OPEN,
+                    }
+                },
+                {"$set": {"distinctReporters": {"$size": "$reporterIds"}}},
+                {
+                    "$set": {
+                        "priority": {"$add": [
+                            {"$multiply": ["$distinctReporters", ModerationModel.REPORTER_WEIGHT]},
+                            "$reportCount"
+                        ]}
+                    }
+                },
+            ],
+            projection={"reporterIds": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    async def rebuild(database) -> int:
+        """Recompute the queue from the reports collection, keeping moderator decisions"""
+        decisions = {
+            item["_id"]: item
+            async for item in database.moderationQueue.find(
+                {}, {"status": 1, "resolutionNotes": 1, "resolvedAt": 1, "autoHiddenAt": 1}
+            )
+        }
+        pipeline = [
+            {"$sort": {"createdAt": 1}},
+            {
+                "$group": {
+                    "_id": {"type": "$type", "targetId": "$targetId"},
+                    "reporterIds": {"$addToSet": "$reporterId"},
+                    "reportCount": {"$sum": 1},
+                    "latestReason": {"$last": "$description"},
+                    "firstReportedAt": {"$first": "$createdAt"},
+                    "latestReportedAt": {"$last": "$createdAt"},
+                    "pending": {"$sum": {"$cond": [{"$eq": ["$status", "pending"]}, 1, 0]}},
+                }
+            }
+        ]
+
+        operations = []
+        async for group in database.reports.aggregate(pipeline):
+            item_id = ModerationModel.item_id(group["_id"]["type"], group["_id"]["targetId"])
+            previous = decisions.get(item_id, {})
+            distinct_reporters = len(group["reporterIds"])
+            item: Dict[str, Any] = {
+                "_id": item_id,
+                "type": group["_id"]["type"],
+                "targetId": group["_id"]["targetId"],
+                "reporterIds": group["reporterIds"],
+                "reportCount": group["reportCount"],
+                "distinctReporters": distinct_reporters,
+                "priority": ModerationModel.priority(group["reportCount"], distinct_reporters),
+                "latestReason": group["latestReason"],
+                "firstReportedAt": group["firstReportedAt"],
+                "latestReportedAt": group["latestReportedAt"],
+                "status": ModerationModel.OPEN if group["pending"] else previous.get("status", ModerationModel.RESOLVED),
+                "autoHiddenAt": previous.get("autoHiddenAt"),
+                "resolutionNotes": previous.get("resolutionNotes"),
+                "resolvedAt": previous.get("resolvedAt"),
+            }
+            operations.append(ReplaceOne({"_id": item_id}, item, upsert=True))
+
+        for i in range(0, len(operations), 500):
+            await database.moderationQueue.bulk_write(operations[i:i + 500], ordered=False)
+        return len(operations)
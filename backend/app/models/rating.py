@@ -1,8 +1,12 @@
 from datetime import datetime
 from bson import ObjectId
 from typing import Optional, Dict, Any, List
+from pymongo import UpdateOne
 
 class RatingModel:
+    # Keys of the per-listing star histogram stored on products as `stars`
+    STARS = ("1", "2", "3", "4", "5")
+    
     @staticmethod
     async def rating_helper(rating: dict) -> dict:
         """Transform MongoDB document to API response format"""
@@ -18,18 +22,20 @@ class RatingModel:
         }
     
     @staticmethod
-    def create_rating_dict(rating_data: dict, user_id: str, listing_id: str, user_name: str = None) -> dict:
+    def create_rating_dict(rating_data: dict, user_id: str, listing_id: str, user_name: str = None, seller_id: str = None) -> dict:
         """Create rating document for MongoDB insertion"""
         now = datetime.utcnow()
         
         return {
             "listingId": ObjectId(listing_id),
             "userId": ObjectId(user_id),
+            "sellerId": ObjectId(seller_id) if seller_id else None,
             "rating": int(rating_data["rating"]),
             "comment": rating_data["comment"],
             "userName": user_name or "Anonymous",
             "createdAt": now,
-            "updatedAt": now
+            "updatedAt": now,
+            "countedAt": now
         }
     
     @staticmethod
@@ -42,9 +48,126 @@ class RatingModel:
         if "comment" in rating_data:
             update_data["comment"] = rating_data["comment"]
             
-        update_data["updatedAt"] = datetime.utcnow()
+        update_data["updatedAt"] = update_data["countedAt"] = datetime.utcnow()
         return update_data
     
+    @staticmethod
+    def empty_stars() -> Dict[str, int]:
+        return {star: 0 for star in RatingModel.STARS}
+    
+    @staticmethod
+    def stars_increments(old_rating: Optional[int], new_rating: Optional[int]) -> Dict[str, int]:
+        """Histogram $inc for a rating moving between stars (None = created/deleted)"""
+        increments: Dict[str, int] = {}
+        if old_rating:
+            increments[f"stars.{old_rating}"] = -1
+        if new_rating:
+            increments[f"stars.{new_rating}"] = increments.get(f"stars.{new_rating}", 0) + 1
+        return {field: value for field, value in increments.items() if value}
+    
+    @staticmethod
+    def summary_from_stars(stars: Optional[dict]) -> Dict[str, Any]:
+        """Average, count and distribution derived from a listing's star histogram"""
+        distribution = {star: max(0, (stars or {}).get(star, 0)) for star in RatingModel.STARS}
+        total = sum(distribution.values())
+        weighted = sum(int(star) * count for star, count in distribution.items())
+        return {
+            "average_rating": round(weighted / total, 1) if total else None,
+            "total_ratings": total,
+            "distribution": distribution,
+        }
+    
+    @staticmethod
+    async def apply_stars(listings_collection, ratings_collection, listing_id, increments: Dict[str, int]) -> None:
+        """$inc a listing's star histogram, counting it from the ratings on its first write
+
+        Call after the rating itself was written. A listing from before the histogram
+        existed has no `stars` yet; incrementing would leave a partial histogram that
+        readers take for the full count.
+        """
+        if not increments:
+            return
+        listing_id = ObjectId(listing_id)
+        try:
+            result = await listings_collection.update_one(
+                {"_id": listing_id, "stars": {"$exists": True}}, {"$inc": increments}
+            )
+            if result.matched_count:
+                return
+            histogram = (await RatingModel.count_stars(ratings_collection, [listing_id]))[listing_id]
+            result = await listings_collection.update_one(
+                {"_id": listing_id, "stars": {"$exists": False}}, {"$set": {"stars": histogram}}
+            )
+            if not result.matched_count:
+                # Another write seeded it first, possibly from a count without this rating
+                histogram = (await RatingModel.count_stars(ratings_collection, [listing_id]))[listing_id]
+                await listings_collection.update_one({"_id": listing_id}, {"$set": {"stars": histogram}})
+        except Exception as e:
+            # The histogram is derived data; rebuild-rating-stars repairs it
+            print(f"Failed to update rating histogram for listing {listing_id}: {e}")
+    
+    @staticmethod
+    async def seller_totals(database, seller_id: Optional[str] = None) -> Dict[ObjectId, Dict[str, int]]:
+        """Rating sum and count per seller (or of one seller) counted from the ratings collection"""
+        totals: Dict[ObjectId, Dict[str, int]] = {}
+        group = {"$group": {"_id": "$sellerId", "ratingSum": {"$sum": "$rating"}, "ratingCount": {"$sum": 1}}}
+        seller_match = {"sellerId": ObjectId(seller_id)} if seller_id else {"sellerId": {"$ne": None}}
+        legacy_match: Dict[str, Any] = {"sellerId": None}
+        if seller_id:
+            legacy_match["listingId"] = {"$in": [
+                listing["_id"] async for listing in database.products.find({"sellerId": ObjectId(seller_id)}, {"_id": 1})
+            ]}
+        # Ratings written before they carried sellerId are attributed through their listing
+        legacy_pipeline = [
+            {"$match": legacy_match},
+            {"$lookup": {"from": "products", "localField": "listingId", "foreignField": "_id", "as": "listing"}},
+            {"$unwind": "$listing"},
+            {"$set": {"sellerId": "$listing.sellerId"}},
+            group,
+        ]
+        for pipeline in ([{"$match": seller_match}, group], legacy_pipeline):
+            async for result in database.ratings.aggregate(pipeline):
+                if result["_id"] is None:
+                    continue
+                counters = totals.setdefault(result["_id"], {"ratingSum": 0, "ratingCount": 0})
+                counters["ratingSum"] += result["ratingSum"]
+                counters["ratingCount"] += result["ratingCount"]
+        return totals
+    
+    @staticmethod
+    async def count_stars(ratings_collection, listing_ids: List[ObjectId]) -> Dict[ObjectId, Dict[str, int]]:
+        """Star histograms of the given listings counted from the ratings collection"""
+        pipeline = [
+            {"$match": {"listingId": {"$in": listing_ids}}},
+            {"$group": {"_id": {"listingId": "$listingId", "rating": "$rating"}, "count": {"$sum": 1}}}
+        ]
+        histograms = {listing_id: RatingModel.empty_stars() for listing_id in listing_ids}
+        async for group in ratings_collection.aggregate(pipeline):
+            star = str(group["_id"]["rating"])
+            if star in histograms[group["_id"]["listingId"]]:
+                histograms[group["_id"]["listingId"]][star] = group["count"]
+        return histograms
+    
+    @staticmethod
+    async def rebuild_stars(database, listing_id: Optional[str] = None, batch_size: int = 500) -> int:
+        """Recount every listing's star histogram and write the ones that changed"""
+        query = {"_id": ObjectId(listing_id)} if listing_id else {}
+        updated = 0
+        cursor = database.products.find(query, {"stars": 1}).sort("_id", 1)
+        while True:
+            listings = await cursor.to_list(batch_size)
+            if not listings:
+                return updated
+            histograms = await RatingModel.count_stars(database.ratings, [listing["_id"] for listing in listings])
+            operations = [
+                UpdateOne({"_id": listing["_id"]}, {"$set": {"stars": histograms[listing["_id"]]}})
+                for listing in listings
+                if listing.get("stars") != histograms[listing["_id"]]
+            ]
+            if operations:
+                await database.products.bulk_write(operations, ordered=False)
+                updated += len(operations)
+    
     @staticmethod
     def validate_object_id(id_string: str) -> bool:
         """Validate if string is a valid ObjectId"""
@@ -0,0 +1,125 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReplaceOne
+from typing import Optional, Dict, Any
+
+from app.models.rating import RatingModel
+
+class SellerStatsModel:
+    COUNTERS = (
+        "totalListings",
+        "activeListings",
+        "soldListings",
+        "unitsSold",
+        "revenue",
+        "views",
+        "ratingSum",
+        "ratingCount",
+    )
+
+    @staticmethod
+    def listing_counters(listing: Optional[dict]) -> Dict[str, int]:
+        """Listing-count contribution of a single listing document (None when it doesn't exist)"""
+        if listing is None:
+            return {"totalListings": 0, "activeListings": 0, "soldListings": 0}
+        is_sold = listing.get("isSold", False)
+        is_hidden = listing.get("isHidden", False)
+        return {
+            "totalListings": 1,
+            "activeListings": int(not is_sold and not is_hidden),
+            "soldListings": int(is_sold),
+        }
+
+    @staticmethod
+    def listing_delta(before: Optional[dict], after: Optional[dict]) -> Dict[str, int]:
+        """Counter increments for a listing going from `before` to `after` (None = created/deleted)"""
+        old = SellerStatsModel.listing_counters(before)
+        new = SellerStatsModel.listing_counters(after)
+        return {name: new[name] - old[name] for name in new if new[name] != old[name]}
+
+    @staticmethod
+    def stats_helper(seller_id: str, stats: Optional[dict] = None) -> dict:
+        """Transform MongoDB document to API response format"""
+        stats = stats or {}
+        rating_count = stats.get("ratingCount", 0)
+        rating_sum = stats.get("ratingSum", 0)
+        return {
+            "seller_id": str(seller_id),
+            "total_listings": stats.get("totalListings", 0),
+            "active_listings": stats.get("activeListings", 0),
+            "sold_listings": stats.get("soldListings", 0),
+            "units_sold": stats.get("unitsSold", 0),
+            "revenue": round(stats.get("revenue", 0.0), 2),
+            "views": stats.get("views", 0),
+            "rating_sum": rating_sum,
+            "rating_count": rating_count,
+            "average_rating": round(rating_sum / rating_count, 1) if rating_count > 0 else None,
+            "updated_at": stats.get("updatedAt"),
+        }
+
+    @staticmethod
+    async def apply(stats_collection, seller_id, increments: Dict[str, float]) -> None:
+        """$inc the seller's counters, creating the stats document on first use"""
+        increments = {name: value for name, value in increments.items() if value}
+        if not increments:
+            return
+        try:
+            await stats_collection.update_one(
+                {"_id": ObjectId(seller_id)},
+                {"$inc": increments, "$set": {"updatedAt": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            # Stats are derived data; a failed increment is repaired by a rebuild
+            print(f"Failed to update seller stats for {seller_id}: {e}")
+
+    @staticmethod
+    async def rebuild(database, seller_id: Optional[str] = None) -> int:
+        """Recompute sellerStats from products, transactions and ratings"""
+        seller_match = {"sellerId": ObjectId(seller_id)} if seller_id else {}
+        stats: Dict[ObjectId, Dict[str, Any]] = {}
+
+        def counters_for(key):
+            return stats.setdefault(key, {name: 0 for name in SellerStatsModel.COUNTERS})
+
+        listings_pipeline = [
+            {"$match": seller_match},
+            {
+                "$group": {
+                    "_id": "$sellerId",
+                    "totalListings": {"$sum": 1},
+                    "activeListings": {"$sum": {"$cond": [
+                        {"$and": [{"$ne": ["$isSold", True]}, {"$ne": ["$isHidden", True]}]}, 1, 0
+                    ]}},
+                    "soldListings": {"$sum": {"$cond": [{"$eq": ["$isSold", True]}, 1, 0]}},
+                    "views": {"$sum": "$views"}
+                }
+            }
+        ]
+        async for group in database.products.aggregate(listings_pipeline):
+            counters = counters_for(group["_id"])
+            for name in ("totalListings", "activeListings", "soldListings", "views"):
+                counters[name] = group[name]
+
+        sales_pipeline = [
+            {"$match": seller_match},
+            {"$group": {"_id": "$sellerId", "unitsSold": {"$sum": "$quantity"}, "revenue": {"$sum": "$totalCost"}}}
+        ]
+        async for group in database.transactions.aggregate(sales_pipeline):
+            counters = counters_for(group["_id"])
+            counters["unitsSold"] = group["unitsSold"]
+            counters["revenue"] = group["revenue"]
+
+        for key, totals in (await RatingModel.seller_totals(database, seller_id)).items():
+            counters_for(key).update(totals)
+
+        now = datetime.utcnow()
+        operations = [
+            ReplaceOne({"_id": key}, {"_id": key, **counters, "updatedAt": now}, upsert=True)
+            for key, counters in stats.items()
+        ]
+        if seller_id and not operations:
+            await database.sellerStats.delete_one({"_id": ObjectId(seller_id)})
+        for i in range(0, len(operations), 500):
+            await database.sellerStats.bulk_write(operations[i:i + 500], ordered=False)
+        return len(operations)
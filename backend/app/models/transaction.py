@@ -0,0 +1,39 @@
+from datetime import datetime
+from bson import ObjectId
+from typing import Optional, Dict, Any
+
+class TransactionModel:
+    @staticmethod
+    def transaction_helper(transaction: dict) -> dict:
+        """Transform MongoDB document to API response format"""
+        return {
+            "id": str(transaction["_id"]),
+            "transaction_id": transaction.get("transactionId"),
+            "listing_id": str(transaction["listingId"]),
+            "buyer_id": str(transaction["buyerId"]),
+            "seller_id": str(transaction["sellerId"]),
+            "quantity": transaction["quantity"],
+            "unit_price": transaction["unitPrice"],
+            "total_cost": transaction["totalCost"],
+            "created_at": transaction.get("createdAt", datetime.utcnow()),
+        }
+
+    @staticmethod
+    def create_transaction_dict(
+        transaction_id: str,
+        listing: dict,
+        buyer_id: str,
+        quantity: int,
+        total_cost: float
+    ) -> dict:
+        """Create purchase record for MongoDB insertion"""
+        return {
+            "transactionId": transaction_id,
+            "listingId": listing["_id"],
+            "buyerId": ObjectId(buyer_id),
+            "sellerId": listing["sellerId"],
+            "quantity": quantity,
+            "unitPrice": listing["price"],
+            "totalCost": total_cost,
+            "createdAt": datetime.utcnow(),
+        }
@@ -1,10 +1,23 @@
 from datetime import datetime
 from bson import ObjectId
 from typing import Optional, Dict, Any, List
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 import hashlib
+import os
 import secrets
 
+# Bayesian smoothing of seller ratings: every seller starts out as if they had
+# SELLER_REPUTATION_PRIOR_WEIGHT ratings of SELLER_REPUTATION_PRIOR_MEAN stars
+SELLER_REPUTATION_PRIOR_MEAN = float(os.getenv("SELLER_REPUTATION_PRIOR_MEAN", 3.5))
+SELLER_REPUTATION_PRIOR_WEIGHT = float(os.getenv("SELLER_REPUTATION_PRIOR_WEIGHT", 5))
+
 class UserModel:
+    @staticmethod
+    def normalize_key(value: Optional[str]) -> Optional[str]:
+        """Case-insensitive form of an email or username, backing the unique indexes"""
+        return value.strip().lower() if value else None
+    
     @staticmethod
     def user_helper(user: dict) -> dict:
         """Transform MongoDB document to API response format"""
@@ -23,6 +36,7 @@ class UserModel:
             "is_banned": user.get("isBanned", False),
             "is_admin": user.get("isAdmin", False),
             "blocked_ids": [str(bid) for bid in user.get("blockedIds", [])],
+            "seller_reputation": user.get("reputation"),
             "created_at": user.get("createdAt", user.get("created_at", datetime.utcnow())),
             "updated_at": user.get("updatedAt", user.get("updated_at", datetime.utcnow())),
         }
@@ -35,6 +49,8 @@ class UserModel:
             "universityId": user_data.get("university_id"),
             "email": user_data["email"],
             "userName": user_data["username"],
+            "emailKey": UserModel.normalize_key(user_data["email"]),
+            "userNameKey": UserModel.normalize_key(user_data["username"]),
             "fullName": user_data["full_name"],
             "university": user_data.get("university"),
             "phone": user_data.get("phone"),
@@ -46,10 +62,212 @@ class UserModel:
             "isBanned": False,
             "isAdmin": user_data.get("is_admin", False),
             "blockedIds": [],
+            "reputation": UserModel.reputation(0, 0),
             "createdAt": now,
             "updatedAt": now,
         }
     
+    @staticmethod
+    async def propagate_profile(database, user_id, full_name: Optional[str] = None, email: Optional[str] = None) -> Dict[str, int]:
+        """Copy a user's current name/email onto the documents that denormalize it"""
+        user_obj_id = ObjectId(user_id)
+        modified = {}
+        
+        listing_fields = {}
+        if full_name is not None:
+            listing_fields["seller_name"] = full_name
+        if email is not None:
+            listing_fields["seller_email"] = email
+        if listing_fields:
+            result = await database.products.update_many({"sellerId": user_obj_id}, {"$set": listing_fields})
+            modified["products"] = result.modified_count
+        
+        if full_name is not None:
+            result = await database.ratings.update_many({"userId": user_obj_id}, {"$set": {"userName": full_name}})
+            modified["ratings"] = result.modified_count
+            
+            chats_a = await database.chats.update_many({"participantAId": user_obj_id}, {"$set": {"participantAName": full_name}})
+            chats_b = await database.chats.update_many({"participantBId": user_obj_id}, {"$set": {"participantBName": full_name}})
+            modified["chats"] = chats_a.modified_count + chats_b.modified_count
+        
+        return modified
+    
+    @staticmethod
+    async def profile_copies_stale(database, user: dict) -> bool:
+        """Whether a listing, rating or chat still carries a name/email other than the user's current one"""
+        user_id = user["_id"]
+        full_name = user.get("fullName")
+        email = user.get("email")
+        listing_differs = []
+        if full_name is not None:
+            listing_differs.append({"seller_name": {"$ne": full_name}})
+        if email is not None:
+            listing_differs.append({"seller_email": {"$ne": email}})
+        probes = []
+        if listing_differs:
+            probes.append((database.products, {"sellerId": user_id, "$or": listing_differs}))
+        if full_name is not None:
+            probes.append((database.ratings, {"userId": user_id, "userName": {"$ne": full_name}}))
+            probes.append((database.chats, {"participantIds": user_id, "$or": [
+                {"participantAId": user_id, "participantAName": {"$ne": full_name}},
+                {"participantBId": user_id, "participantBName": {"$ne": full_name}},
+            ]}))
+        for collection, query in probes:
+            if await collection.find_one(query, {"_id": 1}):
+                return True
+        return False
+    
+    @staticmethod
+    async def backfill_keys(users_collection) -> List[tuple]:
+        """Set emailKey/userNameKey on users created before they existed; returns the clashes
+        
+        Users whose email or username only differs in case from an earlier user's are left
+        without the clashing key; each clash is returned as (user ID, field, value).
+        """
+        conflicts = []
+        query = {"$or": [{"emailKey": {"$exists": False}}, {"userNameKey": {"$exists": False}}]}
+        projection = {"email": 1, "userName": 1, "username": 1, "emailKey": 1, "userNameKey": 1}
+        async for user in users_collection.find(query, projection).sort("createdAt", 1):
+            keys = {
+                "emailKey": UserModel.normalize_key(user.get("email")),
+                "userNameKey": UserModel.normalize_key(user.get("userName", user.get("username"))),
+            }
+            for field, value in keys.items():
+                if value is None or field in user:
+                    continue
+                try:
+                    await users_collection.update_one({"_id": user["_id"], field: {"$exists": False}}, {"$set": {field: value}})
+                except DuplicateKeyError:
+                    conflicts.append((user["_id"], field, value))
+        return conflicts
+    
+    @staticmethod
+    async def taken_field(users_collection, user_fields: dict, keys: List[str], user_id=None) -> Optional[str]:
+        """Which of "email" or "username" another user already has, looking only at the given keys
+        
+        For when the unique index on a key could not be built and so can't reject the write.
+        """
+        for key, field, name in (("emailKey", "email", "email"), ("userNameKey", "userName", "username")):
+            if key not in keys or not user_fields.get(key):
+                continue
+            query = {"$or": [{key: user_fields[key]}, {field: user_fields.get(field)}]}
+            if user_id:
+                query["_id"] = {"$ne": ObjectId(user_id)}
+            if await users_collection.find_one(query, {"_id": 1}):
+                return name
+        return None
+    
+    @staticmethod
+    async def duplicate_field(users_collection, error: DuplicateKeyError, user_fields: dict, user_id=None) -> str:
+        """Which of "email" or "username" a write rejected by a unique index collided on"""
+        key_pattern = (error.details or {}).get("keyPattern") or {}
+        if "emailKey" in key_pattern:
+            return "email"
+        if "userNameKey" in key_pattern:
+            return "username"
+        # Servers that don't report the index: look it up (only on this error path)
+        if user_fields.get("emailKey"):
+            query = {"emailKey": user_fields["emailKey"]}
+            if user_id:
+                query["_id"] = {"$ne": ObjectId(user_id)}
+            if await users_collection.find_one(query, {"_id": 1}):
+                return "email"
+        return "username"
+    
+    @staticmethod
+    def reputation(rating_sum: float, rating_count: int) -> float:
+        """Bayesian-smoothed average rating of a seller"""
+        return (SELLER_REPUTATION_PRIOR_WEIGHT * SELLER_REPUTATION_PRIOR_MEAN + rating_sum) / (
+            SELLER_REPUTATION_PRIOR_WEIGHT + rating_count
+        )
+    
+    @staticmethod
+    def stats_reputation(stats: Optional[dict]) -> float:
+        """Reputation from a seller's sellerStats document (None when they have none)"""
+        stats = stats or {}
+        return UserModel.reputation(stats.get("ratingSum", 0), stats.get("ratingCount", 0))
+    
+    @staticmethod
+    async def refresh_reputation(database, seller_id) -> Optional[float]:
+        """Recompute a seller's reputation from their sellerStats totals; returns the score if it changed
+
+        Call after the rating change was applied to sellerStats.
+        """
+        try:
+            stats = await database.sellerStats.find_one(
+                {"_id": ObjectId(seller_id)}, {"ratingSum": 1, "ratingCount": 1}
+            )
+            reputation = UserModel.stats_reputation(stats)
+            result = await database.users.update_one(
+                {"_id": ObjectId(seller_id), "reputation": {"$ne": reputation}},
+                {"$set": {"reputation": reputation}}
+            )
+            return reputation if result.modified_count else None
+        except Exception as e:
+            # Reputation is derived from seller stats; rebuild-seller-reputation repairs it
+            print(f"Failed to update reputation for seller {seller_id}: {e}")
+            return None
+    
+    @staticmethod
+    async def propagate_reputation(database, user_id) -> int:
+        """Copy a seller's current reputation onto their listings, where browse sorts by it"""
+        user = await database.users.find_one({"_id": ObjectId(user_id)}, {"reputation": 1})
+        if not user:
+            return 0
+        reputation = user.get("reputation", UserModel.reputation(0, 0))
+        result = await database.products.update_many(
+            {"sellerId": user["_id"], "sellerReputation": {"$ne": reputation}},
+            {"$set": {"sellerReputation": reputation}}
+        )
+        return result.modified_count
+    
+    @staticmethod
+    async def rebuild_reputation(database, seller_id: Optional[str] = None) -> Dict[str, int]:
+        """Recompute one seller's or every user's reputation from sellerStats, then their listings' copies
+
+        Rebuild sellerStats first when its rating totals may be off. Returns how many users
+        and listings changed.
+        """
+        user_query = {"_id": ObjectId(seller_id)} if seller_id else {}
+        stats = {
+            document["_id"]: document
+            async for document in database.sellerStats.find(user_query, {"ratingSum": 1, "ratingCount": 1})
+        }
+        user_ids = [user["_id"] async for user in database.users.find(user_query, {"_id": 1})]
+        operations = []
+        for user_id in user_ids:
+            reputation = UserModel.stats_reputation(stats.get(user_id))
+            # Also drops the rating totals older versions kept on the user
+            operations.append(UpdateOne(
+                {"_id": user_id, "$or": [{"reputation": {"$ne": reputation}}, {"ratingCount": {"$exists": True}}]},
+                {"$set": {"reputation": reputation}, "$unset": {"ratingSum": "", "ratingCount": ""}}
+            ))
+        users = 0
+        for i in range(0, len(operations), 500):
+            users += (await database.users.bulk_write(operations[i:i + 500], ordered=False)).modified_count
+        
+        listings = 0
+        for user_id in user_ids:
+            listings += await UserModel.propagate_reputation(database, user_id)
+        return {"users": users, "listings": listings}
+    
+    @staticmethod
+    async def add_unread(users_collection, user_id, delta: int) -> None:
+        """Move a user's unread message total by delta, never below zero"""
+        if not delta:
+            return
+        try:
+            if delta > 0:
+                await users_collection.update_one({"_id": ObjectId(user_id)}, {"$inc": {"unreadTotal": delta}})
+            else:
+                await users_collection.update_one(
+                    {"_id": ObjectId(user_id)},
+                    [{"$set": {"unreadTotal": {"$max": [0, {"$add": [{"$ifNull": ["$unreadTotal", 0]}, delta]}]}}}]
+                )
+        except Exception as e:
+            # The total is derived from the chats' unread counters; rebuild-unread-totals repairs it
+            print(f"Failed to update unread total for {user_id}: {e}")
+    
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
@@ -1,18 +1,33 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from bson import ObjectId
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
+import os
 
-from app.database import get_users_collection, get_listings_collection
+from app.invalidation import invalidation_bus
+from app.shared_cache import SharedCache
+from app.browse_cache import bump_catalog_version
+from app.database import get_users_collection, get_listings_collection, get_analytics_collection, get_seller_stats_collection, get_jobs_collection, get_moderation_queue_collection, get_reports_collection
+from app.jobs import enqueue_job
 from app.models.user import UserModel
 from app.models.listing import ListingModel
+from app.models.analytics import AnalyticsModel
+from app.models.seller_stats import SellerStatsModel
+from app.models.job import JobModel
+from app.models.moderation import ModerationModel
 from app.schemas.user import User
 from app.schemas.listing import Listing
+from app.schemas.report import ModerationDecision, ReportStatus
 from app.schemas.response import SuccessResponse
 from app.routers.auth import get_current_user
 
 router = APIRouter()
 
+# Dashboard stats are refreshed often; serve them from the shared cache for a few seconds
+admin_stats_cache = SharedCache("admin_stats", float(os.getenv("ADMIN_STATS_CACHE_TTL", 30)))
+invalidation_bus.subscribe("catalog", lambda keys: admin_stats_cache.invalidate())
+
 async def get_admin_user(current_user: User = Depends(get_current_user)):
     """Dependency to ensure the current user is an admin"""
     if not current_user.is_admin:
@@ -193,7 +208,6 @@ async def delete_user_account(
         )
     
     users_collection = await get_users_collection()
-    listings_collection = await get_listings_collection()
     
     # Check if user exists
     user = await users_collection.find_one({"_id": ObjectId(user_id)})
@@ -217,16 +231,15 @@ async def delete_user_account(
             detail="Cannot delete other admin accounts"
         )
     
-    # Delete all user's listings
-    await listings_collection.delete_many({"sellerId": ObjectId(user_id)})
-    
-    # Delete the user account
+    # Delete the user account; listings, chats, ratings, reports and stats are
+    # removed in bounded batches by the background job queue
     result = await users_collection.delete_one({"_id": ObjectId(user_id)})
     
     if result.deleted_count == 1:
+        job_id = await enqueue_job("cascade_delete_user", {"user_id": user_id})
         return SuccessResponse(
-            message="User account and all associated data deleted successfully",
-            data={"user_id": user_id}
+            message="User account deleted; associated data is being removed in the background",
+            data={"user_id": user_id, "cleanup_job_id": job_id}
         )
     
     raise HTTPException(
@@ -234,6 +247,124 @@ async def delete_user_account(
         detail="Failed to delete user account"
     )
 
+@router.get("/jobs", response_model=List[dict])
+async def get_background_jobs(
+    admin_user: User = Depends(get_admin_user),
+    job_status: Optional[str] = Query(None, alias="status", description="Filter by job status"),
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of jobs")
+):
+    """Get recent background jobs, newest first (admin only)"""
+    jobs_collection = await get_jobs_collection()
+    
+    query = {"status": job_status} if job_status else {}
+    cursor = jobs_collection.find(query).sort("createdAt", -1).limit(limit)
+    return [JobModel.job_helper(job) async for job in cursor]
+
+@router.get("/moderation", response_model=dict)
+async def get_moderation_queue(
+    admin_user: User = Depends(get_admin_user),
+    queue_status: str = Query(ModerationModel.OPEN, alias="status", pattern="^(open|resolved|dismissed)$", description="Queue status"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of items"),
+    after: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page")
+):
+    """Reported targets, highest priority first, with keyset pagination (admin only)"""
+    queue_collection = await get_moderation_queue_collection()
+    
+    query = {"status": queue_status}
+    if after:
+        try:
+            after_priority, after_id = ModerationModel.decode_cursor(after)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        # Resume strictly after the last item seen, walking the (status, priority, _id) index
+        query["$or"] = [
+            {"priority": {"$lt": after_priority}},
+            {"priority": after_priority, "_id": {"$gt": after_id}}
+        ]
+    
+    cursor = queue_collection.find(query, {"reporterIds": 0}).sort([("priority", -1), ("_id", 1)]).limit(limit)
+    items = await cursor.to_list(limit)
+    
+    return {
+        "items": [ModerationModel.item_helper(item) for item in items],
+        "next_cursor": ModerationModel.encode_cursor(items[-1]) if len(items) == limit else None
+    }
+
+@router.post("/moderation/{item_id}/decision", response_model=SuccessResponse)
+async def decide_moderation_item(
+    item_id: str,
+    decision: ModerationDecision,
+    admin_user: User = Depends(get_admin_user)
+):
+    """Resolve or dismiss a reported target and its pending reports (admin only)"""
+    if decision.status not in (ReportStatus.RESOLVED, ReportStatus.DISMISSED):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Decision must be resolved or dismissed"
+        )
+    
+    queue_collection = await get_moderation_queue_collection()
+    now = datetime.utcnow()
+    item = await queue_collection.find_one_and_update(
+        {"_id": item_id},
+        {
+            "$set": {
+                "status": decision.status.value,
+                "resolutionNotes": decision.resolution_notes,
+                "resolvedAt": now,
+                "resolvedBy": ObjectId(admin_user.id)
+            }
+        }
+    )
+    
+    if not item:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Moderation item not found"
+        )
+    
+    reports_collection = await get_reports_collection()
+    await reports_collection.update_many(
+        {
+            "type": item["type"],
+            "targetId": item["targetId"],
+            "status": {"$in": [ReportStatus.PENDING.value, ReportStatus.UNDER_REVIEW.value]}
+        },
+        {
+            "$set": {
+                "status": decision.status.value,
+                "assignedTo": ObjectId(admin_user.id),
+                "resolutionNotes": decision.resolution_notes,
+                "resolvedAt": now
+            }
+        }
+    )
+    
+    # A dismissed report should not leave its listing hidden by the auto-hide threshold
+    if decision.status == ReportStatus.DISMISSED and item.get("autoHiddenAt"):
+        listings_collection = await get_listings_collection()
+        listing = await listings_collection.find_one_and_update(
+            {"_id": item["targetId"], "isHidden": True},
+            {"$set": {"isHidden": False, "updatedAt": now, "countedAt": now}}
+        )
+        await queue_collection.update_one({"_id": item_id}, {"$set": {"autoHiddenAt": None}})
+        if listing:
+            bump_catalog_version()
+            seller_stats_collection = await get_seller_stats_collection()
+            await SellerStatsModel.apply(
+                seller_stats_collection,
+                listing["sellerId"],
+                SellerStatsModel.listing_delta(listing, {**listing, "isHidden": False})
+            )
+    
+    return SuccessResponse(
+        message=f"Report {decision.status.value}",
+        data={"item_id": item_id}
+    )
+
 @router.get("/listings", response_model=List[Listing])
 async def get_all_listings(
     admin_user: User = Depends(get_admin_user),
@@ -299,6 +430,14 @@ async def delete_listing(
     result = await listings_collection.delete_one({"_id": ObjectId(listing_id)})
     
     if result.deleted_count == 1:
+        bump_catalog_version()
+        seller_stats_collection = await get_seller_stats_collection()
+        await SellerStatsModel.apply(seller_stats_collection, listing["sellerId"], {
+            "views": -listing.get("views", 0),
+            **SellerStatsModel.listing_delta(listing, None)
+        })
+        await enqueue_job("cascade_delete_listing", {"listing_id": listing_id})
+        
         return SuccessResponse(
             message="Listing deleted successfully",
             data={"listing_id": listing_id}
@@ -309,33 +448,101 @@ async def delete_listing(
         detail="Failed to delete listing"
     )
 
+def _facet_count(facet_result: dict, name: str) -> int:
+    """Read a {"$count": "n"} sub-pipeline result out of a $facet document"""
+    counts = facet_result.get(name) or []
+    return counts[0]["n"] if counts else 0
+
 @router.get("/stats", response_model=dict)
 async def get_admin_stats(admin_user: User = Depends(get_admin_user)):
     """Get admin dashboard statistics"""
+    return await admin_stats_cache.get_or_load("stats", load_admin_stats)
+
+async def load_admin_stats() -> dict:
     users_collection = await get_users_collection()
     listings_collection = await get_listings_collection()
     
-    # Get user statistics
-    total_users = await users_collection.count_documents({})
-    banned_users = await users_collection.count_documents({"isBanned": True})
-    active_users = await users_collection.count_documents({"is_active": True, "isBanned": False})
+    # One $facet pass per collection instead of a count_documents call per number
+    users_pipeline = [
+        {
+            "$facet": {
+                "total": [{"$count": "n"}],
+                "banned": [{"$match": {"isBanned": True}}, {"$count": "n"}],
+                "active": [{"$match": {"is_active": True, "isBanned": False}}, {"$count": "n"}]
+            }
+        }
+    ]
+    listings_pipeline = [
+        {
+            "$facet": {
+                "total": [{"$count": "n"}],
+                "active": [{"$match": {"isSold": False, "isHidden": False}}, {"$count": "n"}],
+                "sold": [{"$match": {"isSold": True}}, {"$count": "n"}],
+                "hidden": [{"$match": {"isHidden": True}}, {"$count": "n"}]
+            }
+        }
+    ]
     
-    # Get listing statistics
-    total_listings = await listings_collection.count_documents({})
-    active_listings = await listings_collection.count_documents({"isSold": False, "isHidden": False})
-    sold_listings = await listings_collection.count_documents({"isSold": True})
-    hidden_listings = await listings_collection.count_documents({"isHidden": True})
+    user_facets, listing_facets = await asyncio.gather(
+        users_collection.aggregate(users_pipeline).to_list(1),
+        listings_collection.aggregate(listings_pipeline).to_list(1)
+    )
+    user_facets = user_facets[0] if user_facets else {}
+    listing_facets = listing_facets[0] if listing_facets else {}
     
-    return {
+    stats = {
         "users": {
-            "total": total_users,
-            "active": active_users,
-            "banned": banned_users
+            "total": _facet_count(user_facets, "total"),
+            "active": _facet_count(user_facets, "active"),
+            "banned": _facet_count(user_facets, "banned")
         },
         "listings": {
-            "total": total_listings,
-            "active": active_listings,
-            "sold": sold_listings,
-            "hidden": hidden_listings
+            "total": _facet_count(listing_facets, "total"),
+            "active": _facet_count(listing_facets, "active"),
+            "sold": _facet_count(listing_facets, "sold"),
+            "hidden": _facet_count(listing_facets, "hidden")
         }
-    }
\ No newline at end of file
+    }
+    
+    return stats
+
+@router.get("/analytics", response_model=dict)
+async def get_marketplace_analytics(
+    admin_user: User = Depends(get_admin_user),
+    granularity: str = Query("day", pattern="^(day|hour)$", description="Bucket size (day/hour)"),
+    start: Optional[datetime] = Query(None, description="Range start (UTC), defaults to 30 days before end"),
+    end: Optional[datetime] = Query(None, description="Range end (UTC, exclusive), defaults to now")
+):
+    """Get time-bucketed marketplace metrics from the analytics rollups (admin only)"""
+    end = AnalyticsModel.to_naive_utc(end) if end else datetime.utcnow()
+    start = AnalyticsModel.to_naive_utc(start) if start else end - timedelta(days=30)
+    
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must be before end"
+        )
+    
+    max_buckets = AnalyticsModel.MAX_BUCKETS[granularity]
+    if (end - start) / AnalyticsModel.GRANULARITIES[granularity] > max_buckets:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range too large: at most {max_buckets} {granularity} buckets per request"
+        )
+    
+    analytics_collection = await get_analytics_collection()
+    buckets = await AnalyticsModel.get_series(analytics_collection, granularity, start, end)
+    
+    totals = {field: 0 for field in AnalyticsModel.METRICS.values()}
+    for bucket in buckets:
+        for field in totals:
+            totals[field] += bucket[field]
+    totals["gmv"] = round(totals["gmv"], 2)
+    
+    return {
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "buckets": buckets,
+        "totals": totals
+    }
@@ -4,16 +4,20 @@ from fastapi.responses import JSONResponse
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from typing import Optional
 import os
 
-from app.database import get_users_collection
+from app.database import get_users_collection, get_analytics_collection, unique_index_missing
 from app.models.user import UserModel
+from app.models.analytics import AnalyticsModel
 from app.schemas.auth import LoginRequest, RegisterRequest, TokenResponse
 from app.schemas.user import User, UserCreate
 from app.schemas.response import SuccessResponse, ErrorResponse
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 async def initialize_admin_account():
     """Initialize the default admin account if it doesn't exist"""
@@ -37,8 +41,12 @@ async def initialize_admin_account():
         hashed_password = UserModel.get_password_hash("admin")
         admin_dict = UserModel.create_user_dict(admin_data, hashed_password)
         
-        await users_collection.insert_one(admin_dict)
-        print("Admin account created successfully")
+        try:
+            await users_collection.insert_one(admin_dict)
+            print("Admin account created successfully")
+        except DuplicateKeyError:
+            # Another request created it first
+            pass
 
 # Handle CORS preflight requests
 @router.options("/register")
@@ -106,6 +114,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     user_dict = UserModel.user_helper(user)
     return User(**user_dict)
 
+async def get_optional_current_user(token: Optional[str] = Depends(optional_oauth2_scheme)) -> Optional[User]:
+    """The signed-in user on routes that also serve anonymous visitors"""
+    if not token:
+        return None
+    try:
+        return await get_current_user(token)
+    except HTTPException:
+        return None
+
 @router.post("/register", response_model=SuccessResponse)
 async def register(user_data: RegisterRequest):
     print(f"Received registration data: {user_data}")
@@ -113,28 +130,41 @@ async def register(user_data: RegisterRequest):
     
     users_collection = await get_users_collection()
     
-    # Check if user already exists
-    existing_user = await users_collection.find_one({"email": user_data.email})
-    if existing_user:
+    # Hash password and create user
+    hashed_password = UserModel.get_password_hash(user_data.password)
+    user_dict = UserModel.create_user_dict(user_data.dict(), hashed_password)
+    
+    # Unique indexes on the normalized email and username reject taken ones; where one
+    # could not be built, look the value up first
+    missing_keys = [key for key in ("emailKey", "userNameKey") if unique_index_missing("users", key)]
+    taken = await UserModel.taken_field(users_collection, user_dict, missing_keys) if missing_keys else None
+    if taken == "email":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
-    
-    existing_username = await users_collection.find_one({"username": user_data.username})
-    if existing_username:
+    if taken == "username":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already taken"
+        )
+    try:
+        result = await users_collection.insert_one(user_dict)
+    except DuplicateKeyError as e:
+        if await UserModel.duplicate_field(users_collection, e, user_dict) == "email":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already taken"
         )
-    
-    # Hash password and create user
-    hashed_password = UserModel.get_password_hash(user_data.password)
-    user_dict = UserModel.create_user_dict(user_data.dict(), hashed_password)
-    
-    result = await users_collection.insert_one(user_dict)
     
     if result.inserted_id:
+        analytics_collection = await get_analytics_collection()
+        await AnalyticsModel.record(analytics_collection, newUsers=1)
+        
         return SuccessResponse(
             message="User registered successfully",
             data={"user_id": str(result.inserted_id)}
@@ -1,15 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import List, Optional
 from datetime import datetime
+import asyncio
 import math
 
-from app.database import get_chats_collection, get_messages_collection, get_users_collection
+from app.database import get_chats_collection, get_users_collection, get_analytics_collection
+from app.message_store import message_store
+from app.message_archive import get_chat_messages_page
+from app.message_search import MessageSearch
 from app.models.chat import ChatModel, MessageModel
-from app.schemas.chat import Chat, ChatCreate, Message, MessageCreate, ChatResponse, ChatWithMessages
+from app.models.user import UserModel
+from app.models.analytics import AnalyticsModel
+from app.schemas.chat import Chat, ChatCreate, Message, MessageCreate, ChatResponse, ChatWithMessages, MessageSearchResponse, UnreadCountResponse
 from app.schemas.user import User
 from app.schemas.response import SuccessResponse
 from app.routers.auth import get_current_user
+from app.blocks import get_block_set
 
 router = APIRouter()
 
@@ -21,15 +30,10 @@ async def get_user_chats(
 ):
     """Get user's chat conversations"""
     chats_collection = await get_chats_collection()
-    users_collection = await get_users_collection()
     
-    # Build query for chats where user is participant
-    query = {
-        "$or": [
-            {"participantAId": ObjectId(current_user.id)},
-            {"participantBId": ObjectId(current_user.id)}
-        ]
-    }
+    # Chats where user is participant (multikey index on participantIds), minus chats
+    # with users blocked in either direction
+    query = ChatModel.participants_query(current_user.id, await get_block_set(current_user))
     
     # Count total chats
     total = await chats_collection.count_documents(query)
@@ -38,21 +42,10 @@ async def get_user_chats(
     skip = (page - 1) * per_page
     cursor = chats_collection.find(query).sort("lastMessageAt", -1).skip(skip).limit(per_page)
     
+    # Participant names are denormalized on the chat document
     chats = []
     async for chat in cursor:
-        chat_data = ChatModel.chat_helper(chat)
-        
-        # Get other participant's info
-        other_user_id = chat["participantBId"] if str(chat["participantAId"]) == current_user.id else chat["participantAId"]
-        other_user = await users_collection.find_one({"_id": other_user_id})
-        
-        if other_user:
-            if str(chat["participantAId"]) == current_user.id:
-                chat_data["participant_b_name"] = other_user.get("fullName")
-            else:
-                chat_data["participant_a_name"] = other_user.get("fullName")
-        
-        chats.append(chat_data)
+        chats.append(ChatModel.chat_helper(chat))
     
     return ChatResponse(
         chats=chats,
@@ -65,21 +58,49 @@ async def create_chat(
     current_user: User = Depends(get_current_user)
 ):
     """Create a new chat conversation"""
+    if not ChatModel.validate_object_id(chat_data.participant_b_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid participant ID"
+        )
+    
+    if ObjectId(chat_data.participant_b_id) in await get_block_set(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You cannot start a chat with this user"
+        )
+    
     chats_collection = await get_chats_collection()
     
-    # Check if chat already exists between these users
-    existing_chat = await chats_collection.find_one({
-        "$or": [
-            {
-                "participantAId": ObjectId(current_user.id),
-                "participantBId": ObjectId(chat_data.participant_b_id)
-            },
-            {
-                "participantAId": ObjectId(chat_data.participant_b_id),
-                "participantBId": ObjectId(current_user.id)
-            }
-        ]
-    })
+    # Look up the other participant so their name can be stored on the chat
+    users_collection = await get_users_collection()
+    other_user = await users_collection.find_one({"_id": ObjectId(chat_data.participant_b_id)}, {"fullName": 1})
+    if not other_user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    # Create the chat unless one already exists for this pair, in one atomic upsert on the
+    # unique pairKey; the returned pre-image is None exactly when this call inserted it
+    chat_dict = ChatModel.create_chat_dict(
+        current_user.id,
+        chat_data.participant_b_id,
+        current_user.full_name,
+        other_user.get("fullName")
+    )
+    chat_dict["_id"] = ObjectId()
+    try:
+        existing_chat = await chats_collection.find_one_and_update(
+            {"pairKey": chat_dict["pairKey"]},
+            {"$setOnInsert": chat_dict},
+            projection={"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Lost a race with a concurrent create for the same pair
+        existing_chat = await chats_collection.find_one({"pairKey": chat_dict["pairKey"]}, {"_id": 1})
     
     if existing_chat:
         return SuccessResponse(
@@ -87,19 +108,43 @@ async def create_chat(
             data={"chat_id": str(existing_chat["_id"])}
         )
     
-    # Create new chat
-    chat_dict = ChatModel.create_chat_dict(current_user.id, chat_data.participant_b_id)
-    result = await chats_collection.insert_one(chat_dict)
-    
-    if result.inserted_id:
-        return SuccessResponse(
-            message="Chat created successfully",
-            data={"chat_id": str(result.inserted_id)}
+    return SuccessResponse(
+        message="Chat created successfully",
+        data={"chat_id": str(chat_dict["_id"])}
+    )
+
+@router.get("/unread-count", response_model=UnreadCountResponse)
+async def get_unread_count(current_user: User = Depends(get_current_user)):
+    """Total unread messages across all of the user's chats"""
+    users_collection = await get_users_collection()
+    user = await users_collection.find_one({"_id": ObjectId(current_user.id)}, {"unreadTotal": 1})
+    return UnreadCountResponse(unread_total=(user or {}).get("unreadTotal", 0))
+
+@router.get("/search", response_model=MessageSearchResponse)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200, description="Words or \"phrase\" to search for"),
+    chat_id: Optional[str] = Query(None, description="Only search this chat"),
+    page: int = Query(1, ge=1, description="Page number"),
+    per_page: int = Query(20, ge=1, le=50, description="Results per page"),
+    current_user: User = Depends(get_current_user)
+):
+    """Search the messages of the user's chats, best matches first"""
+    if chat_id and not ChatModel.validate_object_id(chat_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid chat ID"
         )
     
-    raise HTTPException(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        detail="Failed to create chat"
+    # Search entries exist per participant, so results are always limited to the user's chats
+    skip = (page - 1) * per_page
+    results, total = await MessageSearch.search(current_user.id, q, skip, per_page, chat_id)
+    
+    return MessageSearchResponse(
+        results=results,
+        total=total,
+        page=page,
+        per_page=per_page,
+        total_pages=math.ceil(total / per_page)
     )
 
 @router.get("/{chat_id}/messages", response_model=List[Message])
@@ -117,16 +162,9 @@ async def get_chat_messages(
         )
     
     chats_collection = await get_chats_collection()
-    messages_collection = await get_messages_collection()
     
     # Verify user is participant in this chat
-    chat = await chats_collection.find_one({
-        "_id": ObjectId(chat_id),
-        "$or": [
-            {"participantAId": ObjectId(current_user.id)},
-            {"participantBId": ObjectId(current_user.id)}
-        ]
-    })
+    chat = await chats_collection.find_one(ChatModel.participant_filter(chat_id, current_user.id))
     
     if not chat:
         raise HTTPException(
@@ -134,15 +172,12 @@ async def get_chat_messages(
             detail="Chat not found or access denied"
         )
     
-    # Get messages with pagination (oldest first for chronological order)
+    # Get messages with pagination (oldest first for chronological order); pages far
+    # enough back are served from the message archive
     skip = (page - 1) * per_page
-    cursor = messages_collection.find({"chatId": ObjectId(chat_id)}).sort("createdAt", 1).skip(skip).limit(per_page)
-    
-    messages = []
-    async for message in cursor:
-        messages.append(MessageModel.message_helper(message))
+    page_messages = await get_chat_messages_page(chat, skip, per_page)
     
-    return messages
+    return [MessageModel.message_helper(message, chat) for message in page_messages]
 
 @router.post("/{chat_id}/messages", response_model=SuccessResponse)
 async def send_message(
@@ -165,52 +200,61 @@ async def send_message(
         )
     
     chats_collection = await get_chats_collection()
-    messages_collection = await get_messages_collection()
+    blocked_ids = await get_block_set(current_user)
     
-    # Verify user is participant in this chat
-    chat = await chats_collection.find_one({
-        "_id": ObjectId(chat_id),
-        "$or": [
-            {"participantAId": ObjectId(current_user.id)},
-            {"participantBId": ObjectId(current_user.id)}
-        ]
-    })
+    # The participant-filtered find_one_and_update checks membership and records the
+    # message on the chat in one write; only then is the message itself stored, under
+    # the ID generated here
+    message_dict = MessageModel.create_message_dict(chat_id, current_user.id, message_data.text)
+    message_dict["_id"] = ObjectId()
+    chat = await chats_collection.find_one_and_update(
+        ChatModel.participant_filter(chat_id, current_user.id, blocked_ids),
+        ChatModel.new_message_update(message_dict),
+        projection={
+            "participantAId": 1, "participantBId": 1, "blocked": 1,
+            "lastMessage": 1, "lastMessageAt": 1, "lastMessageId": 1
+        }
+    )
     
     if not chat:
+        # Only a failed send pays for telling a block apart from a missing chat
+        if blocked_ids and await chats_collection.find_one(ChatModel.participant_filter(chat_id, current_user.id), {"_id": 1}):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You cannot message this user"
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Chat not found or access denied"
         )
     
-    # Create message
-    message_dict = MessageModel.create_message_dict(chat_id, current_user.id, message_data.text)
-    result = await messages_collection.insert_one(message_dict)
-    
-    if result.inserted_id:
-        # Update chat with last message info
-        now = datetime.utcnow()
-        await chats_collection.update_one(
-            {"_id": ObjectId(chat_id)},
-            {
-                "$set": {
-                    "lastMessage": message_data.text,
-                    "lastMessageAt": now,
-                    "updatedAt": now
-                },
-                "$inc": {
-                    f"unreadCount.{'b' if str(chat['participantAId']) == current_user.id else 'a'}": 1
-                }
-            }
-        )
-        
-        return SuccessResponse(
-            message="Message sent successfully",
-            data={"message_id": str(result.inserted_id)}
+    try:
+        await message_store.insert(message_dict)
+    except Exception as e:
+        print(f"Failed to store message {message_dict['_id']} in chat {chat_id}: {e}")
+        # Don't leave the chat pointing at (and counting) a message that doesn't exist
+        await chats_collection.update_one({"_id": chat["_id"]}, ChatModel.retract_message_update(message_dict, chat))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to send message"
         )
     
-    raise HTTPException(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        detail="Failed to send message"
+    MessageSearch.index_message_later(message_dict, [chat["participantAId"], chat["participantBId"]])
+    
+    # The recipient's global unread badge moves with the chat's unread counter, unless a
+    # block hides the chat (a send can slip past a block cache that is a moment stale)
+    recipient_id = chat["participantBId"] if str(chat["participantAId"]) == current_user.id else chat["participantAId"]
+    counted = str(recipient_id) != current_user.id and not chat.get("blocked")
+    users_collection = await get_users_collection()
+    analytics_collection = await get_analytics_collection()
+    await asyncio.gather(
+        UserModel.add_unread(users_collection, recipient_id, 1 if counted else 0),
+        AnalyticsModel.record(analytics_collection, messagesSent=1)
+    )
+    
+    return SuccessResponse(
+        message="Message sent successfully",
+        data={"message_id": str(message_dict["_id"])}
     )
 
 @router.put("/{chat_id}/mark-read", response_model=SuccessResponse)
@@ -226,16 +270,9 @@ async def mark_messages_read(
         )
     
     chats_collection = await get_chats_collection()
-    messages_collection = await get_messages_collection()
     
     # Verify user is participant in this chat
-    chat = await chats_collection.find_one({
-        "_id": ObjectId(chat_id),
-        "$or": [
-            {"participantAId": ObjectId(current_user.id)},
-            {"participantBId": ObjectId(current_user.id)}
-        ]
-    })
+    chat = await chats_collection.find_one(ChatModel.participant_filter(chat_id, current_user.id))
     
     if not chat:
         raise HTTPException(
@@ -243,28 +280,27 @@ async def mark_messages_read(
             detail="Chat not found or access denied"
         )
     
-    # Mark messages as read
-    now = datetime.utcnow()
-    await messages_collection.update_many(
-        {
-            "chatId": ObjectId(chat_id),
-            "senderId": {"$ne": ObjectId(current_user.id)},
-            "isRead": False
-        },
+    # Move this user's read watermark and reset their unread count in one write;
+    # message read state is derived from the watermark, so no message is touched
+    user_key = ChatModel.participant_key(chat, current_user.id)
+    before = await chats_collection.find_one_and_update(
+        {"_id": ObjectId(chat_id)},
         {
             "$set": {
-                "isRead": True,
-                "readAt": now
+                f"readWatermarks.{user_key}": ChatModel.read_watermark_dict(chat, datetime.utcnow()),
+                f"unreadCount.{user_key}": 0
             }
-        }
+        },
+        projection={"unreadCount": 1, "blocked": 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    # Reset unread count for this user
-    user_key = "a" if str(chat["participantAId"]) == current_user.id else "b"
-    await chats_collection.update_one(
-        {"_id": ObjectId(chat_id)},
-        {"$set": {f"unreadCount.{user_key}": 0}}
-    )
+    # Take exactly what was cleared off the user's total, including messages that
+    # arrived after the membership check above; a blocked chat's are already off it
+    cleared = ((before or {}).get("unreadCount") or {}).get(user_key, 0)
+    if cleared and not (before or {}).get("blocked"):
+        users_collection = await get_users_collection()
+        await UserModel.add_unread(users_collection, current_user.id, -cleared)
     
     return SuccessResponse(
         message="Messages marked as read"
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from typing import List, Optional
+import os
 
 from app.database import (
     get_featured_products_collection,
@@ -12,14 +13,24 @@ from app.schemas.featured import HomePageData, FeaturedProduct, CategoryStats
 from app.schemas.listing import Listing
 from app.schemas.user import User
 from app.routers.auth import get_current_user
+from app.invalidation import invalidation_bus
+from app.shared_cache import SharedCache
 
 router = APIRouter()
 
+# The home page and category stats are the same for everyone; all workers share one copy
+home_cache = SharedCache("home", float(os.getenv("HOME_CACHE_TTL", 30)))
+invalidation_bus.subscribe("catalog", lambda keys: home_cache.invalidate())
+
 @router.get("/", response_model=HomePageData)
 async def get_home_page_data(
     current_user: Optional[User] = Depends(get_current_user)
 ):
     """Get data for home page including featured products, recent listings, and stats"""
+    return await home_cache.get_or_load("page", load_home_page_data)
+
+async def load_home_page_data() -> HomePageData:
+    """Query featured products, recent listings and stats for the home page"""
     featured_collection = await get_featured_products_collection()
     listings_collection = await get_listings_collection()
     users_collection = await get_users_collection()
@@ -38,15 +49,7 @@ async def get_home_page_data(
         })
         
         if product:
-            product_data = ListingModel.listing_helper(product)
-            
-            # Get seller info
-            seller = await users_collection.find_one({"_id": product["sellerId"]})
-            if seller:
-                product_data["seller_name"] = seller.get("fullName")
-                product_data["seller_email"] = seller.get("email")
-            
-            featured_data["product"] = product_data
+            featured_data["product"] = await ListingModel.listing_helper(product)
             featured_products.append(featured_data)
     
     # Get recent products (last 10 active listings)
@@ -57,15 +60,7 @@ async def get_home_page_data(
     }).sort("createdAt", -1).limit(10)
     
     async for product in recent_cursor:
-        product_data = ListingModel.listing_helper(product)
-        
-        # Get seller info
-        seller = await users_collection.find_one({"_id": product["sellerId"]})
-        if seller:
-            product_data["seller_name"] = seller.get("fullName")
-            product_data["seller_email"] = seller.get("email")
-        
-        recent_products.append(product_data)
+        recent_products.append(await ListingModel.listing_helper(product))
     
     # Get category statistics
     category_stats = []
@@ -110,6 +105,10 @@ async def get_home_page_data(
 @router.get("/categories", response_model=List[CategoryStats])
 async def get_category_stats():
     """Get statistics for all product categories"""
+    return await home_cache.get_or_load("categories", load_category_stats)
+
+async def load_category_stats() -> List[CategoryStats]:
+    """Aggregate listing counts and average prices per category"""
     listings_collection = await get_listings_collection()
     
     pipeline = [
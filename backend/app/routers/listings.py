@@ -2,17 +2,41 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from bson import ObjectId
 from typing import List, Optional
 from datetime import datetime
+import asyncio
 import math
+import os
 
-from app.database import get_listings_collection, get_users_collection, get_ratings_collection
+from app.database import get_listings_collection, get_users_collection, get_ratings_collection, get_transactions_collection, get_analytics_collection, get_seller_stats_collection
 from app.models.listing import ListingModel
+from app.models.transaction import TransactionModel
+from app.models.analytics import AnalyticsModel
+from app.models.seller_stats import SellerStatsModel
+from app.jobs import enqueue_job
+from app.cache import TTLCache
+from app.browse_cache import browse_cache, browse_filter_key, bump_catalog_version
+from app.single_flight import single_flight
 from app.schemas.listing import Listing, ListingCreate, ListingUpdate, ListingResponse, ListingCategory, ListingStatus, PurchaseRequest, PurchaseResponse
 from app.schemas.user import User
 from app.schemas.response import SuccessResponse
-from app.routers.auth import get_current_user
+from app.routers.auth import get_current_user, get_optional_current_user
+from app.blocks import get_block_set
 
 router = APIRouter()
 
+# Facet counts per normalized browse filter; they only steer the filter sidebar, so a
+# short staleness window is fine
+listing_facets_cache = TTLCache(float(os.getenv("LISTING_FACETS_CACHE_TTL", 60)), max_entries=1000)
+
+async def get_listing_facets(listings_collection, query: dict) -> dict:
+    """Facet counts for a browse query, from the cache or one $facet aggregation"""
+    key = (browse_cache.version, browse_filter_key(query))
+    facets = listing_facets_cache.get(key)
+    if facets is None:
+        result = await listings_collection.aggregate(ListingModel.facet_pipeline(query)).to_list(1)
+        facets = ListingModel.facets_helper(result[0] if result else None)
+        listing_facets_cache.set(key, facets)
+    return facets
+
 @router.get("/", response_model=ListingResponse)
 async def get_listings(
     page: int = Query(1, ge=1, description="Page number"),
@@ -22,12 +46,14 @@ async def get_listings(
     search: Optional[str] = Query(None, description="Search in title and description"),
     min_price: Optional[float] = Query(None, ge=0, description="Minimum price"),
     max_price: Optional[float] = Query(None, ge=0, description="Maximum price"),
-    sort_by: str = Query("created_at", description="Sort field"),
-    sort_order: str = Query("desc", description="Sort order (asc/desc)")
+    condition: Optional[str] = Query(None, description="Filter by condition"),
+    sort_by: str = Query("created_at", description="Sort field (seller_reputation ranks by seller reputation)"),
+    sort_order: str = Query("desc", description="Sort order (asc/desc)"),
+    facets: bool = Query(False, description="Also return category, price range and condition counts"),
+    current_user: Optional[User] = Depends(get_optional_current_user)
 ):
     """Get listings with filtering, searching, and pagination"""
     listings_collection = await get_listings_collection()
-    users_collection = await get_users_collection()
     
     # Build query
     query = {"isHidden": False}  # Always exclude hidden products
@@ -37,6 +63,8 @@ async def get_listings(
         query["isSold"] = True
     if category:
         query["category"] = category
+    if condition:
+        query["condition"] = condition
     if search:
         query["$or"] = [
             {"title": {"$regex": search, "$options": "i"}},
@@ -50,31 +78,57 @@ async def get_listings(
             price_query["$lte"] = max_price
         query["price"] = price_query
     
-    # Count total documents
-    total = await listings_collection.count_documents(query)
-    total_pages = math.ceil(total / per_page)
-    
-    # Calculate skip
-    skip = (page - 1) * per_page
+    # Signed-in users don't see sellers blocked in either direction; a plain $nin on
+    # sellerId is an extra filter that leaves the choice of index unchanged
+    if current_user:
+        blocked_ids = await get_block_set(current_user)
+        if blocked_ids:
+            query["sellerId"] = {"$nin": list(blocked_ids)}
     
     # Build sort
     sort_direction = 1 if sort_order == "asc" else -1
     sort_query = [(sort_by, sort_direction)]
+    if sort_by == "seller_reputation":
+        # Reputation is copied onto listings so this sort can use the browse index
+        sort_query = [("sellerReputation", sort_direction), ("createdAt", -1)]
+    
+    # The first pages of unsearched, unpersonalized queries are served from the browse cache
+    cache_key = None
+    listing_page = None
+    if not search and "sellerId" not in query and page <= browse_cache.max_page:
+        cache_key = browse_cache.page_key(query, sort_query, page, per_page)
+        cached_page = browse_cache.get(cache_key)
+        if cached_page is not None:
+            listing_page = ListingResponse(**cached_page)
+    
+    if listing_page is None:
+        # Count total documents
+        total = await listings_collection.count_documents(query)
+        total_pages = math.ceil(total / per_page)
+        
+        # Calculate skip
+        skip = (page - 1) * per_page
+        
+        # Get listings
+        ratings_collection = await get_ratings_collection()
+        cursor = listings_collection.find(query).sort(sort_query).skip(skip).limit(per_page)
+        listings = []
+        async for listing in cursor:
+            listings.append(await ListingModel.listing_helper(listing, ratings_collection))
+        
+        listing_page = ListingResponse(
+            listings=listings,
+            total=total,
+            page=page,
+            per_page=per_page,
+            total_pages=total_pages
+        )
+        if cache_key is not None:
+            browse_cache.set(cache_key, listing_page.dict())
     
-    # Get listings
-    ratings_collection = await get_ratings_collection()
-    cursor = listings_collection.find(query).sort(sort_query).skip(skip).limit(per_page)
-    listings = []
-    async for listing in cursor:
-        listings.append(await ListingModel.listing_helper(listing, users_collection, ratings_collection))
-    
-    return ListingResponse(
-        listings=listings,
-        total=total,
-        page=page,
-        per_page=per_page,
-        total_pages=total_pages
-    )
+    if facets:
+        listing_page.facets = await get_listing_facets(listings_collection, query)
+    return listing_page
 
 @router.post("/{listing_id}/purchase", response_model=SuccessResponse)
 async def purchase_listing(
@@ -98,6 +152,8 @@ async def purchase_listing(
     
     listings_collection = await get_listings_collection()
     users_collection = await get_users_collection()
+    transactions_collection = await get_transactions_collection()
+    analytics_collection = await get_analytics_collection()
     
     # Get the listing
     listing = await listings_collection.find_one({"_id": ObjectId(listing_id)})
@@ -213,9 +269,11 @@ async def purchase_listing(
         
         # Update listing stock
         remaining_stock = current_stock - purchase_request.quantity
+        now = datetime.utcnow()
         listing_update_data = {
             "stock": remaining_stock,
-            "updatedAt": datetime.utcnow()
+            "updatedAt": now,
+            "countedAt": now
         }
         
         # If no stock remaining, mark as sold
@@ -233,6 +291,8 @@ async def purchase_listing(
             {"$set": listing_update_data}
         )
         
+        bump_catalog_version()
+        
         if listing_update_result.modified_count == 0:
             # Rollback both user balances if listing update fails
             await users_collection.update_one(
@@ -250,7 +310,24 @@ async def purchase_listing(
         
         # Generate a simple transaction ID
         transaction_id = f"tx_{listing_id}_{current_user.id}_{int(datetime.utcnow().timestamp())}"
+
+        # Keep a purchase record (source of truth for analytics rebuilds) and bump the rollups
+        transaction_dict = TransactionModel.create_transaction_dict(
+            transaction_id, listing, current_user.id, purchase_request.quantity, total_cost
+        )
+        try:
+            await transactions_collection.insert_one(transaction_dict)
+        except Exception as e:
+            print(f"Failed to record transaction {transaction_id}: {e}")
+        await AnalyticsModel.record(analytics_collection, purchases=1, gmv=total_cost)
         
+        seller_stats_collection = await get_seller_stats_collection()
+        await SellerStatsModel.apply(seller_stats_collection, listing["sellerId"], {
+            "unitsSold": purchase_request.quantity,
+            "revenue": total_cost,
+            **SellerStatsModel.listing_delta(listing, {**listing, **listing_update_data})
+        })
+
         return SuccessResponse(
             message="Purchase completed successfully!",
             data={
@@ -284,24 +361,31 @@ async def get_listing(listing_id: str):
         )
     
     listings_collection = await get_listings_collection()
-    users_collection = await get_users_collection()
-    ratings_collection = await get_ratings_collection()
-    listing = await listings_collection.find_one({"_id": ObjectId(listing_id)})
     
-    if not listing:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Listing not found"
-        )
+    async def load_listing() -> dict:
+        ratings_collection = await get_ratings_collection()
+        listing = await listings_collection.find_one({"_id": ObjectId(listing_id)})
+        if not listing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Listing not found"
+            )
+        return await ListingModel.listing_helper(listing, ratings_collection)
     
-    # Increment view count
-    await listings_collection.update_one(
-        {"_id": ObjectId(listing_id)},
-        {"$inc": {"views": 1}}
+    # Concurrent requests for the same listing share one read; every view is still counted
+    listing_data = await single_flight.do(("listing", listing_id), load_listing)
+    
+    # Increment view count on the listing and the seller's dashboard stats
+    seller_stats_collection = await get_seller_stats_collection()
+    await asyncio.gather(
+        listings_collection.update_one(
+            {"_id": ObjectId(listing_id)},
+            {"$inc": {"views": 1}}
+        ),
+        SellerStatsModel.apply(seller_stats_collection, ObjectId(listing_data["seller_id"]), {"views": 1})
     )
-    listing["views"] = listing.get("views", 0) + 1
     
-    return await ListingModel.listing_helper(listing, users_collection, ratings_collection)
+    return {**listing_data, "views": listing_data["views"] + 1}
 
 @router.post("/", response_model=SuccessResponse)
 async def create_listing(
@@ -322,12 +406,22 @@ async def create_listing(
         listing_data.dict(),
         current_user.id,
         current_user.email,
-        current_user.full_name
+        current_user.full_name,
+        current_user.seller_reputation
     )
     
     result = await listings_collection.insert_one(listing_dict)
     
     if result.inserted_id:
+        bump_catalog_version()
+        analytics_collection = await get_analytics_collection()
+        await AnalyticsModel.record(analytics_collection, newListings=1)
+        
+        seller_stats_collection = await get_seller_stats_collection()
+        await SellerStatsModel.apply(
+            seller_stats_collection, current_user.id, SellerStatsModel.listing_delta(None, listing_dict)
+        )
+        
         return SuccessResponse(
             message="Listing created successfully",
             data={"listing_id": str(result.inserted_id)}
@@ -381,6 +475,12 @@ async def update_listing(
     )
     
     if result.modified_count:
+        bump_catalog_version()
+        seller_stats_collection = await get_seller_stats_collection()
+        await SellerStatsModel.apply(
+            seller_stats_collection, current_user.id, SellerStatsModel.listing_delta(listing, {**listing, **update_data})
+        )
+        
         return SuccessResponse(
             message="Listing updated successfully",
             data={"updated_fields": list(update_data.keys())}
@@ -406,12 +506,20 @@ async def delete_listing(
     listings_collection = await get_listings_collection()
     
     # Check if listing exists and belongs to current user
-    result = await listings_collection.delete_one({
+    deleted_listing = await listings_collection.find_one_and_delete({
         "_id": ObjectId(listing_id),
         "sellerId": ObjectId(current_user.id)
     })
     
-    if result.deleted_count:
+    if deleted_listing:
+        bump_catalog_version()
+        seller_stats_collection = await get_seller_stats_collection()
+        await SellerStatsModel.apply(seller_stats_collection, current_user.id, {
+            "views": -deleted_listing.get("views", 0),
+            **SellerStatsModel.listing_delta(deleted_listing, None)
+        })
+        await enqueue_job("cascade_delete_listing", {"listing_id": listing_id})
+        
         return SuccessResponse(
             message="Listing deleted successfully"
         )
@@ -429,7 +537,6 @@ async def get_my_listings(
 ):
     """Get current user's listings"""
     listings_collection = await get_listings_collection()
-    users_collection = await get_users_collection()
     
     query = {"sellerId": ObjectId(current_user.id)}
     
@@ -445,7 +552,7 @@ async def get_my_listings(
     cursor = listings_collection.find(query).sort("created_at", -1).skip(skip).limit(per_page)
     listings = []
     async for listing in cursor:
-        listings.append(await ListingModel.listing_helper(listing, users_collection, ratings_collection))
+        listings.append(await ListingModel.listing_helper(listing, ratings_collection))
     
     return ListingResponse(
         listings=listings,
@@ -1,16 +1,80 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from typing import List, Optional
 
-from app.database import get_ratings_collection, get_listings_collection, get_users_collection
+from app.browse_cache import bump_catalog_version
+from app.database import get_database, get_ratings_collection, get_listings_collection, get_seller_stats_collection, unique_index_missing
+from app.jobs import enqueue_job
 from app.models.rating import RatingModel
-from app.schemas.rating import Rating, RatingCreate, RatingUpdate, RatingResponse
+from app.models.seller_stats import SellerStatsModel
+from app.models.user import UserModel
+from app.schemas.rating import Rating, RatingCreate, RatingUpdate, RatingResponse, RatingSummary, RatingSummaryResponse
 from app.schemas.user import User
 from app.schemas.response import SuccessResponse
 from app.routers.auth import get_current_user
 
 router = APIRouter()
 
+MAX_SUMMARY_LISTINGS = 100
+
+async def get_rating_seller_id(rating: dict):
+    """Seller of the rated listing (stored on newer ratings, looked up for older ones)"""
+    if rating.get("sellerId"):
+        return rating["sellerId"]
+    listings_collection = await get_listings_collection()
+    listing = await listings_collection.find_one({"_id": rating["listingId"]}, {"sellerId": 1})
+    return listing["sellerId"] if listing else None
+
+async def apply_seller_rating(seller_id, increments: dict) -> None:
+    """Fold a rating change into the seller's stats and the reputation derived from them"""
+    seller_stats_collection = await get_seller_stats_collection()
+    await SellerStatsModel.apply(seller_stats_collection, seller_id, increments)
+    
+    database = await get_database()
+    if await UserModel.refresh_reputation(database, seller_id) is not None:
+        # Listings carry a copy for browse ranking; refresh them in the background
+        await enqueue_job(
+            "propagate_seller_reputation",
+            {"user_id": str(seller_id)},
+            dedupe_key=f"propagate_seller_reputation:{seller_id}"
+        )
+
+@router.get("/summary", response_model=RatingSummaryResponse)
+async def get_ratings_summary(
+    listing_ids: str = Query(..., description=f"Comma-separated listing IDs (up to {MAX_SUMMARY_LISTINGS})")
+):
+    """Get average rating, count and distribution for many listings at once"""
+    ids = list(dict.fromkeys(listing_id.strip() for listing_id in listing_ids.split(",") if listing_id.strip()))
+    if not ids or len(ids) > MAX_SUMMARY_LISTINGS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Provide between 1 and {MAX_SUMMARY_LISTINGS} listing IDs"
+        )
+    if not all(RatingModel.validate_object_id(listing_id) for listing_id in ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid listing ID format"
+        )
+    
+    # One read of the maintained star histograms; listings without one are counted in one aggregation
+    listings_collection = await get_listings_collection()
+    object_ids = [ObjectId(listing_id) for listing_id in ids]
+    histograms = {
+        listing["_id"]: listing.get("stars")
+        async for listing in listings_collection.find({"_id": {"$in": object_ids}}, {"stars": 1})
+    }
+    missing = [listing_id for listing_id, stars in histograms.items() if stars is None]
+    if missing:
+        ratings_collection = await get_ratings_collection()
+        histograms.update(await RatingModel.count_stars(ratings_collection, missing))
+    
+    return RatingSummaryResponse(summaries=[
+        RatingSummary(listing_id=str(listing_id), **RatingModel.summary_from_stars(histograms[listing_id]))
+        for listing_id in object_ids
+        if listing_id in histograms
+    ])
+
 @router.get("/{listing_id}", response_model=RatingResponse)
 async def get_listing_ratings(
     listing_id: str,
@@ -42,12 +106,12 @@ async def get_listing_ratings(
     ratings_cursor = ratings_collection.find(query).sort("createdAt", -1).skip(skip).limit(per_page)
     ratings = await ratings_cursor.to_list(per_page)
     
-    total = await ratings_collection.count_documents(query)
-    
-    # Calculate average rating
-    average_rating, total_ratings = await RatingModel.calculate_listing_average_rating(
-        ratings_collection, listing_id
-    )
+    # Average, count and distribution come from the listing's star histogram
+    stars = listing.get("stars")
+    if stars is None:
+        # Listing not backfilled yet (maintenance.py rebuild-rating-stars)
+        stars = (await RatingModel.count_stars(ratings_collection, [listing["_id"]]))[listing["_id"]]
+    summary = RatingModel.summary_from_stars(stars)
     
     # Convert ratings to response format
     rating_list = []
@@ -57,9 +121,10 @@ async def get_listing_ratings(
     
     return RatingResponse(
         ratings=rating_list,
-        total=total,
-        average_rating=average_rating,
-        total_ratings=total_ratings
+        total=summary["total_ratings"],
+        average_rating=summary["average_rating"],
+        total_ratings=summary["total_ratings"],
+        distribution=summary["distribution"]
     )
 
 @router.post("/{listing_id}", response_model=SuccessResponse)
@@ -92,29 +157,42 @@ async def create_rating(
             detail="You cannot rate your own listing"
         )
     
-    # Check if user has already rated this listing
-    existing_rating = await ratings_collection.find_one({
-        "listingId": ObjectId(listing_id),
-        "userId": ObjectId(current_user.id)
-    })
-    
-    if existing_rating:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You have already rated this listing"
-        )
-    
     # Create rating
     rating_dict = RatingModel.create_rating_dict(
         rating_data.dict(),
         current_user.id,
         listing_id,
-        current_user.full_name
+        current_user.full_name,
+        str(listing["sellerId"])
     )
     
-    result = await ratings_collection.insert_one(rating_dict)
+    # The unique (listingId, userId) index rejects a second rating from the same user;
+    # without it (legacy duplicates not yet removed) look for one first
+    if unique_index_missing("ratings", "listingId", "userId") and await ratings_collection.find_one(
+        {"listingId": rating_dict["listingId"], "userId": rating_dict["userId"]}, {"_id": 1}
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You have already rated this listing"
+        )
+    try:
+        result = await ratings_collection.insert_one(rating_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You have already rated this listing"
+        )
     
     if result.inserted_id:
+        await RatingModel.apply_stars(
+            listings_collection, ratings_collection, listing["_id"], RatingModel.stars_increments(None, rating_dict["rating"])
+        )
+        bump_catalog_version()
+        await apply_seller_rating(listing["sellerId"], {
+            "ratingSum": rating_dict["rating"],
+            "ratingCount": 1
+        })
+        
         return SuccessResponse(message="Rating created successfully")
     
     raise HTTPException(
@@ -160,6 +238,18 @@ async def update_rating(
     )
     
     if result.modified_count:
+        rating_change = update_data.get("rating", rating["rating"]) - rating["rating"]
+        if rating_change:
+            listings_collection = await get_listings_collection()
+            await RatingModel.apply_stars(
+                listings_collection, ratings_collection, rating["listingId"],
+                RatingModel.stars_increments(rating["rating"], update_data["rating"])
+            )
+            bump_catalog_version()
+            seller_id = await get_rating_seller_id(rating)
+            if seller_id:
+                await apply_seller_rating(seller_id, {"ratingSum": rating_change})
+        
         return SuccessResponse(message="Rating updated successfully")
     
     raise HTTPException(
@@ -199,6 +289,18 @@ async def delete_rating(
     result = await ratings_collection.delete_one({"_id": ObjectId(rating_id)})
     
     if result.deleted_count:
+        listings_collection = await get_listings_collection()
+        await RatingModel.apply_stars(
+            listings_collection, ratings_collection, rating["listingId"], RatingModel.stars_increments(rating["rating"], None)
+        )
+        bump_catalog_version()
+        seller_id = await get_rating_seller_id(rating)
+        if seller_id:
+            await apply_seller_rating(seller_id, {
+                "ratingSum": -rating["rating"],
+                "ratingCount": -1
+            })
+        
         return SuccessResponse(message="Rating deleted successfully")
     
     raise HTTPException(
@@ -1,11 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from typing import List, Optional
 from datetime import datetime
 import math
+import os
 
-from app.database import get_reports_collection, get_users_collection, get_listings_collection
+from app.browse_cache import bump_catalog_version
+from app.database import get_reports_collection, get_users_collection, get_listings_collection, get_analytics_collection, get_moderation_queue_collection, get_seller_stats_collection, unique_index_missing
 from app.models.report import ReportModel
+from app.models.analytics import AnalyticsModel
+from app.models.moderation import ModerationModel
+from app.models.seller_stats import SellerStatsModel
 from app.schemas.report import Report, ReportCreate, ReportResponse, ReportType, ReportStatus
 from app.schemas.user import User
 from app.schemas.response import SuccessResponse
@@ -13,6 +19,28 @@ from app.routers.auth import get_current_user
 
 router = APIRouter()
 
+# Distinct reporters after which a listing is hidden pending review (0 disables)
+REPORT_AUTO_HIDE_THRESHOLD = int(os.getenv("REPORT_AUTO_HIDE_THRESHOLD", 5))
+
+async def auto_hide_listing(queue_item: dict) -> None:
+    """Hide a listing that has crossed the report threshold, once"""
+    listings_collection = await get_listings_collection()
+    now = datetime.utcnow()
+    listing = await listings_collection.find_one_and_update(
+        {"_id": queue_item["targetId"], "isHidden": {"$ne": True}},
+        {"$set": {"isHidden": True, "updatedAt": now, "countedAt": now}}
+    )
+    queue_collection = await get_moderation_queue_collection()
+    await queue_collection.update_one({"_id": queue_item["_id"]}, {"$set": {"autoHiddenAt": datetime.utcnow()}})
+    if listing:
+        bump_catalog_version()
+        seller_stats_collection = await get_seller_stats_collection()
+        await SellerStatsModel.apply(
+            seller_stats_collection,
+            listing["sellerId"],
+            SellerStatsModel.listing_delta(listing, {**listing, "isHidden": True})
+        )
+
 @router.post("/", response_model=SuccessResponse)
 async def create_report(
     report_data: ReportCreate,
@@ -21,19 +49,6 @@ async def create_report(
     """Create a new report"""
     reports_collection = await get_reports_collection()
     
-    # Check if user already reported this target
-    existing_report = await reports_collection.find_one({
-        "reporterId": ObjectId(current_user.id),
-        "targetId": ObjectId(report_data.target_id),
-        "type": report_data.type
-    })
-    
-    if existing_report:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You have already reported this item"
-        )
-    
     # Create report
     report_dict = ReportModel.create_report_dict(
         current_user.id,
@@ -42,7 +57,22 @@ async def create_report(
         report_data.description
     )
     
-    result = await reports_collection.insert_one(report_dict)
+    # The unique (reporterId, targetId, type) index rejects a second report from the same user;
+    # without it (legacy duplicates not yet removed) look for one first
+    if unique_index_missing("reports", "reporterId", "targetId", "type") and await reports_collection.find_one(
+        {"reporterId": report_dict["reporterId"], "targetId": report_dict["targetId"], "type": report_dict["type"]}, {"_id": 1}
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You have already reported this item"
+        )
+    try:
+        result = await reports_collection.insert_one(report_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You have already reported this item"
+        )
     
     if result.inserted_id:
         # Update the reported item if it's a product
@@ -52,6 +82,21 @@ async def create_report(
                 {"_id": ObjectId(report_data.target_id)},
                 {"$set": {"isReported": True}}
             )
+            bump_catalog_version()
+        
+        # Keep the target's moderation queue entry current so admins never group reports
+        queue_collection = await get_moderation_queue_collection()
+        queue_item = await ModerationModel.record_report(queue_collection, report_dict)
+        if (
+            report_data.type == ReportType.PRODUCT
+            and REPORT_AUTO_HIDE_THRESHOLD > 0
+            and queue_item["distinctReporters"] >= REPORT_AUTO_HIDE_THRESHOLD
+            and not queue_item.get("autoHiddenAt")
+        ):
+            await auto_hide_listing(queue_item)
+        
+        analytics_collection = await get_analytics_collection()
+        await AnalyticsModel.record(analytics_collection, reportsFiled=1)
         
         return SuccessResponse(
             message="Report submitted successfully",
@@ -1,10 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from typing import List
 from datetime import datetime
 
-from app.database import get_users_collection
+from app.database import get_database, get_users_collection, get_seller_stats_collection, unique_index_missing
+from app.jobs import enqueue_job
+from app.blocks import invalidate_block_cache
+from app.single_flight import single_flight
 from app.models.user import UserModel
+from app.models.chat import ChatModel
+from app.models.seller_stats import SellerStatsModel
 from app.schemas.user import User, UserUpdate, AddFundsRequest
 from app.schemas.response import SuccessResponse
 from app.routers.auth import get_current_user
@@ -38,31 +44,14 @@ async def update_user_profile(
     
     # Prepare update data - convert from snake_case schema to camelCase MongoDB format
     update_data = {}
+    # Emails and usernames taken by another user are rejected by unique indexes on the update
     if user_update.email is not None:
-        # Check if email is already taken by another user
-        existing_user = await users_collection.find_one({
-            "email": user_update.email,
-            "_id": {"$ne": ObjectId(current_user.id)}
-        })
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already taken"
-            )
         update_data["email"] = user_update.email
+        update_data["emailKey"] = UserModel.normalize_key(user_update.email)
     
     if user_update.username is not None:
-        # Check if username is already taken by another user
-        existing_user = await users_collection.find_one({
-            "userName": user_update.username,
-            "_id": {"$ne": ObjectId(current_user.id)}
-        })
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Username already taken"
-            )
         update_data["userName"] = user_update.username
+        update_data["userNameKey"] = UserModel.normalize_key(user_update.username)
     
     # Handle full_name from either full_name field or combined firstName/lastName
     if user_update.full_name is not None:
@@ -93,13 +82,48 @@ async def update_user_profile(
     
     update_data["updatedAt"] = datetime.utcnow()
     
+    # Where a unique index could not be built, look the new email/username up first
+    missing_keys = [key for key in ("emailKey", "userNameKey") if unique_index_missing("users", key)]
+    taken = await UserModel.taken_field(users_collection, update_data, missing_keys, current_user.id) if missing_keys else None
+    if taken == "email":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already taken"
+        )
+    if taken == "username":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already taken"
+        )
+    
     # Update user
-    result = await users_collection.update_one(
-        {"_id": ObjectId(current_user.id)},
-        {"$set": update_data}
-    )
+    try:
+        result = await users_collection.update_one(
+            {"_id": ObjectId(current_user.id)},
+            {"$set": update_data}
+        )
+    except DuplicateKeyError as e:
+        if await UserModel.duplicate_field(users_collection, e, update_data, current_user.id) == "email":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already taken"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already taken"
+        )
     
     if result.modified_count:
+        # Listings, ratings and chats store copies of the name/email; refresh them in the background
+        new_name = update_data.get("fullName")
+        new_email = update_data.get("email")
+        if (new_name and new_name != current_user.full_name) or (new_email and new_email != current_user.email):
+            await enqueue_job(
+                "propagate_user_profile",
+                {"user_id": current_user.id},
+                dedupe_key=f"propagate_user_profile:{current_user.id}"
+            )
+        
         return SuccessResponse(
             message="Profile updated successfully",
             data={"updated_fields": list(update_data.keys())}
@@ -110,10 +134,15 @@ async def update_user_profile(
         detail="Failed to update profile"
     )
 
-# Profile routes - must come before general /{user_id} route
-@router.get("/{user_id}/profile", response_model=dict)
-async def get_public_user_profile(user_id: str):
-    """Get public user profile information"""
+@router.get("/me/stats", response_model=dict)
+async def get_my_seller_stats(current_user: User = Depends(get_current_user)):
+    """Get current user's seller dashboard statistics"""
+    seller_stats_collection = await get_seller_stats_collection()
+    stats = await seller_stats_collection.find_one({"_id": ObjectId(current_user.id)})
+    return SellerStatsModel.stats_helper(current_user.id, stats)
+
+async def load_public_user_profile(user_id: str) -> dict:
+    """Build a user's public profile with their visible listings"""
     from app.database import get_listings_collection, get_ratings_collection
     
     users_collection = await get_users_collection()
@@ -147,7 +176,7 @@ async def get_public_user_profile(user_id: str):
     async for listing_doc in user_listings_cursor:
         from app.models.listing import ListingModel
         listing_data = await ListingModel.listing_helper(
-            listing_doc, users_collection, ratings_collection
+            listing_doc, ratings_collection
         )
         user_listings.append(listing_data)
     
@@ -156,19 +185,11 @@ async def get_public_user_profile(user_id: str):
     active_listings = len([l for l in user_listings if not l["is_sold"]])
     sold_listings = len([l for l in user_listings if l["is_sold"]])
     
-    # Calculate average rating as a seller (ratings on their listings)
-    listing_ids = [ObjectId(listing["id"]) for listing in user_listings]
-    
-    total_rating = 0
-    rating_count = 0
-    
-    if listing_ids:
-        ratings_cursor = ratings_collection.find({"listingId": {"$in": listing_ids}})
-        async for rating in ratings_cursor:
-            total_rating += rating.get("rating", 0)
-            rating_count += 1
-    
-    average_seller_rating = round(total_rating / rating_count, 1) if rating_count > 0 else None
+    # Rating totals as a seller come from their seller stats, the reputation from the user
+    seller_stats_collection = await get_seller_stats_collection()
+    seller_stats = SellerStatsModel.stats_helper(
+        user_id, await seller_stats_collection.find_one({"_id": user_obj_id}, {"ratingSum": 1, "ratingCount": 1})
+    )
     
     # Return public profile data
     return {
@@ -184,12 +205,20 @@ async def get_public_user_profile(user_id: str):
             "total_listings": total_listings,
             "active_listings": active_listings,
             "sold_listings": sold_listings,
-            "average_rating": average_seller_rating,
-            "total_ratings": rating_count
+            "average_rating": seller_stats["average_rating"],
+            "total_ratings": seller_stats["rating_count"],
+            "reputation": user.get("reputation", UserModel.reputation(0, 0))
         },
         "listings": user_listings
     }
 
+# Profile routes - must come before general /{user_id} route
+@router.get("/{user_id}/profile", response_model=dict)
+async def get_public_user_profile(user_id: str):
+    """Get public user profile information"""
+    # Concurrent requests for the same profile share one load
+    return await single_flight.do(("public_user_profile", user_id), lambda: load_public_user_profile(user_id))
+
 @router.get("/{user_id}/listings", response_model=List[dict])
 async def get_user_listings(user_id: str):
     """Get all listings by a specific user"""
@@ -227,7 +256,7 @@ async def get_user_listings(user_id: str):
     async for listing_doc in user_listings_cursor:
         from app.models.listing import ListingModel
         listing_data = await ListingModel.listing_helper(
-            listing_doc, users_collection, ratings_collection
+            listing_doc, ratings_collection
         )
         user_listings.append(listing_data)
     
@@ -253,6 +282,59 @@ async def get_user_by_id(user_id: str):
     
     return UserModel.user_helper(user)
 
+@router.post("/{user_id}/block", response_model=SuccessResponse)
+async def block_user(user_id: str, current_user: User = Depends(get_current_user)):
+    """Block a user: hides their listings and chats and stops messages both ways"""
+    if not UserModel.validate_object_id(user_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid user ID"
+        )
+    
+    if user_id == current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You cannot block yourself"
+        )
+    
+    users_collection = await get_users_collection()
+    if not await users_collection.find_one({"_id": ObjectId(user_id)}, {"_id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    await users_collection.update_one(
+        {"_id": ObjectId(current_user.id)},
+        {"$addToSet": {"blockedIds": ObjectId(user_id)}, "$set": {"updatedAt": datetime.utcnow()}}
+    )
+    invalidate_block_cache(current_user.id, user_id)
+    # Their chat disappears from both users' lists, so its unread messages leave both badges
+    await ChatModel.set_blocked(await get_database(), current_user.id, user_id, True)
+    
+    return SuccessResponse(message="User blocked")
+
+@router.delete("/{user_id}/block", response_model=SuccessResponse)
+async def unblock_user(user_id: str, current_user: User = Depends(get_current_user)):
+    """Remove a user from the block list"""
+    if not UserModel.validate_object_id(user_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid user ID"
+        )
+    
+    users_collection = await get_users_collection()
+    await users_collection.update_one(
+        {"_id": ObjectId(current_user.id)},
+        {"$pull": {"blockedIds": ObjectId(user_id)}, "$set": {"updatedAt": datetime.utcnow()}}
+    )
+    invalidate_block_cache(current_user.id, user_id)
+    # The chat stays hidden while the other user still blocks this one
+    if not await users_collection.find_one({"_id": ObjectId(user_id), "blockedIds": ObjectId(current_user.id)}, {"_id": 1}):
+        await ChatModel.set_blocked(await get_database(), current_user.id, user_id, False)
+    
+    return SuccessResponse(message="User unblocked")
+
 @router.delete("/account", response_model=SuccessResponse)
 async def delete_user_account(current_user: User = Depends(get_current_user)):
     """Delete current user's account"""
@@ -261,6 +343,8 @@ async def delete_user_account(current_user: User = Depends(get_current_user)):
     result = await users_collection.delete_one({"_id": ObjectId(current_user.id)})
     
     if result.deleted_count:
+        # Listings, chats, messages, ratings and reports are cleaned up by the job queue
+        await enqueue_job("cascade_delete_user", {"user_id": current_user.id})
         return SuccessResponse(
             message="Account deleted successfully"
         )
@@ -333,81 +417,8 @@ async def add_funds(
 @router.get("/{user_id}/profile", response_model=dict)
 async def get_public_user_profile(user_id: str):
     """Get public user profile information"""
-    from app.database import get_listings_collection, get_ratings_collection
-    
-    users_collection = await get_users_collection()
-    listings_collection = await get_listings_collection()
-    ratings_collection = await get_ratings_collection()
-    
-    # Get user info
-    try:
-        user_obj_id = ObjectId(user_id)
-    except:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid user ID format"
-        )
-    
-    user = await users_collection.find_one({"_id": user_obj_id})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    # Get user's active listings
-    user_listings_cursor = listings_collection.find({
-        "sellerId": user_obj_id,
-        "isHidden": {"$ne": True},
-        "isReported": {"$ne": True}
-    }).sort("createdAt", -1)
-    
-    user_listings = []
-    async for listing_doc in user_listings_cursor:
-        from app.models.listing import ListingModel
-        listing_data = await ListingModel.listing_helper(
-            listing_doc, users_collection, ratings_collection
-        )
-        user_listings.append(listing_data)
-    
-    # Calculate seller statistics
-    total_listings = len(user_listings)
-    active_listings = len([l for l in user_listings if not l["is_sold"]])
-    sold_listings = len([l for l in user_listings if l["is_sold"]])
-    
-    # Calculate average rating as a seller (ratings on their listings)
-    listing_ids = [ObjectId(listing["id"]) for listing in user_listings]
-    
-    total_rating = 0
-    rating_count = 0
-    
-    if listing_ids:
-        ratings_cursor = ratings_collection.find({"listingId": {"$in": listing_ids}})
-        async for rating in ratings_cursor:
-            total_rating += rating.get("rating", 0)
-            rating_count += 1
-    
-    average_seller_rating = round(total_rating / rating_count, 1) if rating_count > 0 else None
-    
-    # Return public profile data
-    return {
-        "user": {
-            "id": str(user["_id"]),
-            "username": user.get("userName", user.get("username")),
-            "full_name": user.get("fullName", user.get("full_name")),
-            "university": user.get("university"),
-            "bio": user.get("bio", ""),
-            "created_at": user.get("createdAt", user.get("created_at")),
-        },
-        "statistics": {
-            "total_listings": total_listings,
-            "active_listings": active_listings,
-            "sold_listings": sold_listings,
-            "average_rating": average_seller_rating,
-            "total_ratings": rating_count
-        },
-        "listings": user_listings
-    }
+    # Concurrent requests for the same profile share one load
+    return await single_flight.do(("public_user_profile", user_id), lambda: load_public_user_profile(user_id))
 
 @router.get("/{user_id}/listings", response_model=List[dict])
 async def get_user_listings(user_id: str):
@@ -445,7 +456,7 @@ async def get_user_listings(user_id: str):
     async for listing_doc in listings_cursor:
         from app.models.listing import ListingModel
         listing_data = await ListingModel.listing_helper(
-            listing_doc, users_collection, ratings_collection
+            listing_doc, ratings_collection
         )
         listings.append(listing_data)
     
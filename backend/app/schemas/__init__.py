@@ -2,7 +2,7 @@ from .user import User, UserCreate, UserUpdate, UserLogin, Token, TokenData
 from .listing import Listing, ListingCreate, ListingUpdate, ListingResponse, ListingCategory, ListingStatus
 from .auth import LoginRequest, RegisterRequest, TokenResponse
 from .response import BaseResponse, ErrorResponse, SuccessResponse, PaginatedResponse
-from .chat import Chat, ChatCreate, Message, MessageCreate, ChatResponse, ChatWithMessages
+from .chat import Chat, ChatCreate, Message, MessageCreate, ChatResponse, ChatWithMessages, MessageSearchResult, MessageSearchResponse, UnreadCountResponse
 from .report import Report, ReportCreate, ReportResponse, ReportType, ReportStatus
 from .featured import FeaturedProduct, FeaturedProductCreate, HomePageData, CategoryStats
 
@@ -11,7 +11,7 @@ __all__ = [
     "Listing", "ListingCreate", "ListingUpdate", "ListingResponse", "ListingCategory", "ListingStatus",
     "LoginRequest", "RegisterRequest", "TokenResponse",
     "BaseResponse", "ErrorResponse", "SuccessResponse", "PaginatedResponse",
-    "Chat", "ChatCreate", "Message", "MessageCreate", "ChatResponse", "ChatWithMessages",
+    "Chat", "ChatCreate", "Message", "MessageCreate", "ChatResponse", "ChatWithMessages", "MessageSearchResult", "MessageSearchResponse", "UnreadCountResponse",
     "Report", "ReportCreate", "ReportResponse", "ReportType", "ReportStatus",
     "FeaturedProduct", "FeaturedProductCreate", "HomePageData", "CategoryStats"
 ]
\ No newline at end of file
@@ -45,4 +45,23 @@ class ChatWithMessages(Chat):
 
 class ChatResponse(BaseModel):
     chats: List[Chat]
-    total: int
\ No newline at end of file
+    total: int
+
+class UnreadCountResponse(BaseModel):
+    unread_total: int
+
+class MessageSearchResult(BaseModel):
+    message_id: str
+    chat_id: str
+    sender_id: str
+    text: str
+    snippet: str
+    score: float
+    created_at: datetime
+
+class MessageSearchResponse(BaseModel):
+    results: List[MessageSearchResult]
+    total: int
+    page: int
+    per_page: int
+    total_pages: int
\ No newline at end of file
@@ -70,12 +70,27 @@ class Listing(ListingBase):
     class Config:
         from_attributes = True
 
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class PriceRangeCount(BaseModel):
+    min: float
+    max: Optional[float] = None
+    count: int
+
+class ListingFacets(BaseModel):
+    categories: List[FacetCount]
+    price_ranges: List[PriceRangeCount]
+    conditions: List[FacetCount]
+
 class ListingResponse(BaseModel):
     listings: List[Listing]
     total: int
     page: int
     per_page: int
     total_pages: int
+    facets: Optional[ListingFacets] = None
 
 class PurchaseRequest(BaseModel):
     quantity: int = Field(..., ge=1, description="Quantity to purchase (must be at least 1)")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, Dict, List
 from datetime import datetime
 
 class RatingBase(BaseModel):
@@ -24,8 +24,18 @@ class Rating(RatingBase):
     class Config:
         from_attributes = True
 
+class RatingSummary(BaseModel):
+    listing_id: str
+    average_rating: Optional[float] = None
+    total_ratings: int = 0
+    distribution: Dict[str, int] = {}
+
+class RatingSummaryResponse(BaseModel):
+    summaries: List[RatingSummary]
+
 class RatingResponse(BaseModel):
     ratings: list[Rating]
     total: int
     average_rating: Optional[float] = None
-    total_ratings: int = 0
\ No newline at end of file
+    total_ratings: int = 0
+    distribution: Dict[str, int] = {}
\ No newline at end of file
@@ -36,6 +36,10 @@ class Report(ReportBase):
     class Config:
         from_attributes = True
 
+class ModerationDecision(BaseModel):
+    status: ReportStatus
+    resolution_notes: Optional[str] = None
+
 class ReportResponse(BaseModel):
     reports: List[Report]
     total: int
@@ -48,6 +48,7 @@ class User(UserBase):
     is_banned: bool = False
     is_admin: bool = False
     blocked_ids: List[str] = []
+    seller_reputation: Optional[float] = None
     created_at: datetime
     updated_at: datetime
 
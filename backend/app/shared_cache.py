@@ -0,0 +1,363 @@
+"""
+Cache shared by all workers on a host
+
+Hot read data that is the same for everyone (the home page, category stats, admin stats)
+is kept once per host instead of once per gunicorn worker. Values are pickled into a
+memory-mapped file under /dev/shm that every worker maps, so a refresh by one worker is
+what the others read next.
+
+Values are unpickled, so the file lives in SHARED_CACHE_DIR, a directory that must belong
+to the user running the API and be closed to everyone else; the segment is refused
+otherwise. The file name carries the layout, so a deploy that changes the slot settings
+maps a new file rather than resizing one that older workers still have mapped.
+
+The file is a header followed by SHARED_CACHE_SLOTS fixed-size slots. A key's hash picks
+a set of SHARED_CACHE_WAYS neighbouring slots and the key lives in one of them; storing
+into a full set evicts its least recently used slot. Every access holds an flock on the
+file, which serializes the workers for the few microseconds it takes to copy a value.
+Those calls run on a single cache thread, never on the event loop, so a worker waiting
+for the lock keeps serving requests, and the cache's operations run in the order issued.
+
+Each delete bumps a generation number in the header. get_or_load reads it before loading
+and drops its write if an invalidation happened meanwhile, so a slow load that started
+before a write cannot put the old data back for a whole TTL.
+
+Where the file cannot be used (no fcntl on Windows, SHARED_CACHE_ENABLED=false) each
+SharedCache falls back to a per-worker TTLCache.
+"""
+
+import asyncio
+import hashlib
+import mmap
+import os
+import pickle
+import stat
+import struct
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from app.cache import TTLCache
+from app.single_flight import single_flight
+
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "true").lower() == "true"
+SHARED_CACHE_DIR = os.getenv(
+    "SHARED_CACHE_DIR",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        f"campus-connect-{os.getuid()}" if hasattr(os, "getuid") else "campus-connect"
+    )
+)
+SHARED_CACHE_SLOTS = int(os.getenv("SHARED_CACHE_SLOTS", 128))
+SHARED_CACHE_SLOT_BYTES = int(os.getenv("SHARED_CACHE_SLOT_BYTES", 256 * 1024))
+SHARED_CACHE_WAYS = 8
+
+T = TypeVar("T")
+
+class SharedSegment:
+    """Set-associative LRU of pickled values in a memory-mapped file"""
+
+    MAGIC = b"CCCACHE2"
+    # magic, slot count, slot size, access clock, generation (bumped by every delete)
+    HEADER = struct.Struct("<8sIIQQ")
+    # key hash, expires at (unix time), last used (clock), key length (0 = empty), value length
+    SLOT = struct.Struct("<QdQII")
+
+    def __init__(self, directory: str, slots: int, slot_bytes: int, ways: int = SHARED_CACHE_WAYS):
+        self.directory = directory
+        self.ways = min(ways, slots)
+        self.slots = slots - slots % self.ways
+        self.slot_bytes = slot_bytes
+        self.size = self.HEADER.size + self.slots * self.slot_bytes
+        self.path = os.path.join(
+            directory, f"{self.MAGIC.decode().lower()}-{self.slots}x{self.slot_bytes}-{self.ways}way"
+        )
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    @staticmethod
+    def _check_private(path: str, st: os.stat_result) -> None:
+        """Refuse anything another local user could have created or can write to"""
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise OSError(f"{path} must be owned by uid {os.getuid()} and not accessible to others")
+
+    def _open(self) -> None:
+        """Map the file in this process, formatting it if this process created it
+
+        A descriptor inherited through fork shares its flock with the parent, so every
+        worker process opens the file itself.
+        """
+        if self._pid == os.getpid():
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        st = os.lstat(self.directory)
+        if not stat.S_ISDIR(st.st_mode):
+            raise OSError(f"{self.directory} is not a directory")
+        self._check_private(self.directory, st)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            self._check_private(self.path, os.fstat(fd))
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(fd).st_size
+                if size == 0:
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, self.HEADER.pack(self.MAGIC, self.slots, self.slot_bytes, 0, 0), 0)
+                elif size != self.size or self.HEADER.unpack(os.pread(fd, self.HEADER.size, 0))[:3] \
+                        != (self.MAGIC, self.slots, self.slot_bytes):
+                    # Never resized in place: another worker may have it mapped
+                    raise OSError(f"{self.path} has an unexpected layout")
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.size)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+    def _offset(self, slot: int) -> int:
+        return self.HEADER.size + slot * self.slot_bytes
+
+    def _read_slot(self, slot: int) -> tuple:
+        return self.SLOT.unpack_from(self._map, self._offset(slot))
+
+    def _slot_key(self, slot: int, key_length: int) -> bytes:
+        start = self._offset(slot) + self.SLOT.size
+        return self._map[start:start + key_length]
+
+    def _clear_slot(self, slot: int) -> None:
+        self.SLOT.pack_into(self._map, self._offset(slot), 0, 0.0, 0, 0, 0)
+
+    def _tick(self) -> int:
+        magic, slots, slot_bytes, clock, generation = self.HEADER.unpack_from(self._map, 0)
+        self.HEADER.pack_into(self._map, 0, magic, slots, slot_bytes, clock + 1, generation)
+        return clock + 1
+
+    def _bump_generation(self) -> None:
+        magic, slots, slot_bytes, clock, generation = self.HEADER.unpack_from(self._map, 0)
+        self.HEADER.pack_into(self._map, 0, magic, slots, slot_bytes, clock, generation + 1)
+
+    def generation(self) -> int:
+        """Counts deletes; compare before and after a load to tell whether it went stale"""
+        with self._locked():
+            return self.HEADER.unpack_from(self._map, 0)[4]
+
+    def _find(self, key: bytes, key_hash: int) -> Optional[int]:
+        first = key_hash % (self.slots // self.ways) * self.ways
+        for slot in range(first, first + self.ways):
+            slot_hash, _, _, key_length, _ = self._read_slot(slot)
+            if key_length and slot_hash == key_hash and self._slot_key(slot, key_length) == key:
+                return slot
+        return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The stored bytes for key, or None if missing or expired"""
+        key_bytes = key.encode()
+        key_hash = self._hash(key_bytes)
+        with self._locked():
+            slot = self._find(key_bytes, key_hash)
+            if slot is None:
+                return None
+            _, expires_at, _, key_length, value_length = self._read_slot(slot)
+            if expires_at <= time.time():
+                self._clear_slot(slot)
+                return None
+            self.SLOT.pack_into(
+                self._map, self._offset(slot), key_hash, expires_at, self._tick(), key_length, value_length
+            )
+            start = self._offset(slot) + self.SLOT.size + key_length
+            return self._map[start:start + value_length]
+
+    def set(self, key: str, value: bytes, ttl_seconds: float, generation: Optional[int] = None) -> bool:
+        """Store bytes for key; returns False if they do not fit in a slot
+
+        With a generation from generation(), the write is dropped if anything was deleted since.
+        """
+        key_bytes = key.encode()
+        if self.SLOT.size + len(key_bytes) + len(value) > self.slot_bytes:
+            return False
+        key_hash = self._hash(key_bytes)
+        with self._locked():
+            if generation is not None and self.HEADER.unpack_from(self._map, 0)[4] != generation:
+                return True
+            slot = self._find(key_bytes, key_hash)
+            if slot is None:
+                first = key_hash % (self.slots // self.ways) * self.ways
+                now = time.time()
+
+                def eviction_order(candidate: int):
+                    _, expires_at, last_used, key_length, _ = self._read_slot(candidate)
+                    # Empty and expired slots first, then the least recently used
+                    return (bool(key_length) and expires_at > now, last_used)
+
+                slot = min(range(first, first + self.ways), key=eviction_order)
+            offset = self._offset(slot)
+            self.SLOT.pack_into(
+                self._map, offset, key_hash, time.time() + ttl_seconds, self._tick(), len(key_bytes), len(value)
+            )
+            start = offset + self.SLOT.size
+            self._map[start:start + len(key_bytes) + len(value)] = key_bytes + value
+        return True
+
+    def delete(self, key: str) -> None:
+        key_bytes = key.encode()
+        with self._locked():
+            self._bump_generation()
+            slot = self._find(key_bytes, self._hash(key_bytes))
+            if slot is not None:
+                self._clear_slot(slot)
+
+    def delete_prefix(self, prefix: str) -> None:
+        """Drop every key starting with prefix"""
+        prefix_bytes = prefix.encode()
+        with self._locked():
+            self._bump_generation()
+            for slot in range(self.slots):
+                key_length = self._read_slot(slot)[3]
+                if key_length and self._slot_key(slot, key_length).startswith(prefix_bytes):
+                    self._clear_slot(slot)
+
+def open_shared_segment() -> Optional[SharedSegment]:
+    """The host-wide segment, or None when this platform or configuration can't share one"""
+    if not SHARED_CACHE_ENABLED or fcntl is None:
+        return None
+    segment = SharedSegment(SHARED_CACHE_DIR, SHARED_CACHE_SLOTS, SHARED_CACHE_SLOT_BYTES)
+    try:
+        segment._open()
+    except OSError as e:
+        print(f"Shared cache unavailable at {segment.path}, caching per worker: {e}")
+        return None
+    return segment
+
+shared_segment = open_shared_segment()
+
+_executor = None
+_executor_pid = None
+
+def segment_executor() -> ThreadPoolExecutor:
+    """This process's cache thread; one, so segment calls run in the order they were issued
+
+    Created per process, since a forked worker does not inherit its parent's threads.
+    """
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+        _executor_pid = os.getpid()
+    return _executor
+
+class SharedCache:
+    """One kind of cached value in the shared segment
+
+    get, set and get_or_load are coroutines. invalidate is a plain call, so invalidation
+    handlers can use it; it queues the segment delete ahead of any later cache call.
+    """
+
+    def __init__(self, namespace: str, ttl_seconds: float, segment: Optional[SharedSegment] = shared_segment):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.segment = segment
+        self._local = TTLCache(ttl_seconds)
+        # Bumped by invalidate, guarding writes to the per-worker fallback
+        self._generation = 0
+        self._pending = set()
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def _call(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(segment_executor(), method, *args)
+
+    def _call_later(self, method, *args) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            method(*args)
+            return
+        future = loop.run_in_executor(segment_executor(), method, *args)
+        self._pending.add(future)
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future) -> None:
+        self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Shared cache {self.namespace} invalidation failed: {future.exception()}")
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if it is missing or expired"""
+        data = await self._call(self.segment.get, self._key(key)) if self.segment is not None else None
+        if data is None:
+            return self._local.get(key)
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # Written by a different version of the code
+            self._call_later(self.segment.delete, self._key(key))
+            return None
+
+    async def generation(self) -> tuple:
+        """A token for set(); it changes whenever this cache may have been invalidated"""
+        if self.segment is None:
+            return (self._generation, None)
+        return (self._generation, await self._call(self.segment.generation))
+
+    async def set(self, key: str, value: Any, generation: Optional[tuple] = None) -> None:
+        """Store a value for every worker; values too large for a slot stay in this worker
+
+        Given a generation() token taken before the value was loaded, the write is dropped
+        if the cache was invalidated since.
+        """
+        local_generation, segment_generation = generation or (self._generation, None)
+        if local_generation != self._generation:
+            return
+        if self.segment is not None and await self._call(
+            self.segment.set, self._key(key), pickle.dumps(value), self.ttl_seconds, segment_generation
+        ):
+            self._local.invalidate(key)
+        elif local_generation == self._generation:
+            self._local.set(key, value)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Drop a single entry, or everything in this namespace when no key is given"""
+        self._generation += 1
+        self._local.invalidate(key)
+        if self.segment is None:
+            return
+        if key is None:
+            self._call_later(self.segment.delete_prefix, f"{self.namespace}:")
+        else:
+            self._call_later(self.segment.delete, self._key(key))
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable[T]]) -> T:
+        """Return the cached value, or run load() once in this worker and cache its result"""
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        async def load_and_store() -> T:
+            generation = await self.generation()
+            loaded = await load()
+            await self.set(key, loaded, generation)
+            return loaded
+        return await single_flight.do((self.namespace, key), load_and_store)
@@ -0,0 +1,35 @@
+"""
+Request coalescing for read endpoints
+
+When many identical reads arrive at once (a popular listing, the home page), only the
+first one runs its queries; the others in the same worker wait for and share its result
+or exception. The shared work runs as its own task, so a caller that disconnects does not
+cancel it for the rest. Nothing is kept once the work finishes; this is not a cache.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+class SingleFlight:
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable[T]]) -> T:
+        """Run load() for key, or join the run already in progress"""
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Retrieve the exception so it isn't reported as unhandled when every caller left
+        if not task.cancelled():
+            task.exception()
+
+single_flight = SingleFlight()
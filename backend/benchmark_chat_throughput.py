@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark chat send throughput
+Measures messages per second that one API worker (one event loop) can send, comparing
+the previous three-round-trip send path with the current send_message, using a scratch
+database on the configured MongoDB server. MESSAGE_STORAGE_MODE is honoured.
+
+Usage (from the backend directory):
+    python benchmark_chat_throughput.py --chats 50 --messages 5000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from types import SimpleNamespace
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.database import db, ensure_indexes, get_chats_collection
+from app.message_store import message_store
+from app.models.chat import ChatModel, MessageModel
+from app.routers.chat import send_message
+from app.schemas.chat import MessageCreate
+
+async def sequential_send(chat_id: str, user, message_data: MessageCreate) -> None:
+    """The previous send path: membership read, message insert, chat update"""
+    chats_collection = await get_chats_collection()
+    chat = await chats_collection.find_one(ChatModel.participant_filter(chat_id, user.id))
+    message_dict = MessageModel.create_message_dict(chat_id, user.id, message_data.text)
+    message_id = await message_store.insert(message_dict)
+    await chats_collection.update_one(
+        {"_id": chat["_id"]},
+        {
+            "$set": {"lastMessage": message_data.text, "lastMessageAt": message_dict["createdAt"], "lastMessageId": message_id},
+            "$inc": {f"unreadCount.{'b' if str(chat['participantAId']) == user.id else 'a'}": 1}
+        }
+    )
+
+async def current_send(chat_id: str, user, message_data: MessageCreate) -> None:
+    await send_message(chat_id, message_data, user)
+
+async def run(send, chats, total: int, concurrency: int) -> float:
+    """Send `total` messages into random chats and return messages per second"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        chat_id, sender = random.choice(chats)
+        async with semaphore:
+            await send(chat_id, sender, MessageCreate(chat_id=chat_id, text="benchmark message"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - started)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat send throughput per worker")
+    parser.add_argument("--chats", type=int, default=50, help="Chats to send into")
+    parser.add_argument("--messages", type=int, default=5000, help="Messages sent per path")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight at once")
+    parser.add_argument("--database", default=f"{os.getenv('DATABASE_NAME', 'campus_connect')}_benchmark",
+                        help="Scratch database, dropped before and after the run")
+    args = parser.parse_args()
+
+    db.client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    await db.client.drop_database(args.database)
+    db.database = db.client[args.database]
+    await ensure_indexes()
+
+    chats = []
+    chats_collection = await get_chats_collection()
+    for _ in range(args.chats):
+        user_a, user_b = str(ObjectId()), str(ObjectId())
+        result = await chats_collection.insert_one(ChatModel.create_chat_dict(user_a, user_b, "A", "B"))
+        sender = random.choice([user_a, user_b])
+        chats.append((str(result.inserted_id), SimpleNamespace(id=sender, is_admin=False, blocked_ids=[])))
+
+    print(f"{args.messages} messages into {args.chats} chats, concurrency {args.concurrency}, {message_store.mode} storage")
+    try:
+        for name, send in (("sequential", sequential_send), ("current", current_send)):
+            print(f"{name:<12} {await run(send, chats, args.messages, args.concurrency):>8.0f} messages/s per worker")
+    finally:
+        await db.client.drop_database(args.database)
+        db.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark chat message storage layouts
+Compares write and read throughput of the one-document-per-message layout against
+bucketed storage, using a scratch database on the configured MongoDB server
+
+Usage (from the backend directory):
+    python benchmark_message_storage.py --chats 20 --messages 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.database import db, ensure_indexes
+from app.message_store import DocumentMessageStore, BucketMessageStore
+from app.models.chat import MessageModel
+
+async def run_writes(store, chat_ids, messages_per_chat: int, concurrency: int) -> float:
+    """Send every message and return the elapsed seconds"""
+    sender_id = str(ObjectId())
+    queue = [chat_id for _ in range(messages_per_chat) for chat_id in chat_ids]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(chat_id):
+        async with semaphore:
+            await store.insert(MessageModel.create_message_dict(chat_id, sender_id, "benchmark message"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(chat_id) for chat_id in queue))
+    return time.perf_counter() - started
+
+async def run_reads(store, chat_ids, messages_per_chat: int, per_page: int, reads: int, concurrency: int) -> float:
+    """Fetch random history pages and return the elapsed seconds"""
+    pages = max(1, messages_per_chat // per_page)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read():
+        async with semaphore:
+            page = random.randint(1, pages)
+            await store.get_page(random.choice(chat_ids), (page - 1) * per_page, per_page)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(read() for _ in range(reads)))
+    return time.perf_counter() - started
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat message storage layouts")
+    parser.add_argument("--chats", type=int, default=20, help="Chats to write into")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages per chat")
+    parser.add_argument("--bucket-size", type=int, default=100, help="Messages per bucket")
+    parser.add_argument("--per-page", type=int, default=50, help="Messages per history page")
+    parser.add_argument("--reads", type=int, default=2000, help="History pages to fetch")
+    parser.add_argument("--concurrency", type=int, default=32, help="Operations in flight at once")
+    parser.add_argument("--database", default=f"{os.getenv('DATABASE_NAME', 'campus_connect')}_benchmark",
+                        help="Scratch database, dropped before and after the run")
+    args = parser.parse_args()
+
+    db.client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    await db.client.drop_database(args.database)
+    db.database = db.client[args.database]
+    await ensure_indexes()
+
+    total = args.chats * args.messages
+    print(f"{args.chats} chats x {args.messages} messages, pages of {args.per_page}, concurrency {args.concurrency}")
+    print(f"{'layout':<10} {'writes/s':>10} {'reads/s':>10}")
+
+    try:
+        for store in (DocumentMessageStore(), BucketMessageStore(args.bucket_size, per_day=False)):
+            chat_ids = [str(ObjectId()) for _ in range(args.chats)]
+            write_seconds = await run_writes(store, chat_ids, args.messages, args.concurrency)
+            read_seconds = await run_reads(store, chat_ids, args.messages, args.per_page, args.reads, args.concurrency)
+            print(f"{store.mode:<10} {total / write_seconds:>10.0f} {args.reads / read_seconds:>10.0f}")
+    finally:
+        await db.client.drop_database(args.database)
+        db.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
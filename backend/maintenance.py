@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the Campus Connect API
+Rebuilds derived data (analytics rollups, seller stats, ...) from the source collections
+
+Usage (from the backend directory):
+    python maintenance.py rebuild-analytics --days 30
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.browse_cache import bump_catalog_version
+from app.database import connect_to_mongo, close_mongo_connection, get_database
+from app.invalidation import invalidation_bus
+from app.models.analytics import AnalyticsModel
+from app.models.seller_stats import SellerStatsModel
+from app.models.user import UserModel
+from app.models.rating import RatingModel
+from app.models.chat import ChatModel
+from app.models.moderation import ModerationModel
+from app.message_archive import MessageArchive, MESSAGE_ARCHIVE_AFTER_DAYS, MESSAGE_ARCHIVE_SEGMENT_SIZE
+from app.message_search import MessageSearch
+from app.message_store import BucketMessageStore, MESSAGE_BUCKET_SIZE, MESSAGE_BUCKET_PER_DAY
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d")
+
+async def rebuild_analytics(args):
+    """Recompute hourly and daily analytics rollups"""
+    end = args.end or datetime.utcnow()
+    start = args.start or end - timedelta(days=args.days)
+    database = await get_database()
+    written = await AnalyticsModel.rebuild(database, start, end)
+    print(f"Rebuilt {written} analytics buckets between {start:%Y-%m-%d} and {end:%Y-%m-%d}")
+
+async def rebuild_seller_stats(args):
+    """Recompute sellerStats documents and the reputation derived from their rating totals"""
+    database = await get_database()
+    written = await SellerStatsModel.rebuild(database, args.seller_id)
+    reputation = await UserModel.rebuild_reputation(database, args.seller_id)
+    if reputation["listings"]:
+        bump_catalog_version()
+    print(f"Rebuilt stats for {written} sellers; reputation changed for {reputation['users']} users and {reputation['listings']} listings")
+
+async def rebuild_rating_stars(args):
+    """Recompute the per-listing star histograms from the ratings collection"""
+    database = await get_database()
+    updated = await RatingModel.rebuild_stars(database, args.listing_id)
+    if updated:
+        bump_catalog_version()
+    print(f"Updated star histograms on {updated} listings")
+
+async def rebuild_seller_reputation(args):
+    """Recompute sellers' Bayesian reputation from their sellerStats totals, and their listings' copies"""
+    database = await get_database()
+    reputation = await UserModel.rebuild_reputation(database, args.seller_id)
+    if reputation["listings"]:
+        bump_catalog_version()
+    print(f"Reputation changed for {reputation['users']} users and {reputation['listings']} listings")
+
+async def backfill_user_names(args):
+    """Copy every user's current name/email onto their listings, ratings and chats"""
+    database = await get_database()
+    query = {"_id": ObjectId(args.user_id)} if args.user_id else {}
+    count = 0
+    async for user in database.users.find(query, {"fullName": 1, "email": 1}):
+        await UserModel.propagate_profile(database, user["_id"], user.get("fullName"), user.get("email"))
+        count += 1
+    if count:
+        bump_catalog_version()
+    print(f"Propagated names for {count} users")
+
+async def backfill_user_keys(args):
+    """Set the normalized emailKey/userNameKey that back the unique user indexes
+
+    Users whose email or username only differs in case from an earlier user's are left
+    without the clashing key and listed, so they can be contacted and renamed.
+    """
+    database = await get_database()
+    conflicts = await UserModel.backfill_keys(database.users)
+    print(f"{len(conflicts)} user keys could not be set")
+    for user_id, field, value in conflicts:
+        print(f"  user {user_id}: {field} {value!r} is already taken")
+
+async def migrate_read_watermarks(args):
+    """Convert per-message isRead/readAt flags into per-participant chat watermarks"""
+    database = await get_database()
+    chats_updated = 0
+
+    async for chat in database.chats.find({}):
+        update = {}
+        watermarks = chat.get("readWatermarks") or {}
+    
+        # Side "a" reads what participant B sent, and vice versa
+        for key, sender_id in (("a", chat["participantBId"]), ("b", chat["participantAId"])):
+            if watermarks.get(key):
+                continue  # already migrated (or read since the deploy)
+            last_read = await database.messages.find_one(
+                {"chatId": chat["_id"], "senderId": sender_id, "isRead": True},
+                sort=[("createdAt", -1)]
+            )
+            if last_read:
+                update[f"readWatermarks.{key}"] = {
+                    "lastReadAt": last_read.get("readAt") or last_read["createdAt"],
+                    "lastReadMessageId": last_read["_id"],
+                }
+    
+        if not chat.get("lastMessageId"):
+            latest = await database.messages.find_one({"chatId": chat["_id"]}, {"_id": 1}, sort=[("createdAt", -1)])
+            if latest:
+                update["lastMessageId"] = latest["_id"]
+    
+        if update:
+            await database.chats.update_one({"_id": chat["_id"]}, {"$set": update})
+            chats_updated += 1
+
+    print(f"Set read watermarks on {chats_updated} chats")
+
+    if args.unset_message_flags:
+        flagged = {"isRead": {"$exists": True}}
+        cleared = 0
+        while True:
+            ids = [doc["_id"] async for doc in database.messages.find(flagged, {"_id": 1}).limit(args.batch_size)]
+            if not ids:
+                break
+            result = await database.messages.update_many({"_id": {"$in": ids}}, {"$unset": {"isRead": "", "readAt": ""}})
+            cleared += result.modified_count
+        print(f"Removed isRead/readAt from {cleared} messages")
+
+async def migrate_message_storage(args):
+    """Move chat messages between the one-document-per-message and bucketed layouts
+
+    Works chat by chat and only deletes source data once it has been written to the
+    target, skipping messages the target already has, so an interrupted run can simply be
+    started again. Messages sent in the new layout during the run are left alone.
+    """
+    database = await get_database()
+    store = BucketMessageStore(args.bucket_size, MESSAGE_BUCKET_PER_DAY)
+    chats_migrated = 0
+    messages_moved = 0
+
+    async for chat in database.chats.find({}, {"_id": 1}):
+        chat_id = chat["_id"]
+
+        if args.to == "bucket":
+            existing_ids = set()
+            async for bucket in database.messageBuckets.find({"chatId": chat_id}, {"messages._id": 1}):
+                existing_ids.update(message["_id"] for message in bucket.get("messages", []))
+
+            messages = await database.messages.find({"chatId": chat_id}).sort("createdAt", 1).to_list(None)
+            if not messages:
+                continue
+            pending = [message for message in messages if message["_id"] not in existing_ids]
+
+            # Group into buckets by period and size; migrated buckets are closed so new
+            # messages always open a bucket of their own
+            buckets = []
+            for message in pending:
+                current = buckets[-1] if buckets else None
+                if (
+                    current is None
+                    or len(current) >= store.bucket_size
+                    or store.period_for(current[0]["createdAt"]) != store.period_for(message["createdAt"])
+                ):
+                    buckets.append([message])
+                else:
+                    current.append(message)
+
+            if buckets:
+                await database.messageBuckets.insert_many(
+                    [store.create_bucket_dict(chat_id, bucket, is_full=True) for bucket in buckets]
+                )
+            await database.messages.delete_many({"_id": {"$in": [message["_id"] for message in messages]}})
+            messages_moved += len(pending)
+        else:
+            buckets = await database.messageBuckets.find({"chatId": chat_id}).to_list(None)
+            if not buckets:
+                continue
+            messages = [message for bucket in buckets for message in BucketMessageStore.unpack(bucket)]
+            existing_ids = {
+                doc["_id"] async for doc in database.messages.find(
+                    {"_id": {"$in": [message["_id"] for message in messages]}}, {"_id": 1}
+                )
+            }
+            pending = [message for message in messages if message["_id"] not in existing_ids]
+            if pending:
+                await database.messages.insert_many(pending)
+            await database.messageBuckets.delete_many({"_id": {"$in": [bucket["_id"] for bucket in buckets]}})
+            messages_moved += len(pending)
+
+        chats_migrated += 1
+
+    print(f"Moved {messages_moved} messages in {chats_migrated} chats to {args.to} storage")
+
+async def dedupe_chats(args):
+    """Merge duplicate chats between the same two users and backfill pairKey/participantIds
+
+    The oldest chat of each pair is kept. Messages from the duplicates are moved onto it,
+    unread counts are added up and the latest read watermarks and last message win.
+    """
+    database = await get_database()
+    pairs = {}
+    async for chat in database.chats.find({}).sort("createdAt", 1):
+        key = ChatModel.pair_key(chat["participantAId"], chat["participantBId"])
+        pairs.setdefault(key, []).append(chat)
+
+    merged = 0
+    backfilled = 0
+    for key, chats in pairs.items():
+        # Keep a chat that already owns the pair key (created after the unique index), else the oldest
+        keeper = next((chat for chat in chats if chat.get("pairKey") == key), chats[0])
+        duplicates = [chat for chat in chats if chat is not keeper]
+        update = {
+            "pairKey": key,
+            "participantIds": [keeper["participantAId"], keeper["participantBId"]],
+        }
+        unread = dict(keeper.get("unreadCount") or {"a": 0, "b": 0})
+        watermarks = dict(keeper.get("readWatermarks") or {"a": None, "b": None})
+        latest = keeper
+        archived_count = keeper.get("archivedCount", 0)
+
+        for duplicate in duplicates:
+            # The same user may be participant A in one duplicate and B in another
+            swapped = duplicate["participantAId"] != keeper["participantAId"]
+            for side in ("a", "b"):
+                dup_side = {"a": "b", "b": "a"}[side] if swapped else side
+                unread[side] = unread.get(side, 0) + (duplicate.get("unreadCount") or {}).get(dup_side, 0)
+                dup_mark = (duplicate.get("readWatermarks") or {}).get(dup_side)
+                if dup_mark and (not watermarks.get(side) or dup_mark["lastReadAt"] > watermarks[side]["lastReadAt"]):
+                    watermarks[side] = dup_mark
+            if (duplicate.get("lastMessageAt") or datetime.min) > (latest.get("lastMessageAt") or datetime.min):
+                latest = duplicate
+
+            await database.messages.update_many({"chatId": duplicate["_id"]}, {"$set": {"chatId": keeper["_id"]}})
+            await database.messageArchive.update_many({"chatId": duplicate["_id"]}, {"$set": {"chatId": keeper["_id"]}})
+            await database.messageSearch.update_many({"chatId": duplicate["_id"]}, {"$set": {"chatId": keeper["_id"]}})
+            archived_count += duplicate.get("archivedCount", 0)
+            # Moved buckets are closed so they cannot clash with the keeper's open bucket
+            await database.messageBuckets.update_many(
+                {"chatId": duplicate["_id"]},
+                {"$set": {"chatId": keeper["_id"], "full": True}}
+            )
+
+        if duplicates:
+            update.update({
+                "unreadCount": unread,
+                "archivedCount": archived_count,
+                "readWatermarks": watermarks,
+                "lastMessage": latest.get("lastMessage"),
+                "lastMessageAt": latest.get("lastMessageAt"),
+                "lastMessageId": latest.get("lastMessageId"),
+            })
+        elif keeper.get("pairKey") == key and keeper.get("participantIds"):
+            continue
+
+        await database.chats.update_one({"_id": keeper["_id"]}, {"$set": update})
+        if duplicates:
+            await database.chats.delete_many({"_id": {"$in": [duplicate["_id"] for duplicate in duplicates]}})
+            merged += len(duplicates)
+        else:
+            backfilled += 1
+
+    print(f"Merged {merged} duplicate chats and backfilled pair keys on {backfilled} chats")
+
+async def dedupe_reports_ratings(args):
+    """Delete repeat reports and ratings by the same user, keeping each user's first one
+
+    Needed once before the unique report/rating indexes can be built; the seller stats,
+    star histograms, reputation and the moderation queue are rebuilt afterwards when
+    anything was removed.
+    """
+    database = await get_database()
+    removed = {}
+    for collection, keys in ((database.reports, ("reporterId", "targetId", "type")), (database.ratings, ("listingId", "userId"))):
+        pipeline = [
+            {"$sort": {"createdAt": 1, "_id": 1}},
+            {"$group": {"_id": {key: f"${key}" for key in keys}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ]
+        duplicate_ids = [
+            duplicate_id
+            async for group in collection.aggregate(pipeline, allowDiskUse=True)
+            for duplicate_id in group["ids"][1:]
+        ]
+        for i in range(0, len(duplicate_ids), 1000):
+            await collection.delete_many({"_id": {"$in": duplicate_ids[i:i + 1000]}})
+        removed[collection.name] = len(duplicate_ids)
+
+    if removed["ratings"]:
+        await SellerStatsModel.rebuild(database)
+        await RatingModel.rebuild_stars(database)
+        await UserModel.rebuild_reputation(database)
+        bump_catalog_version()
+    if removed["reports"]:
+        await ModerationModel.rebuild(database)
+    print(f"Removed {removed['reports']} duplicate reports and {removed['ratings']} duplicate ratings")
+
+async def dedupe_pending_jobs(args):
+    """Delete extra pending copies of deduplicated jobs, keeping the one due first
+
+    Needed once before the unique pending-dedupeKey index can be built.
+    """
+    database = await get_database()
+    pipeline = [
+        {"$match": {"status": "pending", "dedupeKey": {"$type": "string"}}},
+        {"$sort": {"runAt": 1, "_id": 1}},
+        {"$group": {"_id": "$dedupeKey", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    duplicate_ids = [
+        duplicate_id
+        async for group in database.jobs.aggregate(pipeline, allowDiskUse=True)
+        for duplicate_id in group["ids"][1:]
+    ]
+    for i in range(0, len(duplicate_ids), 1000):
+        await database.jobs.delete_many({"_id": {"$in": duplicate_ids[i:i + 1000]}})
+    print(f"Removed {len(duplicate_ids)} duplicate pending jobs")
+
+async def archive_messages(args):
+    """Move chat messages older than the given age into the compressed archive"""
+    result = await MessageArchive.archive_older_than(args.older_than_days, args.segment_size)
+    print(f"Archived {result['messages']} messages from {result['chats']} chats")
+
+async def rebuild_message_search(args):
+    """Re-index chat messages for search"""
+    database = await get_database()
+    indexed = await MessageSearch.rebuild(database, args.chat_id)
+    print(f"Indexed {indexed} messages for search")
+
+async def rebuild_unread_totals(args):
+    """Recompute every user's unread message total from their chats' unread counters
+
+    Chats between users who block each other (in either direction) are flagged `blocked`
+    again from the block lists and left out, as the chat list hides them.
+    """
+    database = await get_database()
+    blocked_pairs = set()
+    async for user in database.users.find({"blockedIds.0": {"$exists": True}}, {"blockedIds": 1}):
+        for blocked_id in user["blockedIds"]:
+            blocked_pairs.add(frozenset([user["_id"], blocked_id]))
+
+    totals = {}
+    flag_operations = []
+    projection = {"participantAId": 1, "participantBId": 1, "unreadCount": 1, "blocked": 1}
+    async for chat in database.chats.find({}, projection):
+        blocked = frozenset([chat["participantAId"], chat["participantBId"]]) in blocked_pairs
+        if blocked != bool(chat.get("blocked")):
+            update = {"$set": {"blocked": True}} if blocked else {"$unset": {"blocked": ""}}
+            flag_operations.append(UpdateOne({"_id": chat["_id"]}, update))
+        if blocked:
+            continue
+        unread = chat.get("unreadCount") or {}
+        for key, user_id in (("a", chat["participantAId"]), ("b", chat["participantBId"])):
+            totals[user_id] = totals.get(user_id, 0) + unread.get(key, 0)
+    for i in range(0, len(flag_operations), 500):
+        await database.chats.bulk_write(flag_operations[i:i + 500], ordered=False)
+
+    await database.users.update_many({"unreadTotal": {"$ne": 0}}, {"$set": {"unreadTotal": 0}})
+    operations = [UpdateOne({"_id": user_id}, {"$set": {"unreadTotal": total}}) for user_id, total in totals.items() if total]
+    for i in range(0, len(operations), 500):
+        await database.users.bulk_write(operations[i:i + 500], ordered=False)
+    print(f"Rebuilt unread totals for {len(operations)} users with unread messages")
+
+async def rebuild_moderation_queue(args):
+    """Recompute the moderation queue from the reports collection"""
+    database = await get_database()
+    written = await ModerationModel.rebuild(database)
+    print(f"Rebuilt {written} moderation queue entries")
+
+COMMANDS = {
+    "rebuild-analytics": rebuild_analytics,
+    "rebuild-seller-stats": rebuild_seller_stats,
+    "rebuild-rating-stars": rebuild_rating_stars,
+    "rebuild-seller-reputation": rebuild_seller_reputation,
+    "backfill-user-names": backfill_user_names,
+    "backfill-user-keys": backfill_user_keys,
+    "migrate-read-watermarks": migrate_read_watermarks,
+    "migrate-message-storage": migrate_message_storage,
+    "dedupe-chats": dedupe_chats,
+    "dedupe-reports-ratings": dedupe_reports_ratings,
+    "dedupe-pending-jobs": dedupe_pending_jobs,
+    "archive-messages": archive_messages,
+    "rebuild-message-search": rebuild_message_search,
+    "rebuild-unread-totals": rebuild_unread_totals,
+    "rebuild-moderation-queue": rebuild_moderation_queue,
+}
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Campus Connect maintenance tool")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    analytics_parser = subparsers.add_parser("rebuild-analytics", help="Rebuild analytics rollups")
+    analytics_parser.add_argument("--start", type=parse_date, help="First day to rebuild (YYYY-MM-DD)")
+    analytics_parser.add_argument("--end", type=parse_date, help="Day to stop before (YYYY-MM-DD), defaults to now")
+    analytics_parser.add_argument("--days", type=int, default=30, help="Days to rebuild when --start is omitted")
+
+    seller_stats_parser = subparsers.add_parser("rebuild-seller-stats", help="Rebuild per-seller dashboard stats")
+    seller_stats_parser.add_argument("--seller-id", help="Only rebuild this seller")
+
+    stars_parser = subparsers.add_parser("rebuild-rating-stars", help="Rebuild per-listing rating star histograms")
+    stars_parser.add_argument("--listing-id", help="Only rebuild this listing")
+
+    reputation_parser = subparsers.add_parser("rebuild-seller-reputation", help="Rebuild seller reputation scores used for ranking")
+    reputation_parser.add_argument("--seller-id", help="Only rebuild this seller")
+
+    names_parser = subparsers.add_parser("backfill-user-names", help="Refresh denormalized user names on listings, ratings and chats")
+    names_parser.add_argument("--user-id", help="Only backfill this user")
+
+    subparsers.add_parser("backfill-user-keys", help="Set the normalized email/username keys used for uniqueness")
+
+    watermarks_parser = subparsers.add_parser("migrate-read-watermarks", help="Move message read flags to chat read watermarks")
+    watermarks_parser.add_argument("--unset-message-flags", action="store_true", help="Also strip isRead/readAt from messages afterwards")
+    watermarks_parser.add_argument("--batch-size", type=int, default=1000, help="Messages updated per batch")
+
+    storage_parser = subparsers.add_parser("migrate-message-storage", help="Move chat messages to another storage layout")
+    storage_parser.add_argument("--to", choices=["bucket", "document"], required=True, help="Target layout (match MESSAGE_STORAGE_MODE)")
+    storage_parser.add_argument("--bucket-size", type=int, default=MESSAGE_BUCKET_SIZE, help="Messages per migrated bucket")
+
+    subparsers.add_parser("dedupe-chats", help="Merge duplicate chats and backfill canonical pair keys")
+
+    subparsers.add_parser("dedupe-reports-ratings", help="Delete repeat reports and ratings by the same user")
+
+    subparsers.add_parser("dedupe-pending-jobs", help="Delete extra pending copies of deduplicated background jobs")
+
+    archive_parser = subparsers.add_parser("archive-messages", help="Move old chat messages to the archive")
+    archive_parser.add_argument("--older-than-days", type=int, default=MESSAGE_ARCHIVE_AFTER_DAYS, help="Archive messages older than this")
+    archive_parser.add_argument("--segment-size", type=int, default=MESSAGE_ARCHIVE_SEGMENT_SIZE, help="Messages per archive segment")
+
+    search_parser = subparsers.add_parser("rebuild-message-search", help="Rebuild the chat message search index")
+    search_parser.add_argument("--chat-id", help="Only re-index this chat")
+
+    subparsers.add_parser("rebuild-unread-totals", help="Recompute users' unread message totals")
+
+    subparsers.add_parser("rebuild-moderation-queue", help="Rebuild per-target report aggregates for the admin queue")
+
+    return parser
+
+async def main():
+    args = build_parser().parse_args()
+
+    await connect_to_mongo()
+    # Commands that change listings tell the running API workers to drop their cached pages
+    await invalidation_bus.start()
+    try:
+        await COMMANDS[args.command](args)
+    except Exception as e:
+        print(f"{args.command} failed: {e}")
+        sys.exit(1)
+    finally:
+        await invalidation_bus.stop()
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -40,9 +40,11 @@ class DatabaseBackup:
             "categories", 
             "chats",
             "messages",
+            "messageBuckets",
             "reports",
             "featuredProducts",
-            "ratings"
+            "ratings",
+            "transactions"
         ]
     
     async def connect(self):